@@ -0,0 +1,200 @@
+"""
+Модуль для работы с реестром сгенерированных медиа
+Хранит Telegram file_id каждого отправленного результата, чтобы повторно
+отправлять видео/фото без загрузки файла (история, пересылка админом, «отправить ещё раз»)
+"""
+
+import os
+import sqlite3
+import logging
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+
+log = logging.getLogger("db_media")
+
+MEDIA_COLUMNS = ["id", "user_id", "feature", "kind", "file_id", "file_unique_id", "prompt", "job_id", "created_at"]
+
+def db_conn():
+    """Получить соединение с базой данных"""
+    database_url = os.getenv("DATABASE_URL")
+
+    if database_url and database_url.startswith("postgresql://"):
+        # PostgreSQL для Railway
+        try:
+            import psycopg2
+            conn = psycopg2.connect(database_url)
+            return conn
+        except Exception as e:
+            log.warning(f"PostgreSQL connection failed: {e}, falling back to SQLite")
+
+    # SQLite для локальной разработки
+    db_path = os.getenv("DATABASE_URL", "sqlite:///./babka_bot.db").replace("sqlite:///", "")
+    return sqlite3.connect(db_path)
+
+def _is_postgres(conn) -> bool:
+    return 'psycopg2' in str(type(conn))
+
+def _q(conn, query: str) -> str:
+    """Подставить плейсхолдеры под тип базы данных"""
+    return query if _is_postgres(conn) else query.replace("%s", "?")
+
+def init_media_table():
+    """Инициализация таблицы реестра медиа"""
+    with db_conn() as conn:
+        cur = conn.cursor()
+
+        if _is_postgres(conn):
+            # PostgreSQL синтаксис для Railway
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS generated_media (
+                    id SERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL,
+                    feature TEXT,
+                    kind TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    prompt TEXT,
+                    job_id TEXT,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+            """)
+        else:
+            # SQLite синтаксис для локальной разработки
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS generated_media (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    feature TEXT,
+                    kind TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    file_unique_id TEXT,
+                    prompt TEXT,
+                    job_id TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+        # Индекс под keyset-пагинацию: WHERE user_id = ? AND id < ? ORDER BY id DESC
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_generated_media_user_id
+            ON generated_media(user_id, id)
+        """)
+
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_generated_media_unique_id
+            ON generated_media(file_unique_id)
+        """)
+
+        conn.commit()
+        log.info("Generated media table initialized successfully")
+
+def insert_media(user_id: int, kind: str, file_id: str, file_unique_id: Optional[str] = None,
+                 feature: Optional[str] = None, prompt: Optional[str] = None,
+                 job_id: Optional[str] = None) -> Optional[int]:
+    """
+    Записать отправленное медиа в реестр
+
+    Args:
+        user_id: ID пользователя
+        kind: Тип медиа (video, photo, document)
+        file_id: Telegram file_id
+        file_unique_id: Telegram file_unique_id
+        feature: Функция, которая сгенерировала медиа
+        prompt: Промт/описание задачи
+        job_id: ID задачи
+
+    Returns:
+        ID записи или None при ошибке
+    """
+    try:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            params = (user_id, feature, kind, file_id, file_unique_id, prompt, job_id, datetime.now())
+
+            if _is_postgres(conn):
+                cur.execute("""
+                    INSERT INTO generated_media
+                    (user_id, feature, kind, file_id, file_unique_id, prompt, job_id, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                """, params)
+                media_id = cur.fetchone()[0]
+            else:
+                cur.execute("""
+                    INSERT INTO generated_media
+                    (user_id, feature, kind, file_id, file_unique_id, prompt, job_id, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, params)
+                media_id = cur.lastrowid
+
+            conn.commit()
+            log.debug(f"Media {media_id} registered for user {user_id}: {kind}/{feature}")
+            return media_id
+
+    except Exception as e:
+        log.error(f"Failed to insert media record for user {user_id}: {e}")
+        return None
+
+def get_media(media_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Получить запись реестра по ID
+
+    Args:
+        media_id: ID записи
+
+    Returns:
+        Словарь с записью или None
+    """
+    try:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(_q(conn, f"""
+                SELECT {", ".join(MEDIA_COLUMNS)}
+                FROM generated_media
+                WHERE id = %s
+            """), (media_id,))
+            row = cur.fetchone()
+            return dict(zip(MEDIA_COLUMNS, row)) if row else None
+
+    except Exception as e:
+        log.error(f"Failed to get media {media_id}: {e}")
+        return None
+
+def get_user_media(user_id: int, limit: int = 10, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Получить медиа пользователя (от новых к старым) с keyset-пагинацией
+
+    Args:
+        user_id: ID пользователя
+        limit: Количество записей на странице
+        before_id: Курсор — вернуть записи с id меньше этого (None — первая страница)
+
+    Returns:
+        Список записей
+    """
+    try:
+        with db_conn() as conn:
+            cur = conn.cursor()
+
+            if before_id is None:
+                cur.execute(_q(conn, f"""
+                    SELECT {", ".join(MEDIA_COLUMNS)}
+                    FROM generated_media
+                    WHERE user_id = %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                """), (user_id, limit))
+            else:
+                cur.execute(_q(conn, f"""
+                    SELECT {", ".join(MEDIA_COLUMNS)}
+                    FROM generated_media
+                    WHERE user_id = %s AND id < %s
+                    ORDER BY id DESC
+                    LIMIT %s
+                """), (user_id, before_id, limit))
+
+            return [dict(zip(MEDIA_COLUMNS, row)) for row in cur.fetchall()]
+
+    except Exception as e:
+        log.error(f"Failed to get media history for user {user_id}: {e}")
+        return []
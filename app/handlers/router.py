@@ -164,14 +164,50 @@ async def handle_menu_profile(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Профиль пользователя"""
     await handle_nav(update, context, cb)
 
+MEDIA_KIND_ICONS = {"video": "🎬", "photo": "🖼️", "document": "📎"}
+
 @on_action(Actions.MENU_HISTORY)
 async def handle_menu_history(update: Update, context: ContextTypes.DEFAULT_TYPE, cb):
-    """История генераций"""
+    """История генераций (cb.id — курсор keyset-пагинации)"""
     call = update.callback_query
-    await call.message.edit_text(
-        t("btn.history"),
-        reply_markup=build_home_keyboard()
-    )
+    from app.services import media_registry
+
+    before_id = int(cb.id) if cb.id and cb.id.isdigit() else None
+    items, next_cursor = media_registry.history_page(call.from_user.id, before_id=before_id)
+
+    if not items and before_id is None:
+        await call.message.edit_text(t("history.empty"), reply_markup=build_home_keyboard())
+        return
+
+    kb = []
+    for item in items:
+        icon = MEDIA_KIND_ICONS.get(item.get("kind"), "📎")
+        created = str(item.get("created_at") or "")[:16]
+        label = (item.get("prompt") or item.get("feature") or "")[:30]
+        kb.append([InlineKeyboardButton(
+            f"{icon} {created} {label}".strip(),
+            callback_data=Cb(Actions.MEDIA_RESEND, str(item["id"])).pack()
+        )])
+    if next_cursor:
+        kb.append([InlineKeyboardButton(t("btn.history_more"),
+                                        callback_data=Cb(Actions.MENU_HISTORY, str(next_cursor)).pack())])
+    kb.append([InlineKeyboardButton(t("btn.home"), callback_data=Cb(Actions.NAV, "root").pack())])
+
+    await call.message.edit_text(t("history.title"), reply_markup=InlineKeyboardMarkup(kb))
+
+@on_action(Actions.MEDIA_RESEND)
+async def handle_media_resend(update: Update, context: ContextTypes.DEFAULT_TYPE, cb):
+    """Повторная отправка результата по file_id (без загрузки файла)"""
+    call = update.callback_query
+    from app.services import media_registry
+
+    record = media_registry.get_media(int(cb.id)) if cb.id and cb.id.isdigit() else None
+    if not record or record["user_id"] != call.from_user.id:
+        await call.message.reply_text(t("history.not_found"))
+        return
+
+    await media_registry.send_media(context.bot, call.message.chat_id, record,
+                                    caption=record.get("prompt"))
 
 # === ПЛАТЕЖИ И ТАРИФЫ ===
 
@@ -0,0 +1,506 @@
+# gpt_client.py
+# Асинхронный шлюз к OpenAI для сценарных хелперов:
+# - один общий AsyncOpenAI с общим пулом HTTP-соединений
+# - семафор ограничивает число одновременных запросов
+# - тайм-аут на каждый вызов
+# - метрики: задержки (p50/p95), токены, ошибки и тайм-ауты
+# - кэш ответов (LRU в памяти + опционально SQLite) для детерминированных вызовов
+# - хеджирование: если GPT не уложился в дедлайн по p95, отдаём локальный шаблон
+# - потоковые ответы: текст отдаётся по мере генерации (для прогрессивного редактирования сообщений)
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.services import executors
+
+log = logging.getLogger("gpt-client")
+
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "8"))
+GPT_TIMEOUT = float(os.getenv("GPT_TIMEOUT", "30"))
+GPT_POOL_SIZE = int(os.getenv("GPT_POOL_SIZE", "20"))
+LATENCY_WINDOW = 500  # сколько последних вызовов держим для перцентилей
+GPT_CACHE_SIZE = int(os.getenv("GPT_CACHE_SIZE", "1000"))  # записей в памяти
+GPT_CACHE_TTL = int(os.getenv("GPT_CACHE_TTL", str(24 * 3600)))  # секунд
+GPT_CACHE_DB = os.getenv("GPT_CACHE_DB", "")  # путь к SQLite; пусто — только память
+GPT_CACHE_MAX_TEMPERATURE = float(os.getenv("GPT_CACHE_MAX_TEMPERATURE", "0.5"))
+GPT_HEDGE_DEFAULT = float(os.getenv("GPT_HEDGE_DEFAULT", "8"))  # дедлайн, пока мало замеров
+GPT_HEDGE_MIN = float(os.getenv("GPT_HEDGE_MIN", "2"))
+GPT_HEDGE_MAX = float(os.getenv("GPT_HEDGE_MAX", "15"))
+GPT_HEDGE_FACTOR = float(os.getenv("GPT_HEDGE_FACTOR", "1.0"))  # дедлайн = p95 * factor
+HEDGE_MIN_SAMPLES = 20
+LATE_RESULTS_SIZE = 200  # опоздавшие ответы GPT, ждущие следующего такого же запроса
+
+_api_key: Optional[str] = None
+_model: str = "gpt-4o-mini"
+# Клиент и семафор привязаны к event loop. Loop-ов немного и все долгоживущие:
+# обработчик апдейтов (polling или один loop webhook-сервера) и потоки спекуляций
+# и пула сцен. Loop, который закрывается, сначала вызывает aclose()
+_clients: Dict[int, Tuple[asyncio.AbstractEventLoop, AsyncOpenAI, asyncio.Semaphore]] = {}
+
+_latencies: deque = deque(maxlen=LATENCY_WINDOW)
+_label_latencies: Dict[str, deque] = {}
+_first_token_latencies: deque = deque(maxlen=LATENCY_WINDOW)
+_stats: Dict[str, int] = {
+    "calls": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "truncated": 0,
+    "in_flight": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "hedged": 0,
+    "fallbacks": 0,
+    "late_used": 0,
+    "streams": 0,
+}
+
+_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_db_ready = False
+_late_results: "OrderedDict[str, str]" = OrderedDict()
+
+# Счётчики меняются из разных потоков: обработчики, спекуляции, фоновый пул сцен
+_stats_lock = threading.Lock()
+
+def _count(name: str, value: int = 1):
+    with _stats_lock:
+        _stats[name] += value
+
+def configure(api_key: Optional[str], model: str) -> bool:
+    """Задать ключ и модель. Клиент создаётся лениво при первом запросе."""
+    global _api_key, _model
+    _api_key = api_key or None
+    _model = model
+    _clients.clear()
+    return is_configured()
+
+def is_configured() -> bool:
+    return bool(_api_key)
+
+def _get_client() -> Tuple[AsyncOpenAI, asyncio.Semaphore]:
+    loop = asyncio.get_running_loop()
+    entry = _clients.get(id(loop))
+    if entry is None or entry[0] is not loop:
+        # Loop закрыли без aclose(): закрыть его клиент уже нечем, соединения утекли
+        for key in [k for k, (l, _, _) in _clients.items() if l.is_closed()]:
+            _clients.pop(key, None)
+            log.warning("GPT client of a closed event loop dropped without aclose()")
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=GPT_POOL_SIZE,
+                                max_keepalive_connections=GPT_POOL_SIZE),
+            timeout=GPT_TIMEOUT,
+        )
+        # Повторы делает вызывающий код (через фолбэки), поэтому max_retries=0
+        client = AsyncOpenAI(api_key=_api_key, http_client=http_client, max_retries=0)
+        entry = (loop, client, asyncio.Semaphore(GPT_MAX_CONCURRENCY))
+        _clients[id(loop)] = entry
+    return entry[1], entry[2]
+
+async def aclose():
+    """Закрыть клиент текущего event loop (вызывать перед закрытием loop)"""
+    entry = _clients.pop(id(asyncio.get_running_loop()), None)
+    if entry is not None:
+        await entry[1].close()
+
+# -----------------------------------------------------------------------------
+# КЭШ ОТВЕТОВ
+# -----------------------------------------------------------------------------
+def _cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+               response_format: Optional[Dict[str, Any]] = None) -> str:
+    raw = json.dumps([model, messages, temperature, max_tokens, response_format],
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _db_conn():
+    global _cache_db_ready
+    conn = sqlite3.connect(GPT_CACHE_DB)
+    if not _cache_db_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS gpt_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+        _cache_db_ready = True
+    return conn
+
+def _db_get(key: str) -> Optional[Tuple[float, str]]:
+    try:
+        with _db_conn() as conn:
+            row = conn.execute("SELECT expires_at, value FROM gpt_cache WHERE key = ?", (key,)).fetchone()
+            return (row[0], row[1]) if row else None
+    except Exception as e:
+        log.warning("GPT cache read failed: %s", e)
+        return None
+
+def _db_put(key: str, expires_at: float, value: str):
+    try:
+        with _db_conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO gpt_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, value, expires_at))
+            conn.execute("DELETE FROM gpt_cache WHERE expires_at < ?", (time.time(),))
+    except Exception as e:
+        log.warning("GPT cache write failed: %s", e)
+
+def _memory_put(key: str, expires_at: float, value: str):
+    with _cache_lock:
+        _cache[key] = (expires_at, value)
+        _cache.move_to_end(key)
+        while len(_cache) > GPT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+async def cache_get(key: str) -> Optional[str]:
+    now = time.time()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            _cache.move_to_end(key)
+            return entry[1]
+        if entry:
+            _cache.pop(key, None)
+    if GPT_CACHE_DB:
+        entry = await executors.run("db", _db_get, key)
+        if entry and entry[0] > now:
+            _memory_put(key, entry[0], entry[1])
+            return entry[1]
+    return None
+
+async def cache_put(key: str, value: str, ttl: int = GPT_CACHE_TTL):
+    expires_at = time.time() + ttl
+    _memory_put(key, expires_at, value)
+    if GPT_CACHE_DB:
+        await executors.run("db", _db_put, key, expires_at, value)
+
+# -----------------------------------------------------------------------------
+# ЗАПРОСЫ
+# -----------------------------------------------------------------------------
+async def chat(messages: List[Dict[str, str]], temperature: float = 0.65, max_tokens: int = 220,
+               timeout: Optional[float] = None, model: Optional[str] = None,
+               cache_max_temperature: Optional[float] = None,
+               response_format: Optional[Dict[str, Any]] = None, label: Optional[str] = None) -> Optional[str]:
+    """
+    Выполнить chat completion
+
+    Args:
+        cache_max_temperature: включить кэш для этого вызова, если temperature не выше
+            порога (None — без кэша). Одинаковые запросы отдаются из кэша без токенов.
+        response_format: структурированный ответ (например, JSON schema)
+
+    Returns:
+        Текст ответа или None (GPT не настроен, ошибка, тайм-аут)
+    """
+    if not is_configured():
+        return None
+
+    model = model or _model
+    key = None
+    if cache_max_temperature is not None and temperature <= cache_max_temperature:
+        key = _cache_key(model, messages, temperature, max_tokens, response_format)
+        cached = await cache_get(key)
+        if cached is not None:
+            _count("cache_hits")
+            return cached
+        _count("cache_misses")
+
+    text = await _request(messages, temperature, max_tokens, timeout, model, label, response_format)
+    if key and text:
+        await cache_put(key, text)
+    return text
+
+async def _request(messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                   timeout: Optional[float], model: str, label: Optional[str] = None,
+                   response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    client, semaphore = _get_client()
+    timeout = timeout or GPT_TIMEOUT
+    started = None
+    extra = {"response_format": response_format} if response_format else {}
+    try:
+        async with semaphore:
+            _count("in_flight")
+            started = time.monotonic()
+            try:
+                r = await asyncio.wait_for(
+                    client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        **extra,
+                    ),
+                    timeout=timeout,
+                )
+            finally:
+                _count("in_flight", -1)
+                elapsed = time.monotonic() - started
+                _latencies.append(elapsed)
+                if label:
+                    _label_latencies.setdefault(label, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+                _count("calls")
+
+        usage = getattr(r, "usage", None)
+        if usage:
+            _count("prompt_tokens", usage.prompt_tokens or 0)
+            _count("completion_tokens", usage.completion_tokens or 0)
+        choice = r.choices[0]
+        if choice.finish_reason == "length":
+            # Ответ обрезан по max_tokens: это не сбой модели, считаем отдельно от ошибок
+            _count("truncated")
+            log.warning("GPT answer truncated at max_tokens=%d (%s)", max_tokens, label or "-")
+            if response_format:
+                # Обрезанный JSON не разобрать
+                return None
+        return choice.message.content or ""
+
+    except asyncio.TimeoutError:
+        _count("timeouts")
+        log.warning("GPT timeout after %.1fs", timeout)
+        return None
+    except Exception as e:
+        _count("errors")
+        log.error("GPT error: %s", e)
+        return None
+
+async def stream(messages: List[Dict[str, str]], temperature: float = 0.65, max_tokens: int = 220,
+                 on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+                 timeout: Optional[float] = None, model: Optional[str] = None,
+                 cache_max_temperature: Optional[float] = None, label: Optional[str] = None) -> Optional[str]:
+    """
+    Потоковый chat completion
+
+    Args:
+        on_delta: вызывается с накопленным текстом после каждого фрагмента;
+            ошибки колбэка не прерывают генерацию. При попадании в кэш не вызывается.
+
+    Returns:
+        Полный текст ответа или None (GPT не настроен, ошибка, тайм-аут)
+    """
+    if not is_configured():
+        return None
+
+    model = model or _model
+    key = None
+    if cache_max_temperature is not None and temperature <= cache_max_temperature:
+        key = _cache_key(model, messages, temperature, max_tokens)
+        cached = await cache_get(key)
+        if cached is not None:
+            _count("cache_hits")
+            return cached
+        _count("cache_misses")
+
+    text = await _request_stream(messages, temperature, max_tokens, timeout, model, label, on_delta)
+    if key and text:
+        await cache_put(key, text)
+    return text
+
+async def _request_stream(messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                          timeout: Optional[float], model: str, label: Optional[str],
+                          on_delta: Optional[Callable[[str], Awaitable[None]]]) -> Optional[str]:
+    client, semaphore = _get_client()
+    timeout = timeout or GPT_TIMEOUT
+    parts: List[str] = []
+
+    async def consume(started: float) -> str:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in response:
+            usage = getattr(chunk, "usage", None)
+            if usage:
+                _count("prompt_tokens", usage.prompt_tokens or 0)
+                _count("completion_tokens", usage.completion_tokens or 0)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                _first_token_latencies.append(time.monotonic() - started)
+            parts.append(delta)
+            if on_delta:
+                try:
+                    await on_delta("".join(parts))
+                except Exception as e:
+                    log.debug("Stream callback failed: %s", e)
+        return "".join(parts)
+
+    try:
+        async with semaphore:
+            _count("in_flight")
+            started = time.monotonic()
+            try:
+                # Тайм-аут на весь поток, а не на первый фрагмент
+                return await asyncio.wait_for(consume(started), timeout=timeout)
+            finally:
+                _count("in_flight", -1)
+                elapsed = time.monotonic() - started
+                _latencies.append(elapsed)
+                if label:
+                    _label_latencies.setdefault(label, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+                _count("calls")
+                _count("streams")
+
+    except asyncio.TimeoutError:
+        _count("timeouts")
+        log.warning("GPT stream timeout after %.1fs (%d chunks received)", timeout, len(parts))
+        return None
+    except Exception as e:
+        _count("errors")
+        log.error("GPT stream error: %s", e)
+        return None
+
+async def complete(system: str, user: str, temperature: float = 0.65, max_tokens: int = 220,
+                   timeout: Optional[float] = None,
+                   cache_max_temperature: Optional[float] = None,
+                   label: Optional[str] = None) -> Optional[str]:
+    """Запрос в формате system + user"""
+    return await chat(
+        [{"role": "system", "content": system},
+         {"role": "user", "content": user}],
+        temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+        cache_max_temperature=cache_max_temperature, label=label,
+    )
+
+async def complete_json(system: str, user: str, schema: Dict[str, Any], name: str,
+                        temperature: float = 0.65, max_tokens: int = 400,
+                        timeout: Optional[float] = None, label: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Структурированный запрос: ответ строго по JSON schema одним вызовом
+
+    Returns:
+        Разобранный объект или None (GPT недоступен, ошибка, невалидный JSON)
+    """
+    text = await chat(
+        [{"role": "system", "content": system},
+         {"role": "user", "content": user}],
+        temperature=temperature, max_tokens=max_tokens, timeout=timeout, label=label,
+        response_format={"type": "json_schema",
+                         "json_schema": {"name": name, "schema": schema, "strict": True}},
+    )
+    if not text:
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        _count("errors")
+        log.error("GPT structured output is not valid JSON (%s): %s", name, e)
+        return None
+    return data if isinstance(data, dict) else None
+
+# -----------------------------------------------------------------------------
+# ХЕДЖИРОВАНИЕ
+# -----------------------------------------------------------------------------
+def hedge_deadline(label: str) -> float:
+    """Дедлайн ожидания GPT для типа запроса: p95 его задержек в заданных границах"""
+    samples = list(_label_latencies.get(label, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return GPT_HEDGE_DEFAULT
+    return min(GPT_HEDGE_MAX, max(GPT_HEDGE_MIN, _percentile(samples, 0.95) * GPT_HEDGE_FACTOR))
+
+def _stash_late(key: str, cacheable: bool, task: "asyncio.Task"):
+    """Сохранить опоздавший ответ: его получит следующий такой же запрос"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    text = task.result()
+    if not text:
+        return
+    with _cache_lock:
+        _late_results[key] = text
+        while len(_late_results) > LATE_RESULTS_SIZE:
+            _late_results.popitem(last=False)
+    if cacheable:
+        _memory_put(key, time.time() + GPT_CACHE_TTL, text)
+
+def _pop_late(key: str) -> Optional[str]:
+    with _cache_lock:
+        return _late_results.pop(key, None)
+
+async def complete_hedged(system: str, user: str, fallback: Callable[[], str],
+                          temperature: float = 0.65, max_tokens: int = 220, label: str = "default",
+                          cache_max_temperature: Optional[float] = None, cache_late: bool = True) -> str:
+    """
+    Запрос с ограниченной задержкой: если GPT не ответил за hedge_deadline(label),
+    сразу возвращаем fallback() (локальный шаблон). Опоздавший ответ (cache_late=True)
+    не пропадает — его отдадим на следующий такой же запрос.
+    """
+    if not is_configured():
+        _count("fallbacks")
+        return fallback()
+
+    messages = [{"role": "system", "content": system},
+                {"role": "user", "content": user}]
+    key = _cache_key(_model, messages, temperature, max_tokens)
+    cacheable = cache_max_temperature is not None and temperature <= cache_max_temperature
+    if cacheable:
+        cached = await cache_get(key)
+        if cached is not None:
+            _count("cache_hits")
+            return cached
+        _count("cache_misses")
+
+    late = _pop_late(key)
+    if late:
+        _count("late_used")
+        return late
+
+    deadline = hedge_deadline(label)
+    task = asyncio.create_task(_request(messages, temperature, max_tokens, None, _model, label))
+    done, _ = await asyncio.wait({task}, timeout=deadline)
+    if task in done:
+        text = task.result()
+        if text:
+            if cacheable:
+                await cache_put(key, text)
+            return text
+        _count("fallbacks")
+        return fallback()
+
+    _count("hedged")
+    log.info("GPT hedged: %s exceeded %.1fs, serving template", label, deadline)
+    if cache_late:
+        task.add_done_callback(lambda t: _stash_late(key, cacheable, t))
+    else:
+        task.cancel()
+    return fallback()
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+def get_metrics() -> Dict[str, Any]:
+    """Снимок метрик шлюза"""
+    samples = list(_latencies)
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    return {
+        **stats,
+        "cache_hit_rate": round(stats["cache_hits"] / lookups, 3) if lookups else 0.0,
+        "cache_size": len(_cache),
+        "latency_p50": round(_percentile(samples, 0.50), 3),
+        "latency_p95": round(_percentile(samples, 0.95), 3),
+        "first_token_p50": round(_percentile(list(_first_token_latencies), 0.50), 3),
+        "max_concurrency": GPT_MAX_CONCURRENCY,
+    }
@@ -4,11 +4,14 @@
 # - заменить фон (новая локация)
 # Использует Gemini 2.5 Flash Image (preview).
 
-import os, base64, json, logging, time, requests
+import os, json, logging
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
-from PIL import Image, ImageEnhance, ImageFilter
-import io
+
+from app.services.image_enhance import enhance_image
+from app.services.image_normalize import normalize_for_upload
+from app.services.clients import vertex_stream
+from app.services.clients.vertex_stream import B64Image, read_json_with_blobs
 
 log = logging.getLogger("nano-client")
 
@@ -38,56 +41,13 @@ def _access_token() -> str:
 def _post_with_retry(url: str, headers: dict, payload: dict,
                      timeout: int = NANO_HTTP_TIMEOUT,
                      attempts: int = HTTP_RETRIES):
-    backoff = 2
-    last_error = None
-
-    for attempt in range(1, attempts + 1):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            if response.status_code < 400:
-                return response
-
-            if response.status_code in (429, 500, 502, 503, 504):
-                last_error = RuntimeError(
-                    f"Retryable error {response.status_code}: {response.text[:512]}"
-                )
-            else:
-                response.raise_for_status()
-        except requests.RequestException as exc:
-            last_error = exc
-
-        if attempt < attempts:
-            sleep_for = backoff ** (attempt - 1)
-            log.warning("Nano request retry %s/%s after %s", attempt, attempts, last_error)
-            time.sleep(min(20, sleep_for))
-
-    raise RuntimeError(f"Nano request failed after {attempts} attempts: {last_error}")
+    """POST с потоковым телом и повторами; картинки в ответе декодирует read_json_with_blobs."""
+    return vertex_stream.post_with_retry(url, headers, payload, timeout, attempts,
+                                         name="Nano", max_sleep=20)
 
 def _enhance_gemini_image(image_bytes: bytes) -> bytes:
-    """Улучшает качество изображения от Gemini: убирает шум, повышает резкость без потери деталей."""
-    try:
-        # Открываем изображение
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Легкое подавление шума
-        image = image.filter(ImageFilter.MedianFilter(size=1))
-        
-        # Умеренное повышение резкости
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.15)  # Небольшое улучшение резкости
-        
-        # Легкое улучшение контраста
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.05)  # Минимальное улучшение контраста
-        
-        # Сохраняем в высоком качестве
-        output = io.BytesIO()
-        image.save(output, format='PNG', quality=95, optimize=True, compress_level=0)
-        return output.getvalue()
-        
-    except Exception as e:
-        log.warning("Failed to enhance Gemini image quality: %s", e)
-        return image_bytes  # Возвращаем оригинал если не удалось улучшить
+    """Повышает резкость и контраст одним проходом и кодирует результат компактно (см. image_enhance)."""
+    return enhance_image(image_bytes, sharpness=1.15, contrast=1.05)
 
 def repose_or_relocate(dressed_bytes: bytes, prompt: str = "", bg_bytes: bytes | None = None) -> bytes:
     """
@@ -107,13 +67,17 @@ def repose_or_relocate(dressed_bytes: bytes, prompt: str = "", bg_bytes: bytes |
         "Content-Type": "application/json; charset=utf-8"
     }
 
+    dressed_bytes = normalize_for_upload(dressed_bytes, "nano")
+    if bg_bytes:
+        bg_bytes = normalize_for_upload(bg_bytes, "nano")
+
     inst = []
     inst.append({
-        "image": {"bytesBase64Encoded": base64.b64encode(dressed_bytes).decode("utf-8")}
+        "image": {"bytesBase64Encoded": B64Image(dressed_bytes)}
     })
     if bg_bytes:
         inst.append({
-            "image": {"bytesBase64Encoded": base64.b64encode(bg_bytes).decode("utf-8")}
+            "image": {"bytesBase64Encoded": B64Image(bg_bytes)}
         })
 
     instruction = (
@@ -137,13 +101,12 @@ def repose_or_relocate(dressed_bytes: bytes, prompt: str = "", bg_bytes: bytes |
     }
 
     r = _post_with_retry(url, headers, body)
-    data = r.json()
+    data = read_json_with_blobs(r)
     pred = (data.get("predictions") or [{}])[0]
-    b64 = pred.get("bytesBase64Encoded")
-    if not b64:
+    result_bytes = pred.get("bytesBase64Encoded")  # уже декодировано при чтении ответа
+    if not result_bytes:
         raise RuntimeError(f"Unexpected nano response: {data}")
     
-    # Декодируем изображение и улучшаем качество
-    result_bytes = base64.b64decode(b64)
+    # Улучшаем качество
     enhanced_bytes = _enhance_gemini_image(result_bytes)
     return enhanced_bytes
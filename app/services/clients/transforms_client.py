@@ -6,12 +6,14 @@ import os
 import base64
 import json
 import logging
-import time
-import requests
-from PIL import Image, ImageEnhance, ImageFilter, ImageDraw, ImageFont
-import io
 from typing import List, Optional
 
+from app.services.image_enhance import enhance_image
+from app.services.image_normalize import normalize_for_upload
+from app.services.clients import vertex_stream
+from app.services.clients.vertex_stream import B64Image, read_json_with_blobs
+from app.services.polaroid import render_polaroid
+
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 
@@ -70,57 +72,13 @@ def _access_token() -> str:
 def _post_with_retry(url: str, headers: dict, payload: dict,
                      timeout: int = IMAGE_HTTP_TIMEOUT,
                      attempts: int = HTTP_RETRIES):
-    """Отправляет POST-запрос с экспоненциальными повторами."""
-    backoff = 2
-    last_error = None
-
-    for attempt in range(1, attempts + 1):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            if response.status_code < 400:
-                return response
-
-            if response.status_code in (429, 500, 502, 503, 504):
-                last_error = RuntimeError(
-                    f"Retryable error {response.status_code}: {response.text[:512]}"
-                )
-            else:
-                response.raise_for_status()
-        except requests.RequestException as exc:
-            last_error = exc
-
-        if attempt < attempts:
-            sleep_for = backoff ** (attempt - 1)
-            log.warning("Gemini image request retry %s/%s after %s", attempt, attempts, last_error)
-            time.sleep(min(15, sleep_for))
-
-    raise RuntimeError(f"Gemini request failed after {attempts} attempts: {last_error}")
+    """Отправляет POST-запрос с потоковым телом и экспоненциальными повторами."""
+    return vertex_stream.post_with_retry(url, headers, payload, timeout, attempts,
+                                         name="Gemini image", max_sleep=15)
 
 def _enhance_image_quality(image_bytes: bytes) -> bytes:
-    """Улучшает качество изображения без потери деталей: убирает шум, повышает резкость."""
-    try:
-        # Открываем изображение
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Легкое подавление шума
-        image = image.filter(ImageFilter.MedianFilter(size=1))
-        
-        # Умеренное повышение резкости
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.15)
-        
-        # Легкое улучшение контраста
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.05)
-        
-        # Сохраняем в высоком качестве
-        output = io.BytesIO()
-        image.save(output, format='PNG', quality=95, optimize=True, compress_level=0)
-        return output.getvalue()
-        
-    except Exception as e:
-        log.warning("Failed to enhance image quality: %s", e)
-        return image_bytes
+    """Повышает резкость и контраст одним проходом и кодирует результат компактно (см. image_enhance)."""
+    return enhance_image(image_bytes, sharpness=1.15, contrast=1.05)
 
 def _call_gemini(images: List[bytes], prompt: str, quality: str = "basic") -> bytes:
     """Вызывает Gemini 2.5 Flash Image для обработки изображений."""
@@ -140,8 +98,9 @@ def _call_gemini(images: List[bytes], prompt: str, quality: str = "basic") -> by
     # Подготавливаем изображения
     instances = []
     for img_bytes in images:
+        img_bytes = normalize_for_upload(img_bytes, "transform")
         instances.append({
-            "image": {"bytesBase64Encoded": base64.b64encode(img_bytes).decode("utf-8")}
+            "image": {"bytesBase64Encoded": B64Image(img_bytes)}
         })
     
     # Добавляем промпт
@@ -165,14 +124,14 @@ def _call_gemini(images: List[bytes], prompt: str, quality: str = "basic") -> by
     log.info("Transform request → %s", url)
     r = _post_with_retry(url, headers, payload)
 
-    data = r.json()
+    data = read_json_with_blobs(r)
     preds = data.get("predictions") or []
     if not preds:
         raise RuntimeError(f"Empty transform predictions: {data}")
 
     pred = preds[0]
     if "bytesBase64Encoded" in pred:
-        result_bytes = base64.b64decode(pred["bytesBase64Encoded"])
+        result_bytes = pred["bytesBase64Encoded"]  # уже декодировано при чтении ответа
         # Улучшаем качество результата
         enhanced_bytes = _enhance_image_quality(result_bytes)
         return enhanced_bytes
@@ -278,6 +237,7 @@ def retouch_image(image_bytes: bytes, retouch_description: str, quality: str = "
 def create_polaroid(images: List[bytes], quality: str = "basic", caption: str = "") -> bytes:
     """
     Создает Polaroid-стиль изображение из фотографий людей.
+    Gemini нужен только для сборки группового кадра из нескольких фото.
     
     Args:
         images: список байтов изображений (1-4 фото людей)
@@ -301,21 +261,8 @@ def create_polaroid(images: List[bytes], quality: str = "basic", caption: str =
     else:
         group_image = images[0]
     
-    # Шаг 2 — Стилизация под Polaroid
-    polaroid_prompt = (
-        "TASK: Apply Polaroid aesthetic frame and film look.\n"
-        "INSTRUCTIONS:\n"
-        "- Add classic Polaroid white frame (thicker bottom border).\n"
-        "- Apply subtle film grain, soft contrast, slight warm tint.\n"
-        "- Make it look like vintage instant camera from 1970s-80s.\n"
-        "- Keep image sharp and clear but with nostalgic film aesthetic.\n"
-        "OUTPUT: final Polaroid-style image."
-    )
-    
-    if caption:
-        polaroid_prompt += f"\n- Place handwritten-style caption at the bottom: '{caption[:24]}'"
-    
-    return _call_gemini([group_image], polaroid_prompt, quality)
+    # Шаг 2 — Стилизация под Polaroid: рамка, зерно, тон и подпись рендерятся локально
+    return render_polaroid(group_image, caption, quality)
 
 # Функция-роутер для всех трансформаций
 def process_transform(transform_type: str, images: List[bytes], text: Optional[str] = None, quality: str = "basic") -> bytes:
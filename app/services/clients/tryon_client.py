@@ -5,14 +5,16 @@ import os
 import base64
 import json
 import logging
-import time
-import requests
-from PIL import Image, ImageEnhance, ImageFilter
-import io
+from typing import Optional
 
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 
+from app.services.image_enhance import enhance_image
+from app.services import image_index
+from app.services.clients import vertex_stream
+from app.services.clients.vertex_stream import B64Image, read_json_with_blobs
+
 log = logging.getLogger("tryon-client")
 
 PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT", "ornate-producer-473220-g2")
@@ -81,63 +83,20 @@ def _access_token() -> str:
 def _post_with_retry(url: str, headers: dict, payload: dict,
                      timeout: int = TRYON_HTTP_TIMEOUT,
                      attempts: int = HTTP_RETRIES):
-    backoff = 2
-    last_error = None
-
-    for attempt in range(1, attempts + 1):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            if response.status_code < 400:
-                return response
-
-            if response.status_code in (429, 500, 502, 503, 504):
-                last_error = RuntimeError(
-                    f"Retryable error {response.status_code}: {response.text[:512]}"
-                )
-            else:
-                response.raise_for_status()
-        except requests.RequestException as exc:
-            last_error = exc
-
-        if attempt < attempts:
-            sleep_for = backoff ** (attempt - 1)
-            log.warning("Try-on request retry %s/%s after %s", attempt, attempts, last_error)
-            time.sleep(min(20, sleep_for))
-
-    raise RuntimeError(f"Try-on request failed after {attempts} attempts: {last_error}")
+    """POST с потоковым телом и повторами; картинки в ответе декодирует read_json_with_blobs."""
+    return vertex_stream.post_with_retry(url, headers, payload, timeout, attempts,
+                                         name="Try-on", max_sleep=20)
 
 def _enhance_image_quality(image_bytes: bytes) -> bytes:
-    """Улучшает качество изображения без потери деталей: убирает шум, повышает резкость."""
-    try:
-        # Открываем изображение
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Сохраняем оригинальный размер
-        original_size = image.size
-        
-        # Легкое подавление шума (более мягкий подход)
-        image = image.filter(ImageFilter.MedianFilter(size=1))
-        
-        # Умеренное повышение резкости (не слишком агрессивно)
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(1.2)  # Было 1.8, теперь 1.2
-        
-        # Легкое улучшение контраста
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.1)  # Было 1.3, теперь 1.1
-        
-        # Сохраняем в высоком качестве без потери деталей
-        output = io.BytesIO()
-        image.save(output, format='PNG', quality=95, optimize=True, compress_level=0)
-        return output.getvalue()
-        
-    except Exception as e:
-        log.warning("Failed to enhance image quality: %s", e)
-        return image_bytes  # Возвращаем оригинал если не удалось улучшить
+    """Повышает резкость и контраст одним проходом и кодирует результат компактно (см. image_enhance)."""
+    return enhance_image(image_bytes, sharpness=1.2, contrast=1.1)
 
-def virtual_tryon(person_bytes: bytes, garment_bytes: bytes, sample_count: int = 1):
+def virtual_tryon(person_bytes: bytes, garment_bytes: bytes, sample_count: int = 1,
+                  user_id: Optional[int] = None):
     """
-    Вызывает Vertex AI VTO. Возвращает PNG-байты результата или словарь с gcsUri.
+    Вызывает Vertex AI VTO. Возвращает байты результата (см. image_enhance) или словарь с gcsUri.
+
+    user_id — владелец фото человека: похожие фото ищутся в индексе только среди его фото.
     """
     if not PROJECT_ID:
         raise RuntimeError("GCP_PROJECT_ID is not set")
@@ -152,11 +111,16 @@ def virtual_tryon(person_bytes: bytes, garment_bytes: bytes, sample_count: int =
         "Content-Type": "application/json; charset=utf-8"
     }
 
+    # Поворот по EXIF, без метаданных, не больше полезного для VTO разрешения;
+    # уже виденные (в т.ч. пересжатые) фото берутся подготовленными из индекса
+    _, person_bytes = image_index.prepare("person", person_bytes, "tryon_person", user_id)
+    _, garment_bytes = image_index.prepare("garment", garment_bytes, "tryon_garment")
+
     payload = {
         "instances": [{
-            "personImage": {"image": {"bytesBase64Encoded": base64.b64encode(person_bytes).decode("utf-8")}},
+            "personImage": {"image": {"bytesBase64Encoded": B64Image(person_bytes)}},
             "productImages": [
-                {"image": {"bytesBase64Encoded": base64.b64encode(garment_bytes).decode("utf-8")}}
+                {"image": {"bytesBase64Encoded": B64Image(garment_bytes)}}
             ]
         }],
         "parameters": {
@@ -175,14 +139,14 @@ def virtual_tryon(person_bytes: bytes, garment_bytes: bytes, sample_count: int =
     log.info("VTO request → %s", url)
     r = _post_with_retry(url, headers, payload)
 
-    data = r.json()
+    data = read_json_with_blobs(r)
     preds = data.get("predictions") or []
     if not preds:
         raise RuntimeError(f"Empty VTO predictions: {data}")
 
     pred = preds[0]
     if "bytesBase64Encoded" in pred:
-        result_bytes = base64.b64decode(pred["bytesBase64Encoded"])
+        result_bytes = pred["bytesBase64Encoded"]  # уже декодировано при чтении ответа
         # Улучшаем качество результата
         enhanced_bytes = _enhance_image_quality(result_bytes)
         return enhanced_bytes
@@ -1,10 +1,13 @@
 import os
 import time
 import json
+import uuid
 import base64
 import logging
 import requests
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google.oauth2 import service_account
 
@@ -18,6 +21,16 @@ OUTPUT_GCS_URI = os.getenv("VEO_OUTPUT_GCS_URI")  # gs://bucket/path/
 DOWNLOAD = os.getenv("DOWNLOAD_VIDEOS", "1") == "1"
 HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "60"))
 HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+GCS_CHUNK_SIZE = int(os.getenv("VEO_GCS_CHUNK_SIZE", str(4 * 1024 * 1024)))  # байт на один ranged-запрос
+GCS_PARALLEL_READS = int(os.getenv("VEO_GCS_PARALLEL_READS", "4"))
+B64_DECODE_CHUNK = 4 * 1024 * 1024  # символов base64 за один шаг декодирования (кратно 4)
+FFMPEG_MODE = os.getenv("VEO_FFMPEG_MODE", "encode")  # encode | copy | off
+CONCAT_MODE = os.getenv("VEO_CONCAT_MODE", "copy")  # copy | crossfade | off
+CROSSFADE_SEC = float(os.getenv("VEO_CROSSFADE_SEC", "0.5"))
+
+# Общий клиент GCS: создаётся один раз, токен обновляется самим google-auth
+_storage_client = None
+_storage_lock = threading.Lock()
 
 def _get_credentials():
     key_b64 = os.getenv("GCP_KEY_JSON_B64")
@@ -66,9 +79,75 @@ def _post_with_retry(session, url: str, payload: dict, timeout: int = HTTP_TIMEO
 
     raise RuntimeError(f"Veo request failed after {attempts} attempts: {last_error}")
 
+def _get_storage_client():
+    """Возвращает общий storage.Client (без повторного получения учётки на каждую задачу)."""
+    global _storage_client
+    with _storage_lock:
+        if _storage_client is None:
+            from google.cloud import storage
+            _storage_client = storage.Client(project=PROJECT_ID, credentials=_get_credentials())
+        return _storage_client
+
+
+def _download_blob_ranged(blob, local_path: str) -> None:
+    """Скачивает blob параллельными ranged-запросами прямо в файл.
+
+    В памяти одновременно держится не больше GCS_PARALLEL_READS кусков по GCS_CHUNK_SIZE.
+    """
+    size = blob.size or 0
+    if size <= GCS_CHUNK_SIZE:
+        blob.download_to_filename(local_path)
+        return
+
+    ranges = [(start, min(start + GCS_CHUNK_SIZE, size) - 1)
+              for start in range(0, size, GCS_CHUNK_SIZE)]
+    fd = os.open(local_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+
+        def fetch(rng):
+            start, end = rng
+            chunk = blob.download_as_bytes(start=start, end=end, checksum=None)
+            os.pwrite(fd, chunk, start)
+
+        with ThreadPoolExecutor(max_workers=max(1, GCS_PARALLEL_READS)) as pool:
+            list(pool.map(fetch, ranges))
+    finally:
+        os.close(fd)
+
+
+def _write_b64_to_file(b64: str, local_path: str) -> None:
+    """Декодирует base64 кусками и пишет на диск, не создавая полную копию видео в памяти."""
+    step = B64_DECODE_CHUNK - B64_DECODE_CHUNK % 4
+    with open(local_path, "wb") as f:
+        for i in range(0, len(b64), step):
+            f.write(base64.b64decode(b64[i:i + step]))
+
+
 def _fix_aspect_with_ffmpeg(input_path: str, aspect="9:16") -> str:
-    """Прогон через ffmpeg, чтобы Telegram не сплющивал превью."""
+    """Прогон через ffmpeg, чтобы Telegram не сплющивал превью.
+
+    По умолчанию (VEO_FFMPEG_MODE=encode) — полное перекодирование. VEO_FFMPEG_MODE=copy —
+    ремукс без перекодирования: aspect на уровне контейнера и faststart (некоторые клиенты
+    Telegram его не учитывают). Если ремукс не удался — полное перекодирование.
+    """
+    if FFMPEG_MODE == "off":
+        return input_path
+
     fixed_path = input_path.replace(".mp4", "_fixed.mp4")
+    if FFMPEG_MODE == "copy":
+        try:
+            subprocess.run([
+                "ffmpeg", "-y", "-loglevel", "error", "-i", input_path,
+                "-c", "copy",
+                "-aspect", aspect,
+                "-movflags", "+faststart",
+                fixed_path
+            ], check=True)
+            return fixed_path
+        except Exception as e:
+            log.warning(f"FFmpeg remux failed, falling back to re-encode: {e}")
+
     try:
         subprocess.run([
             "ffmpeg", "-y", "-i", input_path,
@@ -83,6 +162,112 @@ def _fix_aspect_with_ffmpeg(input_path: str, aspect="9:16") -> str:
         log.warning(f"FFmpeg fix failed: {e}")
         return input_path
 
+def _probe_streams(path: str) -> dict:
+    """Параметры потоков клипа через ffprobe: кодеки, размеры, аудио и длительность."""
+    out = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,width,height,pix_fmt,r_frame_rate,sample_rate,channels",
+        "-show_entries", "format=duration",
+        "-of", "json", path
+    ], check=True, capture_output=True, text=True).stdout
+    info = json.loads(out or "{}")
+    streams = info.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), {})
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    return {
+        "video": (video.get("codec_name"), video.get("width"), video.get("height"),
+                  video.get("pix_fmt"), video.get("r_frame_rate")),
+        "audio": (audio.get("codec_name"), audio.get("sample_rate"), audio.get("channels")) if audio else None,
+        "duration": float(info.get("format", {}).get("duration") or 0),
+    }
+
+def _concat_copy(paths: list, out_path: str) -> None:
+    """Склейка concat-демуксером без перекодирования (кодеки клипов должны совпадать)."""
+    list_path = out_path.replace(".mp4", "_list.txt")
+    with open(list_path, "w") as f:
+        for p in paths:
+            f.write(f"file '{os.path.abspath(p)}'\n")
+    try:
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            out_path
+        ], check=True)
+    finally:
+        try:
+            os.remove(list_path)
+        except OSError:
+            pass
+
+def _concat_crossfade(paths: list, probes: list, out_path: str, aspect: str) -> None:
+    """Склейка с перекрёстным переходом (xfade/acrossfade) — требует перекодирования.
+
+    Если звук есть хотя бы у одного клипа, немым клипам подставляется тишина (anullsrc),
+    чтобы итоговый ролик не терял звуковую дорожку.
+    """
+    fade = CROSSFADE_SEC
+    with_audio = any(p["audio"] for p in probes)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+    for p in paths:
+        cmd += ["-i", p]
+
+    filters = []
+    if with_audio:
+        # Приводим звук всех клипов к одному формату, немым — тишина длиной клипа
+        for i, p in enumerate(probes):
+            if p["audio"]:
+                filters.append(f"[{i}:a]aformat=sample_rates=48000:channel_layouts=stereo[s{i}]")
+            else:
+                filters.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={p['duration']:.3f}[s{i}]")
+    v_prev, a_prev = "[0:v]", "[s0]"
+    offset = 0.0
+    for i in range(1, len(paths)):
+        offset += probes[i - 1]["duration"] - fade
+        v_out, a_out = f"[v{i}]", f"[a{i}]"
+        filters.append(f"{v_prev}[{i}:v]xfade=transition=fade:duration={fade}:offset={offset:.3f}{v_out}")
+        if with_audio:
+            filters.append(f"{a_prev}[s{i}]acrossfade=d={fade}{a_out}")
+        v_prev, a_prev = v_out, a_out
+
+    cmd += ["-filter_complex", ";".join(filters), "-map", v_prev]
+    if with_audio:
+        cmd += ["-map", a_prev, "-c:a", "aac", "-b:a", "128k"]
+    cmd += [
+        "-c:v", "libx264", "-preset", "fast", "-crf", "18",
+        "-aspect", aspect,
+        "-movflags", "+faststart",
+        out_path
+    ]
+    subprocess.run(cmd, check=True)
+
+def concat_videos(paths: list, aspect: str = "9:16", mode: str = None):
+    """Склеить клипы сцен в один MP4 (faststart), чтобы отправить ролик одним файлом.
+
+    mode=copy: concat-демуксер без перекодирования, если кодеки клипов совпадают,
+    иначе — перекодирование с переходом. mode=crossfade: всегда переход с перекодированием.
+    Возвращает путь к итоговому файлу или None, если склеить не удалось.
+    """
+    mode = mode or CONCAT_MODE
+    if mode == "off" or len(paths) < 2:
+        return None
+
+    base, _ = os.path.splitext(paths[0])
+    out_path = f"{base}_concat.mp4"
+    try:
+        probes = [_probe_streams(p) for p in paths]
+        same_codecs = all(p["video"] == probes[0]["video"] and p["audio"] == probes[0]["audio"]
+                          for p in probes)
+        if mode == "copy" and same_codecs:
+            _concat_copy(paths, out_path)
+        else:
+            _concat_crossfade(paths, probes, out_path, aspect)
+        return out_path
+    except Exception as e:
+        log.warning(f"FFmpeg concat failed: {e}")
+        return None
+
 def generate_video_sync(prompt: str, duration: int = 8, aspect_ratio: str = "9:16", with_audio: bool = True):
     sess = _authorized_session()
     url = (
@@ -114,9 +299,9 @@ def generate_video_sync(prompt: str, duration: int = 8, aspect_ratio: str = "9:1
         raise RuntimeError(f"Не удалось получить operation name: {resp}")
     log.info(f"Получили op_name: {op_name}")
 
-    return _poll_and_collect(sess, op_name)
+    return _poll_and_collect(sess, op_name, aspect_ratio)
 
-def _poll_and_collect(sess, op_name: str):
+def _poll_and_collect(sess, op_name: str, aspect_ratio: str = "9:16"):
     url = (
         f"https://{LOCATION}-aiplatform.googleapis.com/v1/projects/{PROJECT_ID}"
         f"/locations/{LOCATION}/publishers/google/models/{MODEL}:fetchPredictOperation"
@@ -133,9 +318,9 @@ def _poll_and_collect(sess, op_name: str):
             if not videos:
                 return {"videos": []}
 
-            from google.cloud import storage
-            storage_client = storage.Client(project=PROJECT_ID, credentials=_get_credentials())
-            ts = int(time.time())
+            # Сцены репортажа опрашиваются параллельно: без уникальной части операции,
+            # завершившиеся в одну секунду, перезаписали бы клипы друг друга
+            ts = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
 
             for i, v in enumerate(videos):
                 item = {}
@@ -143,24 +328,24 @@ def _poll_and_collect(sess, op_name: str):
                 if gcs_uri:
                     _, path = gcs_uri.split("gs://", 1)
                     bucket_name, blob_name = path.split("/", 1)
-                    bucket = storage_client.bucket(bucket_name)
-                    blob = bucket.blob(blob_name)
+                    bucket = _get_storage_client().bucket(bucket_name)
+                    blob = bucket.get_blob(blob_name) or bucket.blob(blob_name)
                     local_path = f"video_{ts}_{i}.mp4"
-                    blob.download_to_filename(local_path)
+                    _download_blob_ranged(blob, local_path)
                     log.info(f"Скачано в {local_path}")
-                    fixed_path = _fix_aspect_with_ffmpeg(local_path)
+                    fixed_path = _fix_aspect_with_ffmpeg(local_path, aspect_ratio)
                     item["uri"] = gcs_uri
                     item["file_path"] = fixed_path
                     out_files.append(item)
                     continue
 
-                b64 = v.get("bytesBase64Encoded")
+                # pop: освобождаем строку base64 сразу после записи на диск
+                b64 = v.pop("bytesBase64Encoded", None)
                 if b64:
-                    raw = base64.b64decode(b64)
                     local_path = f"video_{ts}_{i}.mp4"
-                    with open(local_path, "wb") as f:
-                        f.write(raw)
-                    fixed_path = _fix_aspect_with_ffmpeg(local_path)
+                    _write_b64_to_file(b64, local_path)
+                    del b64
+                    fixed_path = _fix_aspect_with_ffmpeg(local_path, aspect_ratio)
                     item["file_path"] = fixed_path
                     out_files.append(item)
                     continue
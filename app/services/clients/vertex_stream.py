@@ -0,0 +1,202 @@
+# vertex_stream.py
+# Потоковый обмен с Vertex AI для больших base64-картинок (VTO, Gemini Image, Nano):
+# - тело запроса генерируется кусками: байты фото кодируются в base64 по частям прямо при отправке,
+#   без промежуточных base64-строки и json.dumps всего payload (Content-Length считается заранее)
+# - ответ разбирается по мере чтения: значения bytesBase64Encoded декодируются сразу в буфер,
+#   остальной (маленький) JSON собирается обычным json.loads
+
+import base64
+import io
+import json
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Union
+
+import requests
+
+log = logging.getLogger("vertex-stream")
+
+RAW_CHUNK = 3 * 16 * 1024  # кратно 3: base64 кусков склеивается без паддинга внутри
+READ_CHUNK = 64 * 1024
+BLOB_KEY = b'"bytesBase64Encoded"'
+BLOB_PLACEHOLDER = "__blob_%d__"
+
+class B64Image:
+    """Картинка в payload: в тело запроса попадёт строкой base64, закодированной на лету"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview]):
+        self.data = memoryview(data)
+
+    def encoded_len(self) -> int:
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def iter_encoded(self) -> Iterator[bytes]:
+        for start in range(0, len(self.data), RAW_CHUNK):
+            yield base64.b64encode(self.data[start:start + RAW_CHUNK])
+
+def _pieces(obj: Any) -> Iterator[Union[bytes, B64Image]]:
+    """Компактная JSON-сериализация по частям; B64Image отдаётся как есть"""
+    if isinstance(obj, B64Image):
+        yield obj
+    elif isinstance(obj, dict):
+        yield b"{"
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                yield b","
+            yield json.dumps(str(key), ensure_ascii=False).encode("utf-8") + b":"
+            yield from _pieces(value)
+        yield b"}"
+    elif isinstance(obj, (list, tuple)):
+        yield b"["
+        for i, value in enumerate(obj):
+            if i:
+                yield b","
+            yield from _pieces(value)
+        yield b"]"
+    else:
+        yield json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+class JsonBodyStream:
+    """
+    Тело запроса для requests: итерируемое с известной длиной
+    (requests ставит Content-Length и не переходит на chunked-передачу)
+    """
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self._length = sum(
+            piece.encoded_len() + 2 if isinstance(piece, B64Image) else len(piece)
+            for piece in _pieces(payload)
+        )
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for piece in _pieces(self.payload):
+            if isinstance(piece, B64Image):
+                yield b'"'
+                yield from piece.iter_encoded()
+                yield b'"'
+            else:
+                yield piece
+
+class _BlobDecoder:
+    """Инкрементальный разбор ответа: base64 из bytesBase64Encoded — сразу в байты"""
+
+    def __init__(self):
+        self.skeleton = bytearray()  # JSON без картинок (вместо них — плейсхолдеры)
+        self.blobs: List[bytes] = []
+        self._pending = b""  # хвост на случай, если ключ разрезан между кусками
+        self._state = "json"
+        self._current: io.BytesIO = None
+        self._carry = b""
+
+    def feed(self, data: bytes):
+        while data:
+            if self._state == "json":
+                buf = self._pending + data
+                idx = buf.find(BLOB_KEY)
+                if idx < 0:
+                    keep = len(BLOB_KEY) - 1
+                    self.skeleton += buf[:-keep]
+                    self._pending = buf[-keep:]
+                    return
+                self.skeleton += buf[:idx + len(BLOB_KEY)]
+                self._pending = b""
+                data = buf[idx + len(BLOB_KEY):]
+                self._state = "value"
+
+            elif self._state == "value":
+                i = 0
+                while i < len(data) and data[i] in b" \t\r\n:":
+                    i += 1
+                if i == len(data):
+                    return
+                if data[i] != ord('"'):
+                    # Не строка — оставляем как обычный JSON
+                    self.skeleton += b":"
+                    self._state = "json"
+                    data = data[i:]
+                    continue
+                self.skeleton += (':"' + BLOB_PLACEHOLDER % len(self.blobs) + '"').encode()
+                self._current = io.BytesIO()
+                self._carry = b""
+                self._state = "base64"
+                data = data[i + 1:]
+
+            else:
+                end = data.find(b'"')
+                segment = data if end < 0 else data[:end]
+                # Экранированный «\/» и переносы строк в base64 не нужны
+                segment = self._carry + segment.translate(None, b"\\ \r\n\t")
+                usable = len(segment) // 4 * 4
+                self._current.write(base64.b64decode(segment[:usable]))
+                self._carry = segment[usable:]
+                if end < 0:
+                    return
+                if self._carry:
+                    self._current.write(base64.b64decode(self._carry + b"=" * (-len(self._carry) % 4)))
+                self.blobs.append(self._current.getvalue())
+                self._current = None
+                self._state = "json"
+                data = data[end + 1:]
+
+    def result(self) -> Any:
+        self.skeleton += self._pending
+        return _restore(json.loads(bytes(self.skeleton)), self.blobs)
+
+def _restore(obj: Any, blobs: List[bytes]) -> Any:
+    if isinstance(obj, dict):
+        return {key: _restore(value, blobs) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_restore(value, blobs) for value in obj]
+    if isinstance(obj, str) and obj.startswith("__blob_") and obj.endswith("__"):
+        return blobs[int(obj[7:-2])]
+    return obj
+
+def read_json_with_blobs(response: requests.Response) -> Dict[str, Any]:
+    """
+    Прочитать JSON-ответ Vertex потоком
+
+    Returns:
+        Ответ, в котором значения bytesBase64Encoded уже декодированы в bytes
+    """
+    decoder = _BlobDecoder()
+    for chunk in response.iter_content(chunk_size=READ_CHUNK):
+        decoder.feed(chunk)
+    return decoder.result()
+
+def post_with_retry(url: str, headers: dict, payload: Any, timeout: int, attempts: int,
+                    name: str = "Vertex", max_sleep: int = 20) -> requests.Response:
+    """
+    POST с потоковым телом и экспоненциальными повторами.
+    Тело пересобирается на каждую попытку; ответ возвращается непрочитанным (stream=True).
+    """
+    backoff = 2
+    last_error = None
+
+    for attempt in range(1, attempts + 1):
+        try:
+            response = requests.post(url, headers=headers, data=JsonBodyStream(payload),
+                                     timeout=timeout, stream=True)
+            if response.status_code < 400:
+                return response
+
+            if response.status_code in (429, 500, 502, 503, 504):
+                last_error = RuntimeError(
+                    f"Retryable error {response.status_code}: {response.text[:512]}"
+                )
+            else:
+                response.raise_for_status()
+        except requests.RequestException as exc:
+            last_error = exc
+
+        if attempt < attempts:
+            sleep_for = backoff ** (attempt - 1)
+            log.warning("%s request retry %s/%s after %s", name, attempt, attempts, last_error)
+            time.sleep(min(max_sleep, sleep_for))
+
+    raise RuntimeError(f"{name} request failed after {attempts} attempts: {last_error}")
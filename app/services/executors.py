@@ -0,0 +1,172 @@
+"""
+Именованные пулы исполнителей по классам нагрузки
+Раньше всё блокирующее шло через asyncio.to_thread в один общий пул по умолчанию
+(min(32, cpu+4) потоков): пачка видео, каждое из которых минутами опрашивает Veo,
+занимала все потоки, и вставали даже короткие запросы к SQLite. Теперь у каждого
+класса свой пул и свой размер:
+
+- upstream — долгие вызовы внешних моделей (Veo, VTO, Nano, трансформации), склейка видео
+- db — короткий локальный I/O: SQLite, дисковые кэши
+- image — разбор фото в потоках для индекса фото (декодирование, перцептивные хеши):
+  это CPU-работа, но индекс хранит состояние в памяти процесса, поэтому не cpu-пул
+- cpu — обработка изображений в процессах (удаление фона, пост-обработка, проверка фото)
+
+Процессы cpu-пула запускаются через forkserver (spawn, где его нет): пул создаётся
+лениво, когда в процессе уже работают потоки, а fork из многопоточного процесса может
+унаследовать захваченные чужими потоками блокировки и повиснуть.
+
+По каждому пулу считаются занятость, глубина очереди, время ожидания в очереди,
+а при насыщении (очередь не меньше EXECUTOR_ALERT_QUEUE_RATIO × размер пула) пишется
+предупреждение в лог — не чаще раза в EXECUTOR_ALERT_INTERVAL секунд.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+log = logging.getLogger("executors")
+
+_CPU = os.cpu_count() or 1
+
+EXECUTOR_UPSTREAM_WORKERS = int(os.getenv("EXECUTOR_UPSTREAM_WORKERS", "32"))
+EXECUTOR_DB_WORKERS = int(os.getenv("EXECUTOR_DB_WORKERS", "8"))
+EXECUTOR_IMAGE_WORKERS = int(os.getenv("EXECUTOR_IMAGE_WORKERS", str(min(4, _CPU))))
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", str(min(4, _CPU))))
+EXECUTOR_ALERT_QUEUE_RATIO = float(os.getenv("EXECUTOR_ALERT_QUEUE_RATIO", "1.0"))
+EXECUTOR_ALERT_INTERVAL = float(os.getenv("EXECUTOR_ALERT_INTERVAL", "60"))
+
+def _mp_context():
+    """Контекст запуска процессов без fork"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+class _Pool:
+    """Пул с метриками; сам исполнитель создаётся при первой задаче"""
+
+    def __init__(self, name: str, workers: int, processes: bool = False):
+        self.name = name
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.alert_queue = max(1, int(self.workers * EXECUTOR_ALERT_QUEUE_RATIO))
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_alert = 0.0
+        self._stats: Dict[str, Any] = {
+            "submitted": 0, "completed": 0, "failed": 0,
+            "max_queue": 0, "alerts": 0,
+            "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0,
+        }
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix=f"pool-{self.name}")
+            return self._executor
+
+    def _queue_depth(self) -> int:
+        """Задачи сверх размера пула ждут в очереди (для процессов начало работы не видно)"""
+        return max(0, self._in_flight - self.workers)
+
+    def _timed(self, fn: Callable, submitted: float, *args, **kwargs):
+        """Обёртка для потоков: фиксирует ожидание в очереди и время работы"""
+        started = time.monotonic()
+        with self._lock:
+            wait = started - submitted
+            self._stats["wait_total"] += wait
+            self._stats["wait_max"] = max(self._stats["wait_max"], wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._stats["run_total"] += time.monotonic() - started
+
+    def _on_done(self, submitted: float, future: Future):
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._stats["failed"] += 1
+            else:
+                self._stats["completed"] += 1
+            if self.processes:
+                self._stats["run_total"] += time.monotonic() - submitted
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Поставить задачу в пул (для процессов fn и аргументы должны пиклиться)"""
+        executor = self._get_executor()
+        submitted = time.monotonic()
+        alert_depth = 0
+        with self._lock:
+            self._in_flight += 1
+            self._stats["submitted"] += 1
+            depth = self._queue_depth()
+            self._stats["max_queue"] = max(self._stats["max_queue"], depth)
+            if depth >= self.alert_queue and submitted - self._last_alert >= EXECUTOR_ALERT_INTERVAL:
+                self._last_alert = submitted
+                self._stats["alerts"] += 1
+                alert_depth = depth
+        if alert_depth:
+            log.warning("Executor '%s' saturated: %d queued, %d workers busy",
+                        self.name, alert_depth, self.workers)
+        try:
+            if self.processes:
+                future = executor.submit(fn, *args, **kwargs)
+            else:
+                future = executor.submit(self._timed, fn, submitted, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+                self._stats["failed"] += 1
+            raise
+        future.add_done_callback(functools.partial(self._on_done, submitted))
+        return future
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["workers"] = self.workers
+            stats["in_flight"] = self._in_flight
+            stats["queued"] = self._queue_depth()
+            stats["busy"] = self._in_flight - stats["queued"]
+        finished = stats["completed"] + stats["failed"]
+        stats["avg_wait"] = stats.pop("wait_total") / stats["submitted"] if stats["submitted"] else 0.0
+        stats["avg_run"] = stats.pop("run_total") / finished if finished else 0.0
+        if self.processes:
+            # Для процессов время ожидания не измеряется
+            stats.pop("avg_wait")
+            stats.pop("wait_max")
+        return stats
+
+_pools: Dict[str, _Pool] = {
+    "upstream": _Pool("upstream", EXECUTOR_UPSTREAM_WORKERS),
+    "db": _Pool("db", EXECUTOR_DB_WORKERS),
+    "image": _Pool("image", EXECUTOR_IMAGE_WORKERS),
+    "cpu": _Pool("cpu", EXECUTOR_CPU_WORKERS, processes=True),
+}
+
+def get(name: str) -> _Pool:
+    """Пул по имени: upstream | db | image | cpu"""
+    return _pools[name]
+
+async def run(name: str, fn: Callable, *args, **kwargs) -> Any:
+    """
+    Выполнить блокирующий вызов в пуле своего класса нагрузки (замена asyncio.to_thread)
+
+    Args:
+        name: upstream | db | image | cpu
+        fn: блокирующая функция; для cpu — функция уровня модуля (пиклится в процесс)
+    """
+    return await asyncio.wrap_future(_pools[name].submit(fn, *args, **kwargs))
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: pool.get_stats() for name, pool in _pools.items()}
@@ -0,0 +1,286 @@
+"""
+Планировщик генераций перед клиентами Vertex (Veo, VTO, Gemini)
+Раньше каждый нажатый «Сгенерировать» сразу уходил в модель: один пользователь мог
+запустить десяток роликов и занять всю квоту, а подписчик pro ждал наравне с остальными.
+Теперь задача сначала получает слот:
+
+- общий лимит одновременных генераций и отдельный лимит на каждую модель
+- не больше SCHEDULER_USER_MAX_IN_FLIGHT выполняющихся задач на пользователя; задачам
+  одной пачки (примерка нескольких вещей) разрешено ещё SCHEDULER_BATCH_EXTRA_SLOTS,
+  чтобы пачка не растягивалась на много раундов
+- очередь со взвешенным справедливым обслуживанием (WFQ): у каждого пользователя свои
+  виртуальные часы, которые идут тем медленнее, чем выше вес тарифа (TARIFFS);
+  тяжёлая задача (Veo) двигает часы сильнее лёгкой
+- старение: каждая секунда ожидания уменьшает виртуальную метку задачи, поэтому даже
+  задача без подписки при постоянном потоке pro-задач рано или поздно получит слот
+
+Метрики ожидания в очереди собираются по тарифам. По скользящим перцентилям длительности
+генераций (Veo по длительности и звуку, примерка, каждый тип трансформации) задаче
+считается место в очереди и ETA: очередь проигрывается по слотам модели, уже идущим
+задачам засчитывается прошедшее время. Вызывающий получает их раз в
+SCHEDULER_STATUS_INTERVAL секунд и обновляет одно сообщение со статусом.
+Состояние общее для потоков: задачи ставят и обработчики, и фоновые потоки со своими loop.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import heapq
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config.pricing import TARIFFS
+
+log = logging.getLogger("generation-scheduler")
+
+FREE_PLAN = "free"  # нет активной подписки
+
+SCHEDULER_GLOBAL_SLOTS = int(os.getenv("SCHEDULER_GLOBAL_SLOTS", "16"))
+MODEL_SLOTS: Dict[str, int] = {
+    "veo": int(os.getenv("SCHEDULER_SLOTS_VEO", "6")),
+    "tryon": int(os.getenv("SCHEDULER_SLOTS_TRYON", "8")),
+    "gemini": int(os.getenv("SCHEDULER_SLOTS_GEMINI", "8")),  # Nano и трансформации — одна модель
+}
+SCHEDULER_USER_MAX_IN_FLIGHT = int(os.getenv("SCHEDULER_USER_MAX_IN_FLIGHT", "2"))
+SCHEDULER_BATCH_EXTRA_SLOTS = int(os.getenv("SCHEDULER_BATCH_EXTRA_SLOTS", "3"))  # сверх лимита для задач пачки
+# Сколько виртуального времени «списывает» задача модели (Veo занимает квоту минутами)
+MODEL_COST: Dict[str, float] = {"veo": 4.0, "tryon": 1.0, "gemini": 1.0}
+# Вес тарифа в очереди: чем больше, тем чаще задачи пользователя выходят вперёд
+PLAN_WEIGHTS: Dict[str, float] = {FREE_PLAN: 0.5, "lite": 1.0, "standard": 2.0, "pro": 4.0}
+SCHEDULER_AGING_RATE = float(os.getenv("SCHEDULER_AGING_RATE", "0.1"))  # виртуальных единиц за секунду ожидания
+WAIT_WINDOW = 500  # сколько последних ожиданий держим для перцентилей
+SCHEDULER_STATUS_INTERVAL = float(os.getenv("SCHEDULER_STATUS_INTERVAL", "15"))  # как часто обновлять статус, сек
+LATENCY_WINDOW = 200  # последние длительности по каждому виду задачи
+LATENCY_MIN_SAMPLES = 5  # меньше — берём перцентиль по модели, затем DEFAULT_LATENCY
+# Оценка длительности, пока своей истории нет, сек
+DEFAULT_LATENCY: Dict[str, float] = {"veo": 90.0, "tryon": 25.0, "gemini": 20.0}
+
+for _plan in TARIFFS:
+    PLAN_WEIGHTS.setdefault(_plan, 1.0)
+
+class _Job:
+    __slots__ = ("user_id", "model", "kind", "plan", "tag", "enqueued", "started", "loop", "future",
+                 "extra_slots")
+
+    def __init__(self, user_id: int, model: str, kind: str, plan: str, tag: float,
+                 loop: asyncio.AbstractEventLoop, future: asyncio.Future, extra_slots: int = 0):
+        self.user_id = user_id
+        self.model = model
+        self.kind = kind
+        self.plan = plan
+        self.tag = tag
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None
+        self.loop = loop
+        self.future = future
+        self.extra_slots = extra_slots
+
+_lock = threading.Lock()
+_queue: List[_Job] = []
+_running: List[_Job] = []
+_virtual_time = 0.0
+_user_finish: Dict[int, float] = {}  # виртуальное время окончания последней задачи пользователя
+_running_total = 0
+_running_model: Dict[str, int] = {model: 0 for model in MODEL_SLOTS}
+_running_user: Dict[int, int] = {}
+_waits: Dict[str, Deque[float]] = {}
+_stats: Dict[str, Dict[str, Any]] = {}
+_latency: Dict[str, Deque[float]] = {}  # вид задачи (и модель целиком) → длительности
+
+def _effective_tag(job: _Job, now: float) -> float:
+    return job.tag - SCHEDULER_AGING_RATE * (now - job.enqueued)
+
+def _eligible(job: _Job) -> bool:
+    return (_running_total < SCHEDULER_GLOBAL_SLOTS
+            and _running_model[job.model] < MODEL_SLOTS[job.model]
+            and _running_user.get(job.user_id, 0) < SCHEDULER_USER_MAX_IN_FLIGHT + job.extra_slots)
+
+def _record_wait(plan: str, wait: float):
+    waits = _waits.setdefault(plan, deque(maxlen=WAIT_WINDOW))
+    waits.append(wait)
+    s = _stats.setdefault(plan, {"jobs": 0, "wait_total": 0.0, "wait_max": 0.0})
+    s["jobs"] += 1
+    s["wait_total"] += wait
+    s["wait_max"] = max(s["wait_max"], wait)
+
+def _dispatch_locked():
+    """Выдать слоты задачам с наименьшей меткой, пока есть свободные"""
+    global _virtual_time, _running_total
+    now = time.monotonic()
+    while _queue:
+        candidates = [job for job in _queue if _eligible(job)]
+        if not candidates:
+            return
+        job = min(candidates, key=lambda j: _effective_tag(j, now))
+        _queue.remove(job)
+        job.started = now
+        _running.append(job)
+        _virtual_time = max(_virtual_time, job.tag)
+        _running_total += 1
+        _running_model[job.model] += 1
+        _running_user[job.user_id] = _running_user.get(job.user_id, 0) + 1
+        _record_wait(job.plan, now - job.enqueued)
+        job.loop.call_soon_threadsafe(_grant, job.future)
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+def _release(job: _Job, completed: bool = False):
+    global _running_total
+    with _lock:
+        if completed:
+            # Ошибки и отмены не показательны для длительности
+            duration = time.monotonic() - job.started
+            for key in (job.kind, job.model):
+                _latency.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(duration)
+        _running.remove(job)
+        _running_total -= 1
+        _running_model[job.model] -= 1
+        left = _running_user.get(job.user_id, 0) - 1
+        if left > 0:
+            _running_user[job.user_id] = left
+        else:
+            _running_user.pop(job.user_id, None)
+            if _user_finish.get(job.user_id, 0.0) <= _virtual_time:
+                _user_finish.pop(job.user_id, None)  # часы пользователя не впереди общих
+        _dispatch_locked()
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def _latency_locked(kind: str, model: str, q: float) -> float:
+    for key in (kind, model):
+        samples = _latency.get(key)
+        if samples and len(samples) >= LATENCY_MIN_SAMPLES:
+            return _percentile(list(samples), q)
+    return DEFAULT_LATENCY[model]
+
+def _estimate_locked(entry: _Job, now: float) -> Tuple[int, float]:
+    """
+    Место в очереди (0 — уже выполняется) и оценка секунд до результата
+
+    Очередь модели проигрывается по её слотам: чужим задачам отводится медиана их вида,
+    своей — p75, чтобы обещание чаще выполнялось, чем нет.
+    """
+    if entry.started is not None:
+        return 0, max(0.0, _latency_locked(entry.kind, entry.model, 0.75) - (now - entry.started))
+    free_at = [max(0.0, _latency_locked(j.kind, j.model, 0.5) - (now - j.started))
+               for j in _running if j.model == entry.model]
+    free_at += [0.0] * max(0, MODEL_SLOTS[entry.model] - len(free_at))
+    heapq.heapify(free_at)
+    ahead = sorted((j for j in _queue if j.model == entry.model), key=lambda j: _effective_tag(j, now))
+    for position, queued in enumerate(ahead, 1):
+        start = heapq.heappop(free_at)
+        if queued is entry:
+            return position, start + _latency_locked(entry.kind, entry.model, 0.75)
+        heapq.heappush(free_at, start + _latency_locked(queued.kind, queued.model, 0.5))
+    return 0, 0.0  # задачу уже забрали из очереди
+
+async def _report(entry: _Job, on_status: Callable[[int, float], Awaitable[None]]):
+    """Сообщать место в очереди и ETA, пока задача не закончится"""
+    while True:
+        with _lock:
+            position, eta = _estimate_locked(entry, time.monotonic())
+        try:
+            await on_status(position, eta)
+        except Exception as e:
+            log.debug("Status update failed for user %s: %s", entry.user_id, e)
+        await asyncio.sleep(SCHEDULER_STATUS_INTERVAL)
+
+@asynccontextmanager
+async def job(user_id: int, model: str, plan: str, cost: Optional[float] = None,
+              kind: Optional[str] = None,
+              on_status: Optional[Callable[[int, float], Awaitable[None]]] = None,
+              batch: bool = False):
+    """
+    Занять слот генерации на время блока
+
+    Args:
+        user_id: пользователь (лимит одновременных задач и справедливая очередь)
+        model: veo | tryon | gemini
+        plan: тариф из TARIFFS или FREE_PLAN
+        cost: вес задачи для очереди (по умолчанию MODEL_COST модели)
+        kind: вид задачи для статистики длительности (veo:8s:audio, transform:retouch…);
+            по умолчанию — модель
+        on_status: async (место в очереди, ETA в секундах) — вызывается сразу
+            и затем раз в SCHEDULER_STATUS_INTERVAL, пока задача не закончится
+        batch: задача из пачки — лимит на пользователя выше на SCHEDULER_BATCH_EXTRA_SLOTS
+
+    Usage:
+        async with generation_scheduler.job(uid, "veo", plan):
+            res = await executors.run("upstream", generate_video_sync, ...)
+    """
+    if model not in MODEL_SLOTS:
+        raise ValueError(f"Unknown model for scheduler: {model}")
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    weight = PLAN_WEIGHTS.get(plan, PLAN_WEIGHTS[FREE_PLAN])
+    with _lock:
+        start = max(_virtual_time, _user_finish.get(user_id, 0.0))
+        _user_finish[user_id] = start + (cost if cost is not None else MODEL_COST[model]) / weight
+        entry = _Job(user_id, model, kind or model, plan, start, loop, future,
+                     SCHEDULER_BATCH_EXTRA_SLOTS if batch else 0)
+        _queue.append(entry)
+        _dispatch_locked()
+        queued = entry in _queue
+    if queued:
+        log.info("Job queued: user=%s model=%s plan=%s (%d in queue)", user_id, model, plan, len(_queue))
+
+    reporter = loop.create_task(_report(entry, on_status)) if on_status else None
+    try:
+        try:
+            await future
+        except asyncio.CancelledError:
+            with _lock:
+                if entry in _queue:
+                    _queue.remove(entry)
+                    raise
+            # Слот уже выдан, но задача отменена — вернуть его
+            _release(entry)
+            raise
+
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            _release(entry, completed)
+    finally:
+        if reporter:
+            reporter.cancel()
+
+def get_stats() -> Dict[str, Any]:
+    """Занятость слотов, ожидание в очереди по тарифам и длительность по видам задач"""
+    with _lock:
+        stats: Dict[str, Any] = {
+            "running": _running_total,
+            "global_slots": SCHEDULER_GLOBAL_SLOTS,
+            "queued": len(_queue),
+            "models": {model: {"running": _running_model[model], "slots": slots,
+                               "queued": sum(1 for j in _queue if j.model == model)}
+                       for model, slots in MODEL_SLOTS.items()},
+            "plans": {},
+        }
+        for plan, s in _stats.items():
+            waits = list(_waits.get(plan, ()))
+            stats["plans"][plan] = {
+                "jobs": s["jobs"],
+                "avg_wait": s["wait_total"] / s["jobs"] if s["jobs"] else 0.0,
+                "p50_wait": _percentile(waits, 0.5),
+                "p95_wait": _percentile(waits, 0.95),
+                "max_wait": s["wait_max"],
+                "queued": sum(1 for j in _queue if j.plan == plan),
+            }
+        stats["latency"] = {
+            key: {"samples": len(samples), "p50": _percentile(list(samples), 0.5),
+                  "p95": _percentile(list(samples), 0.95)}
+            for key, samples in _latency.items() if key not in MODEL_SLOTS
+        }
+    return stats
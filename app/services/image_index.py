@@ -0,0 +1,173 @@
+"""
+Индекс фото примерочной по перцептивным хешам (pHash + dHash)
+Пользователи примеряют несколько вещей на одно фото или одну популярную вещь на разные фото,
+и каждый раз одно и то же фото заново нормализовалось и уходило в VTO. Здесь фото
+узнаётся даже после пересжатия Telegram: подготовленные для модели байты берутся из индекса,
+а стабильный ID фото позволяет кэшу результатов (result_cache) отдать готовую примерку,
+если совпали и человек, и одежда.
+
+pHash — DCT 32x32 по яркости (NumPy), dHash — знаки горизонтальных градиентов 9x8.
+Так как оба хеша не видят цвет, дополнительно сравнивается цветовая сетка 4x4:
+та же футболка другого цвета — это другая вещь.
+
+Фото людей (PRIVATE_KINDS) привязаны к владельцу: ID содержит пользователя, а похожие
+фото ищутся только среди его же фото. Иначе похожее фото другого человека получило бы
+чужой ID и чужие подготовленные байты, а через кэш результатов — чужую примерку с чужим
+лицом. Одежда общая для всех пользователей.
+"""
+
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.services.image_normalize import normalize_for_upload
+
+log = logging.getLogger("image-index")
+
+IMAGE_INDEX_MAX_BYTES = int(os.getenv("IMAGE_INDEX_MAX_BYTES", str(128 * 1024 * 1024)))
+PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_INDEX_PHASH_DISTANCE", "6"))  # из 64 бит
+DHASH_MAX_DISTANCE = int(os.getenv("IMAGE_INDEX_DHASH_DISTANCE", "10"))
+COLOR_MAX_DIFF = float(os.getenv("IMAGE_INDEX_COLOR_DIFF", "12"))  # средний модуль разницы, 0..255
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+COLOR_GRID = 4
+PRIVATE_KINDS = {"person"}  # фото этих типов не сопоставляются между пользователями
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Ортонормированная матрица DCT-II: D @ X @ D.T — двумерное преобразование"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d.astype(np.float32)
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+@dataclass
+class _Entry:
+    image_id: str  # стабильный ID: тип + sha256 первого увиденного варианта
+    kind: str
+    owner: Optional[int]  # владелец для PRIVATE_KINDS, иначе None
+    phash: int
+    dhash: int
+    color: np.ndarray
+    prepared: bytes  # нормализованные байты для модели
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()  # image_id → запись, от старых к свежим
+_exact: Dict[str, str] = {}  # тип + sha256 присланных байтов → image_id
+_total = 0
+_stats: Dict[str, Dict[str, int]] = {}
+
+def _bits(mask: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(mask.ravel()).tobytes(), "big")
+
+def fingerprint(image_bytes: bytes) -> Tuple[int, int, np.ndarray]:
+    """(pHash, dHash, цветовая сетка) для фото"""
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", (DCT_SIZE * 4, DCT_SIZE * 4))  # JPEG декодируется сразу в уменьшенном размере
+    rgb = image.convert("RGB")
+
+    gray = np.asarray(rgb.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR), dtype=np.float32)
+    coeffs = (_DCT @ gray @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()[1:]  # без DC-компоненты
+    phash = _bits(coeffs > np.median(coeffs))
+
+    small = np.asarray(rgb.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    dhash = _bits(small[:, 1:] > small[:, :-1])
+
+    color = np.asarray(rgb.resize((COLOR_GRID, COLOR_GRID), Image.BOX), dtype=np.float32)
+    return phash, dhash, color
+
+def _record(kind: str, outcome: str):
+    s = _stats.setdefault(kind, {"lookups": 0, "exact": 0, "near": 0, "new": 0})
+    s["lookups"] += 1
+    s[outcome] += 1
+
+def _find_near(kind: str, owner: Optional[int], phash: int, dhash: int,
+               color: np.ndarray) -> Optional[_Entry]:
+    best, best_distance = None, None
+    for entry in _entries.values():
+        if entry.kind != kind or entry.owner != owner:
+            continue
+        distance = (entry.phash ^ phash).bit_count()
+        if distance > PHASH_MAX_DISTANCE or (entry.dhash ^ dhash).bit_count() > DHASH_MAX_DISTANCE:
+            continue
+        if float(np.abs(entry.color - color).mean()) > COLOR_MAX_DIFF:
+            continue
+        if best_distance is None or distance < best_distance:
+            best, best_distance = entry, distance
+    return best
+
+def _evict():
+    global _total
+    while _total > IMAGE_INDEX_MAX_BYTES and _entries:
+        image_id, entry = _entries.popitem(last=False)
+        _total -= len(entry.prepared)
+        for key in [key for key, iid in _exact.items() if iid == image_id]:
+            del _exact[key]
+
+def prepare(kind: str, image_bytes: bytes, feature: str, owner: Optional[int] = None) -> Tuple[str, bytes]:
+    """
+    Найти фото в индексе или подготовить и запомнить
+
+    Args:
+        kind: person | garment — фото разных типов не сравниваются
+        image_bytes: присланные байты
+        feature: функция для normalize_for_upload (tryon_person, tryon_garment)
+        owner: ID пользователя; для PRIVATE_KINDS фото сопоставляются только
+            с фото того же пользователя (без owner — только с такими же фото без владельца)
+
+    Returns:
+        (стабильный ID фото, нормализованные байты для модели)
+    """
+    global _total
+    owner = owner if kind in PRIVATE_KINDS else None
+    scope = f"{kind}:{owner}" if kind in PRIVATE_KINDS else kind
+    key = f"{scope}:{hashlib.sha256(image_bytes).hexdigest()}"
+    with _lock:
+        image_id = _exact.get(key)
+        if image_id in _entries:
+            _entries.move_to_end(image_id)
+            _record(kind, "exact")
+            return image_id, _entries[image_id].prepared
+
+    try:
+        phash, dhash, color = fingerprint(image_bytes)
+    except Exception as e:
+        log.warning("Failed to fingerprint %s image: %s", kind, e)
+        return key, normalize_for_upload(image_bytes, feature)
+
+    with _lock:
+        entry = _find_near(kind, owner, phash, dhash, color)
+        if entry is not None:
+            _entries.move_to_end(entry.image_id)
+            _exact[key] = entry.image_id
+            _record(kind, "near")
+            log.info("Near-duplicate %s image → %s", kind, entry.image_id[:12])
+            return entry.image_id, entry.prepared
+
+    prepared = normalize_for_upload(image_bytes, feature)
+    with _lock:
+        _entries[key] = _Entry(key, kind, owner, phash, dhash, color, prepared)
+        _exact[key] = key
+        _total += len(prepared)
+        _record(kind, "new")
+        _evict()
+    return key, prepared
+
+def get_stats() -> Dict[str, Any]:
+    """Совпадения по типам фото: точные, почти-дубликаты, новые"""
+    with _lock:
+        stats: Dict[str, Any] = {kind: dict(s) for kind, s in _stats.items()}
+        stats["entries"] = len(_entries)
+        stats["bytes"] = _total
+    return stats
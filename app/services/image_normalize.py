@@ -0,0 +1,86 @@
+"""
+Нормализация фото перед отправкой в Vertex (VTO, Gemini-трансформации, Nano)
+Фото от пользователя уходят в base64 как есть: с EXIF, в исходном разрешении и формате.
+Здесь кадр поворачивается по EXIF, метаданные выбрасываются, сторона ограничивается
+полезным для модели максимумом, результат перекодируется в JPEG с целевым качеством.
+Счётчики «до/после» показывают, сколько байт не ушло в upstream.
+"""
+
+import os
+import io
+import logging
+import threading
+from typing import Any, Dict
+
+from PIL import Image, ImageOps
+
+log = logging.getLogger("image-normalize")
+
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "90"))
+
+# Больше этого модели не используют: VTO и Gemini Image всё равно работают в ~1K
+MAX_SIDE = {
+    "tryon_person": int(os.getenv("UPLOAD_MAX_SIDE_TRYON", "1536")),
+    "tryon_garment": int(os.getenv("UPLOAD_MAX_SIDE_GARMENT", "1024")),
+    "transform": int(os.getenv("UPLOAD_MAX_SIDE_TRANSFORM", "1536")),
+    "nano": int(os.getenv("UPLOAD_MAX_SIDE_NANO", "1536")),
+}
+DEFAULT_MAX_SIDE = 1536
+
+_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {}
+
+def _record(feature: str, before: int, after: int):
+    with _lock:
+        s = _stats.setdefault(feature, {"images": 0, "bytes_in": 0, "bytes_out": 0})
+        s["images"] += 1
+        s["bytes_in"] += before
+        s["bytes_out"] += after
+
+def normalize_for_upload(image_bytes: bytes, feature: str) -> bytes:
+    """
+    Подготовить фото к отправке в модель
+
+    Args:
+        image_bytes: исходные байты (как скачаны из Telegram)
+        feature: tryon_person | tryon_garment | transform | nano — задаёт максимальную сторону
+
+    Returns:
+        JPEG без метаданных (PNG, если есть прозрачность); исходные байты, если нормализация
+        не удалась или не уменьшила размер (и поворачивать кадр не нужно)
+    """
+    max_side = MAX_SIDE.get(feature, DEFAULT_MAX_SIDE)
+    rotated = False
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        rotated = image.getexif().get(0x0112, 1) != 1
+        image = ImageOps.exif_transpose(image)  # поворот по EXIF; сама EXIF при сохранении не пишется
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if has_alpha:
+            # Вырезанные объекты (например, одежда без фона) — прозрачность важна для модели
+            image.convert("RGBA").save(out, format="PNG", compress_level=6)
+        else:
+            image.convert("RGB").save(out, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+        result = out.getvalue()
+    except Exception as e:
+        log.warning("Image normalization failed for %s: %s", feature, e)
+        result = image_bytes
+
+    if len(result) >= len(image_bytes) and not rotated:
+        result = image_bytes
+    _record(feature, len(image_bytes), len(result))
+    log.info("Upload image %s: %d → %d bytes", feature, len(image_bytes), len(result))
+    return result
+
+def get_stats() -> Dict[str, Any]:
+    """Байты до/после нормализации по функциям"""
+    with _lock:
+        stats = {feature: dict(s) for feature, s in _stats.items()}
+    for s in stats.values():
+        s["saved_ratio"] = round(1 - s["bytes_out"] / s["bytes_in"], 3) if s["bytes_in"] else 0.0
+    return stats
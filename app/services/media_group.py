@@ -0,0 +1,79 @@
+"""
+Сборщик альбомов (media group) из входящих фото
+Telegram присылает альбом отдельными апдейтами с общим media_group_id. Первый апдейт
+альбома становится «ведущим»: ждёт короткую паузу без новых фото, забирает все фото
+и обрабатывает альбом одним пакетом. Остальные апдейты только добавляют своё фото.
+Собранный альбом ещё MEDIA_GROUP_TOMBSTONE секунд помнится: фото, опоздавшие после
+MEDIA_GROUP_MAX_WAIT, отбрасываются, а не открывают второй альбом со своим ведущим
+(и отдельной оплатой).
+
+Состояние общее для потоков: в webhook-режиме апдейты приходят из разных потоков Flask.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Hashable, List, Tuple
+
+log = logging.getLogger("media-group")
+
+MEDIA_GROUP_DEBOUNCE = float(os.getenv("MEDIA_GROUP_DEBOUNCE", "1.0"))  # пауза без новых фото, сек
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", "5.0"))  # дольше альбом не ждём
+MEDIA_GROUP_TOMBSTONE = float(os.getenv("MEDIA_GROUP_TOMBSTONE", "60"))  # сколько помним собранный альбом, сек
+STALE_AFTER = 60.0
+
+class _Group:
+    __slots__ = ("items", "started", "last_seen")
+
+    def __init__(self):
+        self.items: List[Tuple[int, Any]] = []  # (message_id, фото)
+        self.started = time.monotonic()
+        self.last_seen = self.started
+
+_lock = threading.Lock()
+_groups: Dict[Hashable, _Group] = {}
+_collected: Dict[Hashable, float] = {}  # собранные альбомы → время сбора
+
+def add(key: Hashable, message_id: int, photo: Any) -> bool:
+    """
+    Добавить фото альбома
+
+    Returns:
+        True, если это первое фото альбома — вызывающий обработает весь альбом;
+        False — фото заберёт ведущий или альбом уже собран (опоздавшее фото отброшено)
+    """
+    now = time.monotonic()
+    with _lock:
+        # Брошенные группы (ведущий упал) и старые отметки о сборе не копим
+        for stale in [k for k, g in _groups.items() if now - g.last_seen > STALE_AFTER]:
+            del _groups[stale]
+        for expired in [k for k, at in _collected.items() if now - at > MEDIA_GROUP_TOMBSTONE]:
+            del _collected[expired]
+        if key in _collected:
+            log.warning("Media group %s: late photo %s after collection, dropped", key, message_id)
+            return False
+        group = _groups.get(key)
+        leader = group is None
+        if leader:
+            group = _groups[key] = _Group()
+        group.items.append((message_id, photo))
+        group.last_seen = now
+        return leader
+
+async def collect(key: Hashable) -> List[Any]:
+    """Дождаться конца альбома и забрать фото в порядке сообщений"""
+    while True:
+        with _lock:
+            group = _groups[key]
+            now = time.monotonic()
+            quiet = now - group.last_seen
+            if quiet >= MEDIA_GROUP_DEBOUNCE or now - group.started >= MEDIA_GROUP_MAX_WAIT:
+                del _groups[key]
+                _collected[key] = now
+                break
+        await asyncio.sleep(MEDIA_GROUP_DEBOUNCE - quiet)
+    photos = [photo for _, photo in sorted(group.items, key=lambda item: item[0])]
+    log.info("Media group %s collected: %d photos", key, len(photos))
+    return photos
@@ -0,0 +1,100 @@
+"""
+Реестр сгенерированных медиа
+Запоминает Telegram file_id отправленных результатов и отправляет их повторно
+по file_id — без повторной загрузки файла в Telegram
+Запись в SQLite идёт в db-пуле исполнителей, чтобы не блокировать event loop
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.db import db_media
+from app.services import executors
+
+log = logging.getLogger("media_registry")
+
+HISTORY_PAGE_SIZE = 5
+
+def _extract_file(message) -> Optional[Tuple[str, str, Optional[str]]]:
+    """Достать (kind, file_id, file_unique_id) из отправленного сообщения"""
+    if message is None:
+        return None
+    if getattr(message, "video", None):
+        return "video", message.video.file_id, message.video.file_unique_id
+    if getattr(message, "photo", None):
+        # Самый большой размер — последний в списке
+        photo = message.photo[-1]
+        return "photo", photo.file_id, photo.file_unique_id
+    if getattr(message, "document", None):
+        return "document", message.document.file_id, message.document.file_unique_id
+    if getattr(message, "animation", None):
+        return "video", message.animation.file_id, message.animation.file_unique_id
+    return None
+
+async def remember(user_id: int, message, feature: str, prompt: Optional[str] = None,
+             job_id: Optional[str] = None) -> Optional[int]:
+    """
+    Записать медиа из отправленного сообщения в реестр
+
+    Args:
+        user_id: ID пользователя
+        message: Сообщение, которое вернул reply_video/reply_photo/edit_media
+        feature: Функция (video, tryon, transform, ...)
+        prompt: Промт/описание задачи
+        job_id: ID задачи
+
+    Returns:
+        ID записи реестра или None
+    """
+    try:
+        extracted = _extract_file(message)
+        if not extracted:
+            return None
+        kind, file_id, file_unique_id = extracted
+        return await executors.run(
+            "db", db_media.insert_media,
+            user_id=user_id,
+            kind=kind,
+            file_id=file_id,
+            file_unique_id=file_unique_id,
+            feature=feature,
+            prompt=(prompt or "")[:1000] or None,
+            job_id=job_id,
+        )
+    except Exception as e:
+        # Реестр не должен ломать доставку результата
+        log.warning(f"Failed to remember media for user {user_id}: {e}")
+        return None
+
+def get_media(media_id: int) -> Optional[Dict[str, Any]]:
+    """Получить запись реестра по ID"""
+    return db_media.get_media(media_id)
+
+def history_page(user_id: int, before_id: Optional[int] = None,
+                 page_size: int = HISTORY_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Страница истории медиа пользователя
+
+    Returns:
+        (записи, курсор следующей страницы или None)
+    """
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    items = db_media.get_user_media(user_id, limit=page_size + 1, before_id=before_id)
+    if len(items) > page_size:
+        items = items[:page_size]
+        return items, items[-1]["id"]
+    return items, None
+
+async def send_media(bot, chat_id: int, record: Dict[str, Any], caption: Optional[str] = None,
+                     reply_markup=None):
+    """Отправить медиа из реестра по file_id (0 байт загрузки)"""
+    kind = record.get("kind")
+    file_id = record["file_id"]
+    if kind == "video":
+        return await bot.send_video(chat_id=chat_id, video=file_id, caption=caption,
+                                    supports_streaming=True, reply_markup=reply_markup)
+    if kind == "photo":
+        return await bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption,
+                                    reply_markup=reply_markup)
+    return await bot.send_document(chat_id=chat_id, document=file_id, caption=caption,
+                                   reply_markup=reply_markup)
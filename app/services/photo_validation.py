@@ -0,0 +1,116 @@
+"""
+Быстрая локальная проверка фото до списания монеток и вызова Vertex
+Миниатюры, скриншоты, смазанные кадры и фото «человека» без человека модель всё равно
+не обработает: пользователь ждёт минуты, получает ошибку и возврат. Здесь такие фото
+отсекаются за миллисекунды на уменьшенной копии кадра, с понятной подсказкой, что прислать.
+
+Проверки: формат по сигнатуре файла, разрешение и пропорции, резкость (дисперсия
+лапласиана), доля «плоских» пикселей (скриншоты, картинки с текстом), доля пикселей
+цвета кожи в YCbCr для фото людей.
+"""
+
+import os
+import io
+import logging
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+log = logging.getLogger("photo-validation")
+
+MIN_SIDE = int(os.getenv("PHOTO_MIN_SIDE", "320"))
+MAX_ASPECT = float(os.getenv("PHOTO_MAX_ASPECT", "3.0"))
+BLUR_MIN_VARIANCE = float(os.getenv("PHOTO_BLUR_MIN_VARIANCE", "25"))
+FLAT_MAX_SHARE = float(os.getenv("PHOTO_FLAT_MAX_SHARE", "0.75"))  # доля пикселей без перепадов
+SKIN_MIN_SHARE = float(os.getenv("PHOTO_SKIN_MIN_SHARE", "0.01"))
+ANALYSIS_SIDE = 512
+
+# Для каких фото нужен человек в кадре
+PERSON_PURPOSES = {"tryon_person", "merge_people"}
+# Одежду часто снимают на идеально белом фоне, как в каталоге, — для неё «плоский» фон норма
+FLAT_ALLOWED_PURPOSES = {"tryon_garment"}
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+    (b"BM", "bmp"),
+)
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Формат по первым байтам файла (расширению и MIME от клиента не верим)"""
+    head = bytes(data[:16])
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"hevc"):
+        return "heic"
+    return None
+
+def _laplacian_variance(gray: np.ndarray) -> float:
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4.0 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+def _flat_share(gray: np.ndarray) -> float:
+    """Доля пикселей, равных соседу справа и снизу, — у фото с шумом матрицы она мала"""
+    flat = (gray[:-1, :-1] == gray[:-1, 1:]) & (gray[:-1, :-1] == gray[1:, :-1])
+    return float(flat.mean())
+
+def _skin_share(rgb: np.ndarray) -> float:
+    """Доля пикселей в классическом диапазоне кожи YCbCr (Cb 77–127, Cr 133–173)"""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    cb = 128.0 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 128.0 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    skin = (cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173) & (y > 40)
+    return float(skin.mean())
+
+def validate(image_bytes: bytes, purpose: str) -> Optional[str]:
+    """
+    Проверить фото перед платной обработкой
+
+    Args:
+        image_bytes: байты фото
+        purpose: transform | merge_people | tryon_person | tryon_garment | background
+
+    Returns:
+        None, если фото годится; иначе текст для пользователя — что не так и что прислать
+    """
+    fmt = sniff_format(image_bytes)
+    if fmt == "heic":
+        return "Фото в формате HEIC не поддерживается. Отправьте его как обычное фото (не файлом)."
+    if fmt is None:
+        return "Не удалось распознать изображение. Пришлите фото в JPG или PNG."
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        image.draft("RGB", (ANALYSIS_SIDE, ANALYSIS_SIDE))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE))
+    except Exception as e:
+        log.info("Photo rejected for %s: cannot decode (%s)", purpose, e)
+        return "Файл повреждён или это не фото. Пришлите другое изображение."
+
+    if min(width, height) < MIN_SIDE:
+        return (f"Фото слишком маленькое ({width}×{height}). "
+                f"Нужно хотя бы {MIN_SIDE} пикселей по короткой стороне — пришлите оригинал, а не миниатюру.")
+    if max(width, height) / min(width, height) > MAX_ASPECT:
+        return "Слишком вытянутое фото. Обрежьте его ближе к обычным пропорциям (не длиннее 3:1)."
+
+    rgb = np.asarray(image, dtype=np.float32)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    if purpose not in FLAT_ALLOWED_PURPOSES and _flat_share(np.round(gray)) > FLAT_MAX_SHARE:
+        return "Похоже на скриншот или картинку с текстом. Пришлите настоящее фото."
+    if _laplacian_variance(gray) < BLUR_MIN_VARIANCE:
+        return "Фото размыто. Пришлите более чёткий снимок — без движения и не в расфокусе."
+    if purpose in PERSON_PURPOSES and _skin_share(rgb) < SKIN_MIN_SHARE:
+        return "Не вижу человека на фото. Пришлите снимок, где хорошо видно лицо и фигуру."
+    return None
@@ -0,0 +1,121 @@
+"""
+Локальный рендер Polaroid
+Рамка, плёночное зерно, тональная кривая, тёплый оттенок и подпись — детерминированные
+операции, второй проход через Gemini для них не нужен. Зерно сидируется хешем входа,
+поэтому одинаковые фото и подпись дают байт-в-байт одинаковый результат (удобно кэшировать).
+"""
+
+import os
+import io
+import hashlib
+import logging
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+log = logging.getLogger("polaroid")
+
+# Шрифт подписи: свой файл в app/assets/fonts (рукописный, с кириллицей) или путь из ENV
+POLAROID_FONT = os.getenv(
+    "POLAROID_FONT",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "fonts", "polaroid.ttf"),
+)
+FALLBACK_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+]
+
+IMAGE_SIDE = {"basic": 1080, "premium": 1440}  # сторона квадратного кадра
+FRAME_SIDE = 0.06  # поля рамки слева/справа/сверху (доля стороны кадра)
+FRAME_BOTTOM = 0.26  # нижнее поле под подпись
+FRAME_COLOR = (246, 244, 238)
+INK_COLOR = (45, 45, 70)
+GRAIN_SIGMA = 6.0
+CAPTION_MAX = 24
+JPEG_QUALITY = 92
+
+def _tone_lut() -> list:
+    """Мягкий контраст, приподнятые тени, тёплый сдвиг (R выше, B ниже)"""
+    x = np.arange(256, dtype=np.float32) / 255.0
+    # Чёрная точка 0.05, белая 0.95, чуть светлее средние тона
+    curve = 0.05 + 0.90 * np.power(x, 0.95)
+    lut = []
+    for gain, lift in ((1.04, 0.01), (1.0, 0.0), (0.93, 0.0)):
+        lut.extend(np.clip((curve * gain + lift) * 255.0, 0, 255).round().astype(np.uint8).tolist())
+    return lut
+
+_TONE_LUT = _tone_lut()
+
+def _seed(image_bytes: bytes, caption: str) -> int:
+    digest = hashlib.sha256(image_bytes + caption.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def _film(img: Image.Image, rng: np.random.Generator) -> Image.Image:
+    """Тональная кривая + монохромное зерно + лёгкая виньетка"""
+    arr = np.asarray(img.point(_TONE_LUT), dtype=np.float32)
+    h, w = arr.shape[:2]
+    grain = rng.normal(0.0, GRAIN_SIGMA, size=(h, w, 1)).astype(np.float32)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    r2 = ((xx - w / 2) / (w / 2)) ** 2 + ((yy - h / 2) / (h / 2)) ** 2
+    vignette = (1.0 - 0.12 * np.clip(r2 - 0.35, 0.0, None))[..., None]
+    return Image.fromarray(np.clip(arr * vignette + grain, 0, 255).round().astype(np.uint8))
+
+def _font(size: int) -> ImageFont.ImageFont:
+    for path in [POLAROID_FONT, *FALLBACK_FONTS]:
+        if path and os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError as e:
+                log.warning("Failed to load font %s: %s", path, e)
+    return ImageFont.load_default(size=size)
+
+def _draw_caption(canvas: Image.Image, caption: str, box_top: int, box_height: int):
+    """Подпись «от руки»: по центру нижнего поля с небольшим наклоном"""
+    probe = ImageDraw.Draw(canvas)
+    size = max(16, int(box_height * 0.3))
+    while True:
+        font = _font(size)
+        left, top, right, bottom = probe.textbbox((0, 0), caption, font=font)
+        # Длинная подпись — уменьшаем шрифт, пока не влезет в поле
+        if right - left <= canvas.width * 0.85 or size <= 16:
+            break
+        size = int(size * 0.9)
+    pad = font.size // 2
+    layer = Image.new("RGBA", (right - left + 2 * pad, bottom - top + 2 * pad), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((pad - left, pad - top), caption, font=font, fill=INK_COLOR + (235,))
+    layer = layer.rotate(2.0, resample=Image.BICUBIC, expand=True)
+    x = (canvas.width - layer.width) // 2
+    y = box_top + (box_height - layer.height) // 2
+    canvas.paste(layer, (x, y), layer)
+
+def render_polaroid(image_bytes: bytes, caption: Optional[str] = "", quality: str = "basic") -> bytes:
+    """
+    Оформить фото как снимок Polaroid
+
+    Args:
+        image_bytes: байты фото (кадр обрезается по центру в квадрат)
+        caption: подпись на нижнем поле (до 24 символов)
+        quality: "basic" или "premium" (размер кадра)
+
+    Returns:
+        JPEG-байты готового снимка
+    """
+    caption = (caption or "").strip()[:CAPTION_MAX]
+    side = IMAGE_SIDE.get(quality, IMAGE_SIDE["basic"])
+    rng = np.random.default_rng(_seed(image_bytes, caption))
+
+    photo = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("RGB")
+    photo = ImageOps.fit(photo, (side, side), Image.LANCZOS)
+    photo = _film(photo, rng)
+
+    margin = int(side * FRAME_SIDE)
+    bottom = int(side * FRAME_BOTTOM)
+    canvas = Image.new("RGB", (side + 2 * margin, side + margin + bottom), FRAME_COLOR)
+    canvas.paste(photo, (margin, margin))
+    if caption:
+        _draw_caption(canvas, caption, margin + side, bottom)
+
+    out = io.BytesIO()
+    canvas.save(out, format="JPEG", quality=JPEG_QUALITY, subsampling=0)
+    return out.getvalue()
@@ -0,0 +1,170 @@
+"""
+Кэш результатов генерации изображений (трансформации, примерка, смена позы/фона)
+process_transform, virtual_tryon и repose_or_relocate — чистые функции входных фото,
+текста и параметров. Повтор того же запроса (переотправка после сбоя сети, та же одежда)
+отдаётся с диска за миллисекунды, без платного вызова Vertex и без повторного списания.
+
+Ключ — sha256 от функции, модели, параметров, текста и хешей фото. Файлы лежат
+в локальном каталоге, общий размер ограничен: при переполнении вытесняются
+давно не использованные записи (LRU по времени последнего обращения).
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+log = logging.getLogger("result-cache")
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "babka_result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+CACHE_VERSION = 1  # поднять, если меняется пост-обработка результата
+
+_lock = threading.Lock()
+_index: Optional["OrderedDict[str, int]"] = None  # ключ → размер, от старых к свежим
+_total = 0
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evicted": 0, "coins_saved": 0}
+
+def make_key(feature: str, model: str, images: Sequence[bytes], text: Optional[str] = None,
+             params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Ключ результата
+
+    Args:
+        feature: transform | tryon | repose ...
+        model: ID модели Vertex
+        images: входные фото в порядке передачи в модель
+        text: промт/подпись (пробелы по краям и регистр не влияют)
+        params: остальные параметры вызова (тип трансформации, качество, ...)
+    """
+    h = hashlib.sha256()
+    head = {
+        "v": CACHE_VERSION,
+        "feature": feature,
+        "model": model,
+        "text": " ".join((text or "").split()).lower(),
+        "params": params or {},
+    }
+    h.update(json.dumps(head, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    for image in images:
+        h.update(hashlib.sha256(image).digest())
+    return h.hexdigest()
+
+def _path(key: str) -> str:
+    return os.path.join(RESULT_CACHE_DIR, key[:2], key + ".bin")
+
+def _load_index() -> "OrderedDict[str, int]":
+    """Восстановить LRU-порядок по mtime файлов (после рестарта)"""
+    global _index, _total
+    if _index is not None:
+        return _index
+    entries = []
+    if os.path.isdir(RESULT_CACHE_DIR):
+        for root, _, files in os.walk(RESULT_CACHE_DIR):
+            for name in files:
+                if not name.endswith(".bin"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+    entries.sort()
+    _index = OrderedDict((key, size) for _, key, size in entries)
+    _total = sum(_index.values())
+    return _index
+
+def _evict(index: "OrderedDict[str, int]"):
+    global _total
+    while _total > RESULT_CACHE_MAX_BYTES and index:
+        key, size = index.popitem(last=False)
+        _total -= size
+        _stats["evicted"] += 1
+        try:
+            os.remove(_path(key))
+        except OSError:
+            pass
+
+def get(key: str, force_fresh: bool = False) -> Optional[bytes]:
+    """Готовый результат или None (промах, кэш выключен, force_fresh)"""
+    global _total
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if force_fresh:
+        with _lock:
+            _stats["bypassed"] += 1
+        return None
+    with _lock:
+        index = _load_index()
+        if key not in index:
+            _stats["misses"] += 1
+            return None
+        index.move_to_end(key)
+    try:
+        with open(_path(key), "rb") as f:
+            data = f.read()
+        os.utime(_path(key))  # mtime — время последнего обращения (для LRU после рестарта)
+    except OSError as e:
+        log.warning("Result cache read failed for %s: %s", key[:12], e)
+        with _lock:
+            _total -= index.pop(key, 0)
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    log.info("Result cache hit %s (%d bytes)", key[:12], len(data))
+    return data
+
+def put(key: str, data: bytes):
+    """Сохранить результат; старые записи вытесняются по размеру"""
+    global _total
+    if not RESULT_CACHE_ENABLED or not data or len(data) > RESULT_CACHE_MAX_BYTES:
+        return
+    path = _path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning("Result cache write failed for %s: %s", key[:12], e)
+        return
+    with _lock:
+        index = _load_index()
+        _total -= index.pop(key, 0)
+        index[key] = len(data)
+        _total += len(data)
+        _stats["stored"] += 1
+        _evict(index)
+
+def record_hit(user_id: int, feature: str, coins_saved: int, balance: int):
+    """Отметить в журнале биллинга, что результат выдан из кэша без списания"""
+    with _lock:
+        _stats["coins_saved"] += coins_saved
+    try:
+        from app.services import billing_observer
+        billing_observer.log(
+            user_id=user_id,
+            delta=0,
+            feature=feature,
+            reason=f"result_cache_hit (saved {coins_saved})",
+            old_balance=balance,
+            new_balance=balance,
+        )
+    except Exception as e:
+        log.warning("Failed to record cache hit for user %s: %s", user_id, e)
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_index) if _index is not None else 0
+        stats["bytes"] = _total
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
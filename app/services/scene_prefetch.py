@@ -0,0 +1,143 @@
+"""
+Пул заранее сгенерированных сцен NEUROKUDO/LEGO
+Генераторы сцен без пользовательского ввода (одиночная сцена, сцена 1 репортажа)
+прогреваются в фоне, поэтому «🔄 Перегенерировать» отдаёт готовую сцену мгновенно.
+Если пул пуст — сцена генерируется вживую, как раньше.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+log = logging.getLogger("scene_prefetch")
+
+PREFETCH_TARGET = int(os.getenv("SCENE_PREFETCH_TARGET", "5"))  # сколько сцен держать на режим
+PREFETCH_LOW_WATER = int(os.getenv("SCENE_PREFETCH_LOW_WATER", "2"))  # ниже — запускаем дозаправку
+REFILL_INTERVAL = 60  # секунд между плановыми проверками пула
+REFILL_BACKOFF = 30  # пауза после неудачной генерации
+RECENT_PER_USER = 50  # сколько последних выданных сцен помним на пользователя
+MAX_TRACKED_USERS = 5000
+
+_generators: Dict[str, Callable[[], Awaitable[str]]] = {}
+_pools: Dict[str, Deque[str]] = {}
+_recent: "OrderedDict[int, Deque[str]]" = OrderedDict()
+_lock = threading.Lock()
+_refill_needed = threading.Event()
+_thread: Optional[threading.Thread] = None
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "generated": 0, "duplicates": 0}
+
+def _key(text: str) -> str:
+    return hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+
+def register(kind: str, generator: Callable[[], Awaitable[str]]):
+    """Зарегистрировать генератор сцен для режима"""
+    _generators[kind] = generator
+    _pools.setdefault(kind, deque())
+
+def _recent_for(user_id: int) -> Deque[str]:
+    recent = _recent.get(user_id)
+    if recent is None:
+        recent = _recent[user_id] = deque(maxlen=RECENT_PER_USER)
+        if len(_recent) > MAX_TRACKED_USERS:
+            _recent.popitem(last=False)
+    else:
+        _recent.move_to_end(user_id)
+    return recent
+
+async def take(kind: str, user_id: int) -> str:
+    """
+    Выдать сцену из пула (исключая недавно показанные пользователю)
+    или сгенерировать вживую, если подходящей нет
+    """
+    item = None
+    with _lock:
+        pool = _pools.setdefault(kind, deque())
+        recent = _recent_for(user_id)
+        for idx, candidate in enumerate(pool):
+            if _key(candidate) not in recent:
+                item = candidate
+                del pool[idx]
+                break
+        if len(pool) < PREFETCH_LOW_WATER:
+            _refill_needed.set()
+
+    if item is None:
+        _stats["misses"] += 1
+        item = await _generators[kind]()
+    else:
+        _stats["hits"] += 1
+
+    with _lock:
+        recent.append(_key(item))
+    return item
+
+def try_take(kind: str, user_id: int) -> Optional[str]:
+    """Выдать готовую сцену из пула без живой генерации (None — подходящей нет)"""
+    with _lock:
+        pool = _pools.setdefault(kind, deque())
+        recent = _recent_for(user_id)
+        for idx, candidate in enumerate(pool):
+            if _key(candidate) not in recent:
+                del pool[idx]
+                recent.append(_key(candidate))
+                _stats["hits"] += 1
+                if len(pool) < PREFETCH_LOW_WATER:
+                    _refill_needed.set()
+                return candidate
+        _refill_needed.set()
+    return None
+
+async def _generate_into(kind: str) -> bool:
+    try:
+        text = await _generators[kind]()
+    except Exception as e:
+        log.warning(f"Prefetch generation failed for {kind}: {e}")
+        return False
+    if not text:
+        return False
+
+    with _lock:
+        pool = _pools[kind]
+        # Одинаковые ответы (в том числе фолбэки при сбое GPT) в пул не кладём
+        if any(_key(text) == _key(existing) for existing in pool):
+            _stats["duplicates"] += 1
+            return False
+        pool.append(text)
+        _stats["generated"] += 1
+    return True
+
+async def _refill(kind: str) -> bool:
+    with _lock:
+        deficit = PREFETCH_TARGET - len(_pools[kind])
+    if deficit <= 0:
+        return True
+    results = await asyncio.gather(*(_generate_into(kind) for _ in range(deficit)))
+    return all(results)
+
+async def _refill_loop():
+    while True:
+        _refill_needed.clear()
+        results = await asyncio.gather(*(_refill(kind) for kind in list(_generators)))
+        if not all(results):
+            await asyncio.sleep(REFILL_BACKOFF)
+        await asyncio.to_thread(_refill_needed.wait, REFILL_INTERVAL)
+
+def start():
+    """Запустить фоновую дозаправку пула в отдельном потоке со своим event loop"""
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=lambda: asyncio.run(_refill_loop()),
+                               name="scene-prefetch", daemon=True)
+    _thread.start()
+    log.info(f"Scene prefetch started: kinds={list(_generators)}, target={PREFETCH_TARGET}")
+
+def get_stats() -> Dict[str, Any]:
+    """Размеры пулов и попадания"""
+    with _lock:
+        sizes = {kind: len(pool) for kind, pool in _pools.items()}
+    return {**_stats, "pools": sizes}
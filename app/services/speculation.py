@@ -0,0 +1,145 @@
+"""
+Спекулятивные шаги умного помощника
+Пока пользователь читает сцену и нажимает кнопки, следующий шаг (фраза, JSON-промт)
+уже считается в фоне. Результат привязан к отпечатку входных данных: если пользователь
+поменял сцену/стиль/фразу/ориентацию — спекуляция отменяется и шаг считается вживую.
+
+Задачи выполняются в отдельном потоке со своим event loop, чтобы фоновые запросы
+не занимали loop, в котором обрабатываются апдейты.
+Расходы ограничены бюджетом спекулятивных запусков на пользователя в час.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+log = logging.getLogger("speculation")
+
+SPECULATION_BUDGET_PER_HOUR = int(os.getenv("SPECULATION_BUDGET_PER_HOUR", "30"))  # 0 — выключено
+CLAIM_TIMEOUT = float(os.getenv("SPECULATION_CLAIM_TIMEOUT", "20"))  # сколько ждать недосчитанный шаг
+BUDGET_WINDOW = 3600
+MAX_TRACKED_USERS = 5000
+
+_tasks: Dict[Tuple[int, str], Tuple[str, Future]] = {}
+_spend: "OrderedDict[int, Deque[float]]" = OrderedDict()
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_stats: Dict[str, int] = {"started": 0, "hits": 0, "misses": 0, "discarded": 0, "over_budget": 0}
+
+def _fingerprint(key: Any) -> str:
+    raw = json.dumps(key, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _ensure_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    if _thread and _thread.is_alive():
+        return _loop
+    _loop = asyncio.new_event_loop()
+    _thread = threading.Thread(target=_loop.run_forever, name="speculation", daemon=True)
+    _thread.start()
+    return _loop
+
+def _take_budget(user_id: int) -> bool:
+    """Списать один спекулятивный запуск из часового бюджета пользователя"""
+    now = time.monotonic()
+    spent = _spend.get(user_id)
+    if spent is None:
+        spent = _spend[user_id] = deque()
+        if len(_spend) > MAX_TRACKED_USERS:
+            _spend.popitem(last=False)
+    else:
+        _spend.move_to_end(user_id)
+    while spent and now - spent[0] > BUDGET_WINDOW:
+        spent.popleft()
+    if len(spent) >= SPECULATION_BUDGET_PER_HOUR:
+        return False
+    spent.append(now)
+    return True
+
+def speculate(user_id: int, kind: str, key: Any, factory: Callable[[], Awaitable[Any]]) -> bool:
+    """
+    Запустить шаг заранее
+
+    Args:
+        kind: Шаг (replica, json)
+        key: Входные данные шага; claim() отдаст результат только при том же key
+        factory: Создаёт корутину шага
+
+    Returns:
+        True, если шаг считается (в том числе уже был запущен с тем же key)
+    """
+    fingerprint = _fingerprint(key)
+    with _lock:
+        current = _tasks.get((user_id, kind))
+        if current and current[0] == fingerprint and not current[1].cancelled():
+            return True
+        if current:
+            # Пользователь свернул в сторону — старый результат больше не нужен
+            current[1].cancel()
+            del _tasks[(user_id, kind)]
+            _stats["discarded"] += 1
+        if not _take_budget(user_id):
+            _stats["over_budget"] += 1
+            return False
+        future = asyncio.run_coroutine_threadsafe(factory(), _ensure_loop())
+        _tasks[(user_id, kind)] = (fingerprint, future)
+        _stats["started"] += 1
+    return True
+
+async def claim(user_id: int, kind: str, key: Any, timeout: float = CLAIM_TIMEOUT) -> Optional[Any]:
+    """
+    Забрать результат спекуляции, если он посчитан для тех же входных данных
+
+    Returns:
+        Результат или None (не запускался, устарел, упал, не успел) — тогда шаг считается вживую
+    """
+    with _lock:
+        current = _tasks.pop((user_id, kind), None)
+    if current is None:
+        _stats["misses"] += 1
+        return None
+
+    fingerprint, future = current
+    if fingerprint != _fingerprint(key) or future.cancelled():
+        future.cancel()
+        _stats["discarded"] += 1
+        _stats["misses"] += 1
+        return None
+
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except Exception as e:
+        log.info(f"Speculative {kind} for user {user_id} not used: {e!r}")
+        _stats["misses"] += 1
+        return None
+
+    if not result:
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    return result
+
+def discard(user_id: int, kind: Optional[str] = None):
+    """Отменить спекуляции пользователя (все или одного шага)"""
+    with _lock:
+        keys = [k for k in _tasks if k[0] == user_id and (kind is None or k[1] == kind)]
+        for k in keys:
+            _tasks.pop(k)[1].cancel()
+            _stats["discarded"] += 1
+
+def get_stats() -> Dict[str, Any]:
+    """Счётчики спекуляций"""
+    with _lock:
+        pending = sum(1 for _, future in _tasks.values() if not future.done())
+    total = _stats["hits"] + _stats["misses"]
+    return {**_stats, "pending": pending,
+            "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0,
+            "budget_per_hour": SPECULATION_BUDGET_PER_HOUR}
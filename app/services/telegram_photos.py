@@ -0,0 +1,110 @@
+"""
+Загрузка входящих фото из Telegram
+- размер PhotoSize выбирается под функцию: трансформациям хватает наименьшего размера
+  не меньше того, что реально использует модель, примерке нужен самый большой
+- скачанное кэшируется по file_unique_id (то же фото, присланное повторно, не качается)
+- байты отдаются тем же объектом, что вернул HTTP-клиент, без bytearray и bytes(...)
+- несколько фото качаются параллельно
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.services.image_normalize import MAX_SIDE
+
+log = logging.getLogger("telegram-photos")
+
+PHOTO_CACHE_MAX_BYTES = int(os.getenv("PHOTO_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Нужная сторона кадра по функциям; None — самый большой размер
+TARGET_SIDE: Dict[str, Optional[int]] = {
+    "transform": MAX_SIDE["transform"],
+    "background": MAX_SIDE["nano"],
+    "tryon": None,  # VTO чувствителен к деталям лица и ткани
+}
+
+_lock = threading.Lock()
+_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_cache_bytes = 0
+_stats: Dict[str, int] = {"downloads": 0, "cache_hits": 0, "bytes_downloaded": 0, "bytes_saved": 0}
+
+class _Capture:
+    """Приёмник для File.download_to_memory: запоминает ссылку на скачанные bytes без копирования"""
+
+    __slots__ = ("data",)
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes) -> int:
+        self.data = data
+        return len(data)
+
+def pick_size(sizes: Sequence[Any], feature: str) -> Any:
+    """
+    Выбрать PhotoSize под функцию
+
+    Args:
+        sizes: update.message.photo (от меньшего к большему)
+        feature: transform | background | tryon
+    """
+    largest = sizes[-1]
+    target = TARGET_SIDE.get(feature)
+    if not target:
+        return largest
+    for size in sizes:
+        if max(size.width, size.height) >= target:
+            if size is not largest:
+                with _lock:
+                    _stats["bytes_saved"] += max(0, (largest.file_size or 0) - (size.file_size or 0))
+            return size
+    return largest
+
+def _cache_get(file_unique_id: str) -> Optional[bytes]:
+    with _lock:
+        data = _cache.get(file_unique_id)
+        if data is not None:
+            _cache.move_to_end(file_unique_id)
+            _stats["cache_hits"] += 1
+        return data
+
+def _cache_put(file_unique_id: str, data: bytes):
+    global _cache_bytes
+    with _lock:
+        if file_unique_id in _cache:
+            return
+        _cache[file_unique_id] = data
+        _cache_bytes += len(data)
+        while _cache_bytes > PHOTO_CACHE_MAX_BYTES and _cache:
+            _, old = _cache.popitem(last=False)
+            _cache_bytes -= len(old)
+
+async def fetch(bot, size: Any) -> bytes:
+    """Скачать PhotoSize (или взять из кэша по file_unique_id)"""
+    cached = _cache_get(size.file_unique_id)
+    if cached is not None:
+        return cached
+    file = await bot.get_file(size.file_id)
+    capture = _Capture()
+    await file.download_to_memory(out=capture)
+    data = capture.data
+    _cache_put(size.file_unique_id, data)
+    with _lock:
+        _stats["downloads"] += 1
+        _stats["bytes_downloaded"] += len(data)
+    return data
+
+async def fetch_photos(bot, photos: Sequence[Sequence[Any]], feature: str) -> List[bytes]:
+    """Скачать несколько фото (списки PhotoSize из сообщений) параллельно"""
+    return list(await asyncio.gather(*(fetch(bot, pick_size(sizes, feature)) for sizes in photos)))
+
+def get_stats() -> Dict[str, Any]:
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["cached"] = len(_cache)
+        stats["cache_bytes"] = _cache_bytes
+    return stats
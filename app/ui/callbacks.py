@@ -91,6 +91,7 @@ class Actions:
     MENU_GUIDES = "guides"
     MENU_PROFILE = "profile"
     MENU_HISTORY = "history"
+    MEDIA_RESEND = "media_resend"
     
     # Режимы генерации
     MODE_HELPER = "helper"
@@ -24,6 +24,8 @@ T = {
         "btn.guides": "📚 Гайды / Инструкции",
         "btn.profile": "👤 Профиль / Баланс",
         "btn.history": "📜 История",
+        "btn.send_again": "🔁 Отправить ещё раз",
+        "btn.history_more": "⬇️ Ещё",
         "btn.back": "⬅️ Назад",
         "btn.home": "🏠 Главное меню",
         "btn.cancel": "❌ Отмена",
@@ -150,6 +152,11 @@ T = {
         "action.edit_from_last": "✏️ Редактировать последнее",
         "action.refine_prompt": "✨ Улучшить промпт",
         
+        # История генераций
+        "history.title": "📜 История генераций\n\nНажмите на результат, чтобы получить его ещё раз:",
+        "history.empty": "📜 История пока пуста. Сгенерируйте первое видео или фото!",
+        "history.not_found": "Результат не найден или недоступен.",
+
         # Сообщения об ошибках
         "error.button_outdated": "Кнопка устарела. Открою меню.",
         "error.low_coins": "💰 Недостаточно монеток",
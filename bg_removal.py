@@ -1,9 +1,245 @@
 """
-Заглушка для bg_removal - модуль для удаления фона
+Локальное удаление фона на CPU
+Вместо платного запроса в Gemini (10–60 с) сегментация считается на месте (~1 с):
+- если установлен onnxruntime и задан BG_REMOVAL_ONNX_MODEL (U2Net/ISNet/MODNet) — маска из модели;
+- иначе классическая сегментация на NumPy/Pillow: модель цвета фона по краям кадра,
+  порог Otsu, заливка фона от краёв, уточнение кромки по расстоянию до фона.
+Работа идёт в общем пуле процессов executors «cpu», чтобы не держать GIL бота.
+Результат: PNG с прозрачным фоном + JPG на зелёном фоне (chroma key).
 """
 
-from typing import Any
+import os
+import io
+import logging
+from typing import Tuple
 
-def remove_background_complete(*args, **kwargs) -> Any:
-    """Заглушка для удаления фона"""
-    return None
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from app.services import executors
+
+log = logging.getLogger("bg-removal")
+
+BG_REMOVAL_TIMEOUT = int(os.getenv("BG_REMOVAL_TIMEOUT", "60"))
+BG_REMOVAL_ONNX_MODEL = os.getenv("BG_REMOVAL_ONNX_MODEL", "")
+# Если локальная сегментация не справилась — идём в Gemini (платный round trip)
+BG_REMOVAL_UPSTREAM_FALLBACK = os.getenv("BG_REMOVAL_UPSTREAM_FALLBACK", "1") == "1"
+
+MAX_SIDE = 2048  # больше Telegram всё равно не пришлёт
+WORK_SIDE = {"basic": 384, "premium": 640}  # размер, на котором строится маска
+BORDER_FRACTION = 0.03  # полоса по краям кадра для модели фона
+BG_CLUSTERS = 4
+MIN_BG_DISTANCE = 18.0  # нижняя граница порога (в единицах YCbCr)
+CHROMA_GREEN = (0, 177, 64)
+
+_onnx_session = None  # кэш сессии внутри процесса-воркера
+
+# -----------------------------------------------------------------------------
+# Маска: классическая сегментация
+# -----------------------------------------------------------------------------
+def _to_ycbcr(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert("YCbCr"), dtype=np.float32)
+
+def _border_pixels(arr: np.ndarray) -> np.ndarray:
+    h, w = arr.shape[:2]
+    b = max(2, int(min(h, w) * BORDER_FRACTION))
+    return np.concatenate([
+        arr[:b].reshape(-1, 3), arr[-b:].reshape(-1, 3),
+        arr[b:-b, :b].reshape(-1, 3), arr[b:-b, -b:].reshape(-1, 3),
+    ])
+
+def _kmeans(samples: np.ndarray, k: int, iterations: int = 8) -> np.ndarray:
+    """Центры цветов фона (детерминированная инициализация по квантилям яркости)"""
+    order = np.argsort(samples[:, 0])
+    centers = samples[order[np.linspace(0, len(order) - 1, k).astype(int)]].copy()
+    for _ in range(iterations):
+        labels = np.argmin(((samples[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+        for c in range(k):
+            members = samples[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+    return centers
+
+def _bg_distance(arr: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Расстояние до ближайшего цвета фона; яркость весит меньше — устойчивее к теням"""
+    weights = np.array([0.5, 1.0, 1.0], dtype=np.float32)
+    best = None
+    for center in centers:
+        d = (((arr - center) ** 2) * weights).sum(-1)
+        best = d if best is None else np.minimum(best, d)
+    return np.sqrt(best)
+
+def _otsu(values: np.ndarray) -> float:
+    hist, edges = np.histogram(values, bins=256)
+    hist = hist.astype(np.float64)
+    mids = (edges[:-1] + edges[1:]) / 2
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m0 = np.cumsum(hist * mids)
+    mu0 = m0 / np.maximum(w0, 1)
+    mu1 = (m0[-1] - m0) / np.maximum(w1, 1)
+    between = w0 * w1 * (mu0 - mu1) ** 2
+    return float(mids[int(np.argmax(between))])
+
+def _dilate(mask: np.ndarray, size: int = 3) -> np.ndarray:
+    img = Image.fromarray(mask.astype(np.uint8) * 255)
+    return np.asarray(img.filter(ImageFilter.MaxFilter(size))) > 127
+
+def _erode(mask: np.ndarray, size: int = 3) -> np.ndarray:
+    img = Image.fromarray(mask.astype(np.uint8) * 255)
+    return np.asarray(img.filter(ImageFilter.MinFilter(size))) > 127
+
+def _spread_along_rows(seed: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Распространить seed на целые горизонтальные отрезки candidate, которых он касается"""
+    starts = candidate.copy()
+    starts[:, 1:] &= ~candidate[:, :-1]
+    runs = (np.cumsum(starts.ravel()) * candidate.ravel()).reshape(candidate.shape)
+    touched = np.bincount(runs[seed & candidate], minlength=int(runs.max()) + 1) > 0
+    touched[0] = False
+    return touched[runs]
+
+def _flood_background(candidate: np.ndarray) -> np.ndarray:
+    """
+    Фон = похожие на фон пиксели, связанные с краем кадра (дыры внутри объекта не трогаем).
+    Заливка отрезками строк и столбцов по очереди — сходится за несколько проходов.
+    """
+    seed = np.zeros_like(candidate)
+    seed[0, :] = seed[-1, :] = True
+    seed[:, 0] = seed[:, -1] = True
+    seed &= candidate
+    while True:
+        grown = _spread_along_rows(seed, candidate)
+        grown = _spread_along_rows(grown.T, candidate.T).T
+        if np.array_equal(grown, seed):
+            return seed
+        seed = grown
+
+def _classic_mask(img: Image.Image, work_side: int) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Returns:
+        (жёсткая маска объекта на рабочем размере, центры фона, порог)
+    """
+    work = img.copy()
+    work.thumbnail((work_side, work_side), Image.BILINEAR)
+    arr = _to_ycbcr(work)
+    centers = _kmeans(_border_pixels(arr), BG_CLUSTERS)
+    dist = _bg_distance(arr, centers)
+    threshold = max(_otsu(dist), MIN_BG_DISTANCE)
+
+    background = _flood_background(dist < threshold)
+    # Открытие убирает мелкие островки, закрытие — зазубрины по контуру
+    fg = _dilate(_erode(~background))
+    fg = _erode(_dilate(fg))
+    return fg, centers, threshold
+
+def _refine_alpha(img: Image.Image, mask: np.ndarray, centers: np.ndarray, threshold: float) -> np.ndarray:
+    """Альфа в полный размер: в полосе вдоль контура прозрачность берём из расстояния до фона"""
+    w, h = img.size
+    soft = np.asarray(
+        Image.fromarray(mask.astype(np.uint8) * 255).resize((w, h), Image.BILINEAR)
+        .filter(ImageFilter.GaussianBlur(2)),
+        dtype=np.float32,
+    ) / 255.0
+    band = (soft > 0.02) & (soft < 0.98)
+    alpha = soft.copy()
+    if band.any():
+        dist = _bg_distance(_to_ycbcr(img)[band], centers)
+        by_color = np.clip((dist - threshold * 0.5) / threshold, 0.0, 1.0)
+        alpha[band] = 0.5 * by_color + 0.5 * soft[band]
+    return alpha
+
+# -----------------------------------------------------------------------------
+# Маска: ONNX (опционально)
+# -----------------------------------------------------------------------------
+def _onnx_available() -> bool:
+    if not BG_REMOVAL_ONNX_MODEL or not os.path.exists(BG_REMOVAL_ONNX_MODEL):
+        return False
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _onnx_alpha(img: Image.Image) -> np.ndarray:
+    global _onnx_session
+    import onnxruntime as ort
+
+    if _onnx_session is None:
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1  # параллелизм даёт пул процессов
+        _onnx_session = ort.InferenceSession(BG_REMOVAL_ONNX_MODEL, opts, providers=["CPUExecutionProvider"])
+    inp = _onnx_session.get_inputs()[0]
+    side = inp.shape[-1] if isinstance(inp.shape[-1], int) else 320
+
+    x = np.asarray(img.resize((side, side), Image.BILINEAR), dtype=np.float32) / 255.0
+    x = (x - np.array([0.485, 0.456, 0.406], dtype=np.float32)) / np.array([0.229, 0.224, 0.225], dtype=np.float32)
+    pred = _onnx_session.run(None, {inp.name: x.transpose(2, 0, 1)[None]})[0]
+    pred = np.squeeze(pred).astype(np.float32)
+    pred = (pred - pred.min()) / max(float(pred.max() - pred.min()), 1e-6)
+
+    w, h = img.size
+    alpha = np.asarray(Image.fromarray((pred * 255).astype(np.uint8)).resize((w, h), Image.BILINEAR),
+                       dtype=np.float32) / 255.0
+    return np.clip((alpha - 0.1) / 0.8, 0.0, 1.0)
+
+# -----------------------------------------------------------------------------
+# Сборка результата
+# -----------------------------------------------------------------------------
+def _load(image_bytes: bytes) -> Image.Image:
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert("RGB")
+    img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    return img
+
+def _encode(img: Image.Image, alpha: np.ndarray) -> Tuple[bytes, bytes]:
+    alpha_img = Image.fromarray((alpha * 255).round().astype(np.uint8))
+
+    png = img.copy()
+    png.putalpha(alpha_img)
+    png_buf = io.BytesIO()
+    png.save(png_buf, format="PNG", compress_level=6)
+
+    green = Image.new("RGB", img.size, CHROMA_GREEN)
+    jpg_buf = io.BytesIO()
+    Image.composite(img, green, alpha_img).save(jpg_buf, format="JPEG", quality=95, subsampling=0)
+    return png_buf.getvalue(), jpg_buf.getvalue()
+
+def _remove_background_local(image_bytes: bytes, quality: str = "basic") -> Tuple[bytes, bytes]:
+    """Выполняется в процессе-воркере"""
+    img = _load(image_bytes)
+    if _onnx_available():
+        alpha = _onnx_alpha(img)
+    else:
+        mask, centers, threshold = _classic_mask(img, WORK_SIDE.get(quality, WORK_SIDE["basic"]))
+        coverage = float(mask.mean())
+        if not 0.01 < coverage < 0.99:
+            raise ValueError(f"Segmentation failed: foreground coverage {coverage:.3f}")
+        alpha = _refine_alpha(img, mask, centers, threshold)
+    return _encode(img, alpha)
+
+def _upstream_fallback(image_bytes: bytes, quality: str) -> Tuple[bytes, bytes]:
+    """Удаление фона через Gemini; зелёный JPG собираем локально из его PNG"""
+    from app.services.clients.transforms_client import remove_background
+
+    png_bytes = remove_background(image_bytes, quality)
+    png = Image.open(io.BytesIO(png_bytes)).convert("RGBA")
+    alpha = np.asarray(png.getchannel("A"), dtype=np.float32) / 255.0
+    return _encode(png.convert("RGB"), alpha)
+
+def remove_background_complete(image_bytes: bytes, quality: str = "basic") -> Tuple[bytes, bytes]:
+    """
+    Удалить фон с фото (блокирующий вызов: запускать через executors.run("upstream", ...))
+
+    Args:
+        image_bytes: байты исходного изображения
+        quality: "basic" или "premium" (маска строится на большем разрешении)
+
+    Returns:
+        (PNG с прозрачным фоном, JPG на зелёном фоне)
+    """
+    try:
+        return executors.get("cpu").submit(_remove_background_local, image_bytes, quality).result(timeout=BG_REMOVAL_TIMEOUT)
+    except Exception as e:
+        if not BG_REMOVAL_UPSTREAM_FALLBACK:
+            raise
+        log.warning("Local background removal failed (%s), falling back to upstream", e)
+        return _upstream_fallback(image_bytes, quality)
@@ -24,8 +24,9 @@ import time
 from datetime import datetime
 from email.mime.text import MIMEText
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable
 from collections import defaultdict
+from functools import partial
 
 from dotenv import load_dotenv
 import os
@@ -39,6 +40,7 @@ from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
     MessageHandler, ContextTypes, filters
 )
+from telegram.error import RetryAfter
 
 # Импорты для работы с базой данных и биллингом
 from app.db.queries import db_manager
@@ -307,18 +309,11 @@ def format_topup_packs() -> str:
 # -----------------------------------------------------------------------------
 # GPT
 # -----------------------------------------------------------------------------
-from openai import OpenAI
-gpt: Optional[OpenAI] = None
-if OPENAI_API_KEY:
-    try:
-        gpt = OpenAI(api_key=OPENAI_API_KEY)
-        log.info("OpenAI GPT активирован. Модель: %s", OPENAI_MODEL)
-    except Exception as e:
-        log.error("OpenAI init error: %s", e)
-        gpt = None
+from app.services.clients import gpt_client
+if gpt_client.configure(OPENAI_API_KEY, OPENAI_MODEL):
+    log.info("OpenAI GPT активирован. Модель: %s", OPENAI_MODEL)
 else:
     log.warning("OPENAI_API_KEY не установлен - GPT функции недоступны")
-    gpt = None
 
 def _sanitize(text: str) -> str:
     if not text:
@@ -429,20 +424,73 @@ def _clean_replica(text: str) -> str:
     return text.strip()
 
 
-def _gpt(system: str, user: str, temperature=0.65, max_tokens=220) -> Optional[str]:
-    if not gpt:
-        return None
-    try:
-        r = gpt.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "system", "content": system},
-                      {"role": "user", "content": user}],
-            temperature=temperature, max_tokens=max_tokens,
-        )
-        return _sanitize((r.choices[0].message.content or "").strip())
-    except Exception as e:
-        log.error("GPT error: %s", e)
+async def _gpt(system: str, user: str, temperature=0.65, max_tokens=220,
+               cache_max_temperature: Optional[float] = None,
+               fallback: Optional[Callable[[], str]] = None, label: str = "default") -> Optional[str]:
+    """
+    Запрос к GPT. С fallback вызов хеджируется: если GPT не уложился в дедлайн
+    (p95 задержек этого label), сразу возвращаем локальный шаблон.
+    """
+    if fallback is not None:
+        text = await gpt_client.complete_hedged(system, user, fallback, temperature=temperature,
+                                                max_tokens=max_tokens, label=label,
+                                                cache_max_temperature=cache_max_temperature)
+        return _sanitize(text.strip()) or fallback()
+    text = await gpt_client.complete(system, user, temperature=temperature, max_tokens=max_tokens,
+                                     cache_max_temperature=cache_max_temperature)
+    if text is None:
         return None
+    return _sanitize(text.strip())
+
+# -----------------------------------------------------------------------------
+# ПОТОКОВЫЙ ВЫВОД GPT
+# Текст появляется в сообщении по мере генерации. Telegram ограничивает частоту
+# редактирования, поэтому правим сообщение не чаще раза в STREAM_EDIT_INTERVAL секунд.
+# -----------------------------------------------------------------------------
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TELEGRAM_TEXT_LIMIT = 4096
+STREAM_CURSOR = " ▌"
+
+def _stream_editor(message, header: str = "") -> Callable[[str], Any]:
+    """Колбэк для gpt_client.stream: редактирует message с троттлингом"""
+    state = {"next_at": 0.0, "shown": None}
+
+    async def on_delta(text: str):
+        now = time.monotonic()
+        if now < state["next_at"]:
+            return
+        body = (header + text)[:TELEGRAM_TEXT_LIMIT - len(STREAM_CURSOR)] + STREAM_CURSOR
+        if body == state["shown"]:
+            return
+        state["next_at"] = now + STREAM_EDIT_INTERVAL
+        try:
+            await message.edit_text(body)
+            state["shown"] = body
+        except RetryAfter as e:
+            # Превысили лимит — молчим, сколько просит Telegram
+            state["next_at"] = time.monotonic() + float(e.retry_after)
+        except Exception as e:
+            log.debug(f"Stream edit skipped: {e}")
+
+    return on_delta
+
+async def _gpt_stream(system: str, user: str, on_delta, temperature=0.65, max_tokens=220,
+                      cache_max_temperature: Optional[float] = None,
+                      fallback: Optional[Callable[[], str]] = None, label: str = "default") -> Optional[str]:
+    """
+    Потоковый аналог _gpt: промежуточный текст уходит в on_delta,
+    итог проверяется один раз в конце (очистка, пустой ответ → fallback)
+    """
+    text = await gpt_client.stream(
+        [{"role": "system", "content": system},
+         {"role": "user", "content": user}],
+        temperature=temperature, max_tokens=max_tokens, on_delta=on_delta,
+        cache_max_temperature=cache_max_temperature, label=label,
+    )
+    text = _sanitize(text.strip()) if text else text
+    if not text and fallback is not None:
+        return fallback()
+    return text
 
 # -----------------------------------------------------------------------------
 # EMAIL + ADMIN NOTIFY
@@ -578,7 +626,11 @@ def style_instructions(style_name: Optional[str]) -> str:
 # -----------------------------------------------------------------------------
 # СЦЕНАРНЫЕ ХЕЛПЕРЫ
 # -----------------------------------------------------------------------------
-def improve_scene(user_text: str, mode: str = "normal") -> str:
+# Улучшения с температурой не выше порога кэшируются: повторное «улучшить» той же
+# сцены отдаётся без запроса к GPT. «Усложнить»/«абсурд» должны давать новые варианты.
+IMPROVE_CACHE_MAX_TEMPERATURE = 0.65
+
+async def improve_scene(user_text: str, mode: str = "normal", use_cache: bool = True, on_delta=None) -> str:
     style = {
         "normal": "Сделай рабочую сцену.",
         "complex": "Добавь деталей, сделай сцену насыщеннее и визуально сложнее.",
@@ -593,12 +645,19 @@ def improve_scene(user_text: str, mode: str = "normal") -> str:
         f"{style} Напиши 1–2 коротких предложения, описывающих ОДНУ сцену."
     )
     temp = {"normal": 0.65, "complex": 0.85, "simple": 0.55, "absurd": 0.9}[mode]
-    return _gpt(sys, user_text, temperature=temp, max_tokens=140) or _sanitize(user_text)
-
-def improve_scene_with_phrase(scene_text: str, phrase: str, mode: str = "complex") -> str:
+    if on_delta is not None:
+        # Пользователь видит сцену по мере генерации — хеджировать шаблоном незачем
+        return await _gpt_stream(sys, user_text, on_delta, temperature=temp, max_tokens=140,
+                                 cache_max_temperature=IMPROVE_CACHE_MAX_TEMPERATURE if use_cache else None,
+                                 fallback=lambda: _sanitize(user_text), label=f"improve_{mode}")
+    return await _gpt(sys, user_text, temperature=temp, max_tokens=140,
+                      cache_max_temperature=IMPROVE_CACHE_MAX_TEMPERATURE if use_cache else None,
+                      fallback=lambda: _sanitize(user_text), label=f"improve_{mode}")
+
+async def improve_scene_with_phrase(scene_text: str, phrase: str, mode: str = "complex") -> str:
     """Улучшает сцену, сохраняя фразу"""
     if not phrase:
-        return improve_scene(scene_text, mode)
+        return await improve_scene(scene_text, mode)
     
     # Извлекаем фразу из сцены, если она там есть
     import re
@@ -607,7 +666,7 @@ def improve_scene_with_phrase(scene_text: str, phrase: str, mode: str = "complex
     scene_without_phrase = re.sub(quote_pattern, '', scene_text).strip()
     
     # Улучшаем сцену без фразы
-    improved_scene = improve_scene(scene_without_phrase, mode)
+    improved_scene = await improve_scene(scene_without_phrase, mode)
     
     # Встраиваем фразу обратно
     embed_prompt = (
@@ -625,19 +684,14 @@ def improve_scene_with_phrase(scene_text: str, phrase: str, mode: str = "complex
     )
     
     try:
-        if not gpt:
+        if not gpt_client.is_configured():
 
             replica = "Да сама довезу без принцев обойдусь!"
 
         else:
 
-            resp = gpt.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": embed_prompt}],
-            max_tokens=200,
-            temperature=0.7,
-        )
-        result = resp.choices[0].message.content.strip() if resp else ""
+            resp = await gpt_client.chat([{"role": "user", "content": embed_prompt}], max_tokens=200, temperature=0.7)
+        result = resp.strip() if resp else ""
         
         # Очищаем результат от лишних строк
         lines = result.split('\n')
@@ -661,15 +715,56 @@ def improve_scene_with_phrase(scene_text: str, phrase: str, mode: str = "complex
         # Если не удалось встроить через GPT, просто добавляем в конец
         return f"{improved_scene}\n\nБабушка говорит: {phrase}"
 
-def suggest_replica(scene: str) -> Optional[str]:
+async def suggest_replica(scene: str) -> Optional[str]:
     sys = ("Придумай короткую фразу героя к сцене, 4–10 слов. Только сама фраза. "
            "Запрещены кавычки/тире/двоеточия/точка с запятой.")
-    return _gpt(sys, scene, temperature=0.9, max_tokens=35)
+    return await _gpt(sys, scene, temperature=0.9, max_tokens=35,
+                      fallback=_offline_replica, label="replica")
+
+# -----------------------------------------------------------------------------
+# ОФФЛАЙН-ШАБЛОНЫ (когда GPT медлит или недоступен)
+# -----------------------------------------------------------------------------
+OFFLINE_SCENES = {
+    "nkudo_single": [
+        "Пенсионерка во дворе деревенского дома толкает гигантскую тыкву-«карету», поправляет платок и хмыкает: «Да сама довезу без принцев обойдусь!». Тыква кренится на бок, и бабка едва не падает.",
+        "Старушка в клетчатом халате стоит у огорода рядом с огромным блестящим самоваром, натирает его щёткой и ворчит: «Чайку накипячу душу согрею, не спину». Самовар внезапно громко свистит, бабка отскакивает.",
+        "Пожилая женщина в спортивных штанах и жилетке проверяет воду в надувном бассейне, где плавает розовый фламинго размером с лодку. Она усмехается: «Кто без круга тот с гордостью плывёт!». Фламинго резко наклоняется, и бабка чуть не падает в воду.",
+    ],
+    "nkudo_reportage_scene1": [
+        "Журналистка в деревенском дворе говорит в камеру. На фоне бабушка расчёсывает енота",
+        "Журналистка у деревянного забора рассказывает в камеру о необычном хозяйстве. За ней бабушка кормит страуса из ведра",
+        "Журналистка во дворе с курятником говорит в камеру. На фоне бабушка выгуливает пингвина на верёвочке",
+    ],
+    "lego_single": [
+        "LEGO бабушка строит LEGO дом из LEGO кирпичей, но вместо цемента использует LEGO клей.",
+        "LEGO бабушка в ярком платке поливает LEGO цветы из LEGO лейки, в которой вместо воды LEGO конфетти.",
+        "LEGO бабушка катит по LEGO двору LEGO тачку с огромной LEGO морковкой и говорит: «Урожай в этом году кирпичный!».",
+    ],
+    "lego_reportage_scene1": [
+        "LEGO журналистка в LEGO дворе рассказывает о LEGO бабушке с LEGO котиком.",
+        "LEGO журналистка у LEGO забора говорит в камеру. На фоне LEGO бабушка кормит LEGO козу",
+    ],
+}
+
+OFFLINE_REPLICAS = [
+    "Вот и весь сказ",
+    "Так у нас в деревне принято",
+    "А вы как думали",
+    "Живём не тужим",
+    "Хозяйство надо держать в строгости",
+]
+
+def _offline_scene(kind: str) -> str:
+    return random.choice(OFFLINE_SCENES[kind])
+
+def _offline_replica() -> str:
+    return random.choice(OFFLINE_REPLICAS)
 
 # -----------------------------------------------------------------------------
 # NEUROKUDO
 # -----------------------------------------------------------------------------
-def generate_nkudo_single_scene() -> str:
+# hedge=False — для фонового пула сцен: там ждать GPT можно, а шаблоны в пул не нужны
+async def generate_nkudo_single_scene(hedge: bool = True) -> str:
     sys = (
         "Ты — генератор односценовых видео (ровно 8 секунд) в стиле Neurokudo: тёплый деревенский реализм + одна абсурдная деталь.\n"
         "Всегда выдай одну сцену на русском в ПОВЕСТВОВАТЕЛЬНОМ формате (никакого JSON, никаких заголовков).\n"
@@ -689,44 +784,136 @@ def generate_nkudo_single_scene() -> str:
         "Пожилая женщина в спортивных штанах и жилетке проверяет воду в надувном бассейне, где плавает розовый фламинго размером с лодку. Она усмехается: «Кто без круга тот с гордостью плывёт!». Фламинго резко наклоняется, и бабка чуть не падает в воду.\n\n"
         "Создай новую сцену в стиле NEUROKUDO в повествовательном формате:"
     )
-    return _gpt(sys, "Создай новую сцену в стиле NEUROKUDO на русском языке", temperature=0.75, max_tokens=200) or \
-           "Пенсионерка во дворе деревенского дома толкает гигантскую тыкву-«карету», поправляет платок и хмыкает: «Да сама довезу без принцев обойдусь!». Тыква кренится на бок, и бабка едва не падает."
+    return await _gpt(sys, "Создай новую сцену в стиле NEUROKUDO на русском языке", temperature=0.75, max_tokens=200,
+                      fallback=(lambda: _offline_scene("nkudo_single")) if hedge else None, label="nkudo_single") or \
+           _offline_scene("nkudo_single")
 
-def generate_nkudo_reportage_scene1() -> str:
+async def generate_nkudo_reportage_scene1(hedge: bool = True) -> str:
     sys = (
         "Репортаж. Сцена 1 (8 сек): русскоязычная журналистка (женщина, 25–40) в деревенском дворе, "
         "говорит короткую фразу в КАМЕРУ по-русски. На заднем плане бабушка с животным, "
         "которое выполняет ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
         "Животные БЕЗ ОДЕЖДЫ, только естественные действия. 1–2 предложения. Без кавычек/тире."
     )
-    return _gpt(sys, "Создай сцену 1", temperature=0.7, max_tokens=100) or \
-           "Журналистка в деревенском дворе говорит в камеру. На фоне бабушка расчёсывает енота"
+    return await _gpt(sys, "Создай сцену 1", temperature=0.7, max_tokens=100,
+                      fallback=(lambda: _offline_scene("nkudo_reportage_scene1")) if hedge else None,
+                      label="nkudo_reportage_scene1") or \
+           _offline_scene("nkudo_reportage_scene1")
+
+NKUDO_SCENE2_RULES = (
+    "Сцена 2 (8 сек): крупный план ТОЙ ЖЕ бабушки. Она отвечает по-русски и в конце "
+    "говорит короткую финальную фразу-бомбу (3–6 слов). "
+    "ВИЗУАЛЬНАЯ КОНТИНУИТИ: те же люди, одежда, двор, предметы/животное — повторить. "
+    "Животные выполняют ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
+)
+REPLICA_RULES = (
+    "replica — короткая финальная фраза бабушки (ОДНО полное предложение, максимум 20 слов). "
+    "Без кавычек, тире, дефисов, длинных тире (—, -, –) и двоеточий."
+)
+
+# -----------------------------------------------------------------------------
+# РЕПОРТАЖ ОДНИМ СТРУКТУРИРОВАННЫМ ЗАПРОСОМ
+# Сцены и фраза приходят одним JSON по схеме вместо цепочки scene1 → scene2 → replica:
+# один round trip и никакого разбора кавычек. Каждое поле проверяется отдельно,
+# невалидное заменяется своим фолбэком, остальные ответы GPT сохраняются.
+# -----------------------------------------------------------------------------
+REPORTAGE_SCENE_MAX_CHARS = 600
+REPORTAGE_REPLICA_MAX_WORDS = 20
+
+def _reportage_schema(fields: List[str]) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {name: {"type": "string"} for name in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+def _valid_scene(value: Any) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip().strip('"«»').strip()
+    if not value or len(value) > REPORTAGE_SCENE_MAX_CHARS:
+        return None
+    return value
+
+def _valid_replica(value: Any) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    value = _clean_replica(value.strip().strip('"«»'))
+    if not value or len(value.split()) > REPORTAGE_REPLICA_MAX_WORDS:
+        return None
+    return value
+
+# Запас на JSON-обвязку и длинные сцены: обрезанный ответ целиком уходит в фолбэки
+REPORTAGE_MAX_TOKENS = int(os.getenv("REPORTAGE_MAX_TOKENS", "700"))
+
+async def _reportage_structured(sys: str, user: str, fallbacks: Dict[str, Callable[[], str]],
+                                label: str, temperature: float = 0.75) -> Dict[str, str]:
+    """
+    Один structured-output запрос за несколько частей репортажа
 
-def generate_nkudo_reportage_scene2(context_scene1: str) -> tuple[str, str]:
+    Args:
+        fallbacks: поле → фолбэк; порядок задаёт поля схемы (scene1/scene2/replica)
+    """
+    fields = list(fallbacks)
+    data = await gpt_client.complete_json(
+        sys, user, _reportage_schema(fields), name=label,
+        temperature=temperature, max_tokens=REPORTAGE_MAX_TOKENS, label=label,
+    ) or {}
+    if not data:
+        # Причина (ошибка, тайм-аут, обрезка по max_tokens) уже учтена в метриках gpt_client
+        log.warning(f"Structured {label}: no answer, using fallbacks")
+
+    result = {}
+    for name in fields:
+        check = _valid_replica if name == "replica" else _valid_scene
+        value = check(data.get(name))
+        if value is None:
+            if data:
+                log.warning(f"Structured {label}: field {name} invalid, using fallback")
+            value = fallbacks[name]()
+        result[name] = value
+    return result
+
+async def generate_nkudo_reportage_scene2(context_scene1: str) -> tuple[str, str]:
     sys = (
-        "Репортаж. Сцена 2 (8 сек): крупный план ТОЙ ЖЕ бабушки. Она отвечает по-русски и в конце "
-        "говорит короткую финальную фразу-бомбу (3–6 слов). "
-        "ВИЗУАЛЬНАЯ КОНТИНУИТИ: те же люди, одежда, двор, предметы/животное — повторить. "
-        "Животные выполняют ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
-        "СТРОГО ЗАПРЕЩЕНО: никаких тире, дефисов или длинных тире (—, -, –) в фразе!"
+        "Репортаж. " + NKUDO_SCENE2_RULES +
+        "Ответь JSON: scene2 — описание сцены 2; " + REPLICA_RULES
     )
-    s2 = _gpt(sys, f"Контекст (сцена 1): {context_scene1}", temperature=0.75, max_tokens=120) or \
-         "Бабушка в том же дворе, рядом енот; отвечает уверенно и говорит: Вот и весь сказ"
-    
-    # Генерируем фразу отдельно с запретом на тире
-    replica_sys = "Короткая финальная фраза бабушки (ОДНО полное предложение, максимум 20 слов). Без кавычек, тире, дефисов, длинных тире (—, -, –) и двоеточий."
-    short = _gpt(replica_sys, f"Контекст сцены: {s2}", temperature=0.8, max_tokens=35) or "Вот и весь сказ"
-    short = _clean_replica(short)
-    
-    return s2, short
+    parts = await _reportage_structured(
+        sys, f"Контекст (сцена 1): {context_scene1}",
+        {"scene2": lambda: "Бабушка в том же дворе, рядом енот; отвечает уверенно и говорит: Вот и весь сказ",
+         "replica": _offline_replica},
+        label="nkudo_reportage_scene2",
+    )
+    return parts["scene2"], parts["replica"]
+
+async def generate_nkudo_reportage(user_id: Optional[int] = None) -> tuple[str, str, str]:
+    # Готовая сцена 1 из пула — достраиваем сцену 2 и фразу одним запросом
+    s1 = scene_prefetch.try_take("nkudo_reportage_scene1", user_id) if user_id else None
+    if s1:
+        s2, rep = await generate_nkudo_reportage_scene2(s1)
+        return s1, s2, rep
 
-def generate_nkudo_reportage() -> tuple[str, str, str]:
-    s1 = generate_nkudo_reportage_scene1()
-    s2, rep = generate_nkudo_reportage_scene2(s1)
-    return s1, s2, rep
+    sys = (
+        "Репортаж из двух сцен. Сцена 1 (8 сек): русскоязычная журналистка (женщина, 25–40) в деревенском дворе, "
+        "говорит короткую фразу в КАМЕРУ по-русски. На заднем плане бабушка с животным, "
+        "которое выполняет ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
+        "Животные БЕЗ ОДЕЖДЫ, только естественные действия. 1–2 предложения. Без кавычек/тире.\n"
+        + NKUDO_SCENE2_RULES + "\n"
+        "Ответь JSON: scene1 — сцена 1, scene2 — сцена 2; " + REPLICA_RULES
+    )
+    parts = await _reportage_structured(
+        sys, "Создай репортаж",
+        {"scene1": lambda: _offline_scene("nkudo_reportage_scene1"),
+         "scene2": lambda: "Бабушка в том же дворе, рядом енот; отвечает уверенно и говорит: Вот и весь сказ",
+         "replica": _offline_replica},
+        label="nkudo_reportage",
+    )
+    return parts["scene1"], parts["scene2"], parts["replica"]
 
 # LEGO функции генерации
-def generate_lego_single_scene() -> str:
+async def generate_lego_single_scene(hedge: bool = True) -> str:
     sys = (
         "Ты — генератор односценовых видео (ровно 8 секунд) в стиле LEGO: яркие пластиковые фигурки, "
         "блочная эстетика, детская простота + одна абсурдная деталь.\n"
@@ -736,48 +923,76 @@ def generate_lego_single_scene() -> str:
         "Стиль: пластиковый, блочный, яркий, детский, но с юмором для взрослых.\n"
         "Примеры: 'LEGO бабушка в ярком платке поливает LEGO цветы из LEGO лейки, в которой вместо воды LEGO конфетти'"
     )
-    return _gpt(sys, "", temperature=0.8, max_tokens=150) or "LEGO бабушка строит LEGO дом из LEGO кирпичей, но вместо цемента использует LEGO клей."
+    return await _gpt(sys, "", temperature=0.8, max_tokens=150,
+                      fallback=(lambda: _offline_scene("lego_single")) if hedge else None, label="lego_single") or \
+           _offline_scene("lego_single")
 
-def generate_lego_reportage_scene1() -> str:
+async def generate_lego_reportage_scene1(hedge: bool = True) -> str:
     sys = (
         "LEGO репортаж. Сцена 1 (8 сек): LEGO журналистка (женщина, 25–40) в LEGO дворе, "
         "говорит короткую фразу в КАМЕРУ по-русски. На заднем плане LEGO бабушка с LEGO животным, "
         "которое выполняет ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
         "LEGO животные БЕЗ ОДЕЖДЫ, только естественные действия. 1–2 предложения. Без кавычек/тире."
     )
-    return _gpt(sys, "", temperature=0.8, max_tokens=100) or "LEGO журналистка в LEGO дворе рассказывает о LEGO бабушке с LEGO котиком."
+    return await _gpt(sys, "", temperature=0.8, max_tokens=100,
+                      fallback=(lambda: _offline_scene("lego_reportage_scene1")) if hedge else None,
+                      label="lego_reportage_scene1") or \
+           _offline_scene("lego_reportage_scene1")
+
+LEGO_SCENE2_RULES = (
+    "Сцена 2 (8 сек): крупный план ТОЙ ЖЕ LEGO бабушки. Она отвечает по-русски и в конце "
+    "говорит короткую финальную фразу-бомбу (3–6 слов). "
+    "ВИЗУАЛЬНАЯ КОНТИНУИТИ: те же LEGO люди, LEGO одежда, LEGO двор, LEGO предметы/животное — повторить. "
+    "LEGO животные выполняют ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
+)
+
+async def generate_lego_reportage_scene2(context_scene1: str) -> tuple[str, str]:
+    sys = (
+        "LEGO репортаж. " + LEGO_SCENE2_RULES +
+        "Ответь JSON: scene2 — описание сцены 2 без фразы; " + REPLICA_RULES
+    )
+    parts = await _reportage_structured(
+        sys, f"Контекст сцены 1: {context_scene1}",
+        {"scene2": lambda: "LEGO бабушка сидит на LEGO лавочке с LEGO котиком",
+         "replica": lambda: "Вот мои LEGO питомцы"},
+        label="lego_reportage_scene2", temperature=0.8,
+    )
+    return parts["scene2"], parts["replica"]
+
+async def generate_lego_reportage(user_id: Optional[int] = None) -> tuple[str, str, str]:
+    s1 = scene_prefetch.try_take("lego_reportage_scene1", user_id) if user_id else None
+    if s1:
+        s2, rep = await generate_lego_reportage_scene2(s1)
+        return s1, s2, rep
 
-def generate_lego_reportage_scene2(context_scene1: str) -> tuple[str, str]:
     sys = (
-        "LEGO репортаж. Сцена 2 (8 сек): крупный план ТОЙ ЖЕ LEGO бабушки. Она отвечает по-русски и в конце "
-        "говорит короткую финальную фразу-бомбу (3–6 слов). "
-        "ВИЗУАЛЬНАЯ КОНТИНУИТИ: те же LEGO люди, LEGO одежда, LEGO двор, LEGO предметы/животное — повторить. "
-        "LEGO животные выполняют ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
-        "Формат: описание сцены + фраза бабушки в кавычках. Без тире/двоеточий."
+        "LEGO репортаж из двух сцен. Сцена 1 (8 сек): LEGO журналистка (женщина, 25–40) в LEGO дворе, "
+        "говорит короткую фразу в КАМЕРУ по-русски. На заднем плане LEGO бабушка с LEGO животным, "
+        "которое выполняет ПРОСТЫЕ действия: стоит, сидит, ест, спит, плавает, ходит. "
+        "LEGO животные БЕЗ ОДЕЖДЫ, только естественные действия. 1–2 предложения. Без кавычек/тире.\n"
+        + LEGO_SCENE2_RULES + "\n"
+        "Ответь JSON: scene1 — сцена 1, scene2 — сцена 2 без фразы; " + REPLICA_RULES
     )
-    result = _gpt(sys, f"Контекст сцены 1: {context_scene1}", temperature=0.8, max_tokens=120)
-    if not result:
-        return "LEGO бабушка сидит на LEGO лавочке с LEGO котиком", "Вот мои LEGO питомцы"
-    
-    # Парсим результат для извлечения фрази
-    if '"' in result:
-        parts = result.split('"')
-        if len(parts) >= 2:
-            scene = parts[0].strip()
-            replica = parts[1].strip()
-            return scene, replica
-    
-    return result, "Вот мои LEGO питомцы"
+    parts = await _reportage_structured(
+        sys, "Создай LEGO репортаж",
+        {"scene1": lambda: _offline_scene("lego_reportage_scene1"),
+         "scene2": lambda: "LEGO бабушка сидит на LEGO лавочке с LEGO котиком",
+         "replica": lambda: "Вот мои LEGO питомцы"},
+        label="lego_reportage", temperature=0.8,
+    )
+    return parts["scene1"], parts["scene2"], parts["replica"]
 
-def generate_lego_reportage() -> tuple[str, str, str]:
-    s1 = generate_lego_reportage_scene1()
-    s2, rep = generate_lego_reportage_scene2(s1)
-    return s1, s2, rep
+# Пул заранее сгенерированных сцен: генераторы без пользовательского ввода
+from app.services import scene_prefetch
+scene_prefetch.register("nkudo_single", partial(generate_nkudo_single_scene, hedge=False))
+scene_prefetch.register("nkudo_reportage_scene1", partial(generate_nkudo_reportage_scene1, hedge=False))
+scene_prefetch.register("lego_single", partial(generate_lego_single_scene, hedge=False))
+scene_prefetch.register("lego_reportage_scene1", partial(generate_lego_reportage_scene1, hedge=False))
 
 # -----------------------------------------------------------------------------
 # ВИДЕО (VEO)
 # -----------------------------------------------------------------------------
-from app.services.clients.veo_client import generate_video_sync
+from app.services.clients.veo_client import generate_video_sync, concat_videos
 
 # -----------------------------------------------------------------------------
 # ВИРТУАЛЬНАЯ ПРИМЕРОЧНАЯ (VTO + Nano Banana для «пере-постановки»)
@@ -785,20 +1000,175 @@ from app.services.clients.veo_client import generate_video_sync
 from app.services.clients.tryon_client import virtual_tryon
 from app.services.clients.nano_client import repose_or_relocate
 
+TRYON_BATCH_MAX = 10  # вещей за раз: столько фото помещается в один альбом Telegram
+
 # -----------------------------------------------------------------------------
 # ТРАНСФОРМАЦИИ ИЗОБРАЖЕНИЙ
 # -----------------------------------------------------------------------------
 from app.services.clients.transforms_client import process_transform
 from bg_removal import remove_background_complete
 
+# -----------------------------------------------------------------------------
+# РЕЕСТР МЕДИА (повторная отправка по Telegram file_id)
+# -----------------------------------------------------------------------------
+from app.services import media_registry, media_group, telegram_photos, photo_validation
+from app.ui.callbacks import Actions, Cb
+
+# -----------------------------------------------------------------------------
+# КЭШ РЕЗУЛЬТАТОВ (те же фото и параметры — ответ с диска, без модели и списания)
+# -----------------------------------------------------------------------------
+from app.services import result_cache, image_index, executors
+from app.services.clients.tryon_client import MODEL_ID as TRYON_MODEL_ID
+from app.services.clients.nano_client import MODEL_ID as NANO_MODEL_ID
+from app.services.clients.transforms_client import MODEL_ID as TRANSFORMS_MODEL_ID
+
+CACHE_HIT_NOTE = "⚡ Такой запрос уже выполнялся — результат из кэша, монетки не списаны."
+
+async def _cached_result(key: str, force_fresh: bool = False) -> Optional[bytes]:
+    return await executors.run("db", result_cache.get, key, force_fresh)
+
+async def _store_result(key: str, result: Any):
+    # virtual_tryon может вернуть {"gcsUri": ...} — такое не кэшируем
+    if isinstance(result, (bytes, bytearray)):
+        await executors.run("db", result_cache.put, key, bytes(result))
+
+async def _account_cache_hit(uid: int, feature: str, saved: int) -> int:
+    """Записать выдачу из кэша в журнал биллинга; возвращает текущий баланс"""
+    sub = await executors.run("db", check_subscription, uid)
+    balance = sub.get("coins", 0)
+    await executors.run("db", result_cache.record_hit, uid, feature, saved, balance)
+    return balance
+
+def _transform_cache_key(st: dict, transform_type: str, quality: str) -> str:
+    return result_cache.make_key(
+        "transform", TRANSFORMS_MODEL_ID, st["transform_images"], st.get("transform_text"),
+        {"type": transform_type, "quality": quality},
+    )
+
+async def _tryon_cache_key(uid: int, person: bytes, garment: bytes) -> str:
+    """
+    Ключ по ID фото из перцептивного индекса: пересжатые копии тех же фото дают тот же ключ
+
+    ID фото человека привязан к пользователю — чужая примерка по похожему фото не выдаётся.
+    """
+    (person_id, _), (garment_id, _) = await asyncio.gather(
+        executors.run("image", image_index.prepare, "person", person, "tryon_person", uid),
+        executors.run("image", image_index.prepare, "garment", garment, "tryon_garment"),
+    )
+    return result_cache.make_key(
+        "tryon", TRYON_MODEL_ID, [], params={"person": person_id, "garment": garment_id, "sample_count": 1}
+    )
+
+def _repose_cache_key(dressed: bytes, prompt: str = "", bg: Optional[bytes] = None, style: str = "") -> str:
+    images = [dressed, bg] if bg else [dressed]
+    return result_cache.make_key("repose", NANO_MODEL_ID, images, prompt, {"style": style})
+
+async def _refund_cache_hit(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            uid: int, feature: str, cost: int):
+    """
+    Функции с оплатой при нажатии кнопки: при попадании в кэш монетки возвращаются
+
+    cost — сумма, фактически списанная при нажатии (0 — возвращать нечего)
+    """
+    if cost:
+        await send_coin_notification(update, context, "refund", cost, "Результат из кэша")
+    await _account_cache_hit(uid, feature, cost)
+
+# -----------------------------------------------------------------------------
+# ПЛАНИРОВЩИК ГЕНЕРАЦИЙ (слоты моделей, лимит на пользователя, очередь по тарифам)
+# -----------------------------------------------------------------------------
+from app.services import generation_scheduler
+
+async def _user_plan(uid: int) -> str:
+    """Тариф для очереди генераций: без активной подписки — FREE_PLAN"""
+    sub = await executors.run("db", check_subscription, uid)
+    return sub.get("plan", "lite") if sub.get("is_active") else generation_scheduler.FREE_PLAN
+
+def _veo_kind(duration: int, with_audio: bool) -> str:
+    """Вид задачи Veo для статистики длительности: длительность и звук заметно меняют время"""
+    return f"veo:{duration}s:{'audio' if with_audio else 'mute'}"
+
+def _format_eta(seconds: float) -> str:
+    if seconds < 60:
+        return "меньше чем через минуту"
+    return f"примерно через {int(seconds // 60) + 1} мин"
+
+def _queue_status(status: Any) -> Callable[[int, float], Any]:
+    """Обновлять сообщение со статусом: место в очереди и ETA дописываются к исходному тексту"""
+    base = status.text or ""
+    last = {"line": None}
+
+    async def update(position: int, eta: float):
+        if position:
+            line = f"🚦 Место в очереди: {position}\n⏱ Результат {_format_eta(eta)}"
+        elif eta > 0:
+            line = f"⏱ Будет готово {_format_eta(eta)}"
+        else:
+            line = "⏱ Почти готово…"
+        if line == last["line"]:
+            return  # Telegram не даёт «редактировать» сообщение тем же текстом
+        last["line"] = line
+        await status.edit_text(f"{base}\n\n{line}")
+
+    return update
+
+async def _run_generation(uid: int, model: str, fn: Callable, *args, cost: Optional[float] = None,
+                          kind: Optional[str] = None, status: Any = None, batch: bool = False,
+                          **kwargs) -> Any:
+    """
+    Вызвать клиента Vertex в пуле upstream, дождавшись слота планировщика
+
+    Args:
+        model: veo | tryon | gemini
+        kind: вид задачи для ETA (veo:8s:audio, tryon, transform:retouch…)
+        status: сообщение «⏳ …», в котором показываются место в очереди и ETA
+        batch: задача из пачки (несколько вещей за раз) — см. SCHEDULER_BATCH_EXTRA_SLOTS
+    """
+    plan = await _user_plan(uid)
+    on_status = _queue_status(status) if status is not None else None
+    async with generation_scheduler.job(uid, model, plan, cost, kind=kind, on_status=on_status,
+                                       batch=batch):
+        return await executors.run("upstream", fn, *args, **kwargs)
+
 # -----------------------------------------------------------------------------
 # ГЕНЕРАЦИЯ «БОГАТОГО» JSON ДЛЯ VEO
 # -----------------------------------------------------------------------------
-def _rich_json_template(scene: str, style: Optional[str], replica: Optional[str],
-                        mode: Optional[str], aspect_ratio: str, context: Optional[str]) -> str:
+def _template_json(scene: str, style: Optional[str], replica: Optional[str], aspect_ratio: str) -> str:
+    """
+    Локальный JSON под Veo без GPT: сцена как есть + директивы стиля из STYLE_HINTS.
+    Используется, когда GPT не настроен или не вернул ответ.
+    """
+    hints = STYLE_HINTS.get(style or "", {})
+    return json.dumps({
+        "model": "veo-3.0-fast",
+        "duration": 8,
+        "aspect_ratio": aspect_ratio,
+        "style_directives": style_instructions(style),
+        "shot": {"composition": "medium shot", "camera_motion": hints.get("shot", "static"),
+                 "lens": "35mm", "frame_rate": "24fps", "film_grain": "subtle"},
+        "subject": {"description": f"{_sanitize(scene)} {hints.get('subject', '')}".strip(), "voice_sync": False},
+        "scene": {"location": hints.get("scene", "generic"), "time_of_day": "day"},
+        "action": "8s action",
+        "voiceover": {"voice": "female", "line": _sanitize(replica or "")},
+        "characters": [],
+        "ambient": "light fx",
+        "lighting": hints.get("lighting", "natural"),
+        "mood": hints.get("mood", "neutral"),
+        "restrictions": "No text or logos"
+    }, ensure_ascii=False)
+
+# Промт Veo собирается при температуре 0.55 — выше общего порога кэша GPT (0.5),
+# поэтому порог задаётся явно: повторный запрос той же сцены отдаётся из кэша
+RICH_JSON_TEMPERATURE = 0.55
+RICH_JSON_CACHE_MAX_TEMPERATURE = 0.55
+
+async def _rich_json_template(scene: str, style: Optional[str], replica: Optional[str],
+                              mode: Optional[str], aspect_ratio: str, context: Optional[str],
+                              allow_template: bool = True) -> str:
     """
     Собираем промт-директиву для GPT, чтобы он вернул ГОТОВЫЙ JSON под Veo.
     ВАЖНО: мы просим ВСТРАИВАТЬ style_directives в subject.description, scene, lighting, mood и shot.
+    allow_template=False — без GPT-ответа не подставлять шаблон, а бросить исключение (для спекуляций).
     """
     style_text = style_instructions(style)
 
@@ -878,39 +1248,21 @@ def _rich_json_template(scene: str, style: Optional[str], replica: Optional[str]
     if context:
         usr += f"context_for_continuity: {context}\n"
 
-    try:
-        r = gpt.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "system", "content": sys},
-                      {"role": "user", "content": usr}],
-            temperature=0.55,
-            max_tokens=1300,
-        )
-        return (r.choices[0].message.content or "").strip()
-    except Exception as e:
-        log.error("GPT JSON convert error: %s", e)
-        # fallback максимально честный и простой
-        style_stub = style_text or ""
-        return json.dumps({
-            "model": "veo-3.0-fast",
-            "duration": 8,
-            "aspect_ratio": aspect_ratio,
-            "style_directives": style_stub,
-            "shot": {"composition": "medium shot (со стилем)", "camera_motion": "static (со стилем)",
-                     "lens": "35mm", "frame_rate": "24fps", "film_grain": "subtle"},
-            "subject": {"description": f"{_sanitize(scene)} (со стилем: {style_stub})", "voice_sync": False},
-            "scene": {"location": "rural yard (со стилем)", "time_of_day": "day"},
-            "action": "simple 8 second action",
-            "voiceover": {"voice": "female", "line": _sanitize(replica or "")},
-            "characters": [],
-            "ambient": "light wind, birds",
-            "lighting": "natural daylight (с учётом стиля)",
-            "mood": "grounded (с учётом стиля)",
-            "restrictions": "No text or logos"
-        }, ensure_ascii=False)
-
-def _neurokudo_json_parser(scene: str, style: Optional[str], replica: Optional[str],
-                          mode: Optional[str], aspect_ratio: str, context: Optional[str] = None) -> str:
+    # Промт платного видео не хеджируется: ждём GPT, шаблон — только если GPT не ответил
+    r = await gpt_client.complete(
+        sys, usr, temperature=RICH_JSON_TEMPERATURE, max_tokens=1300, label="rich_json",
+        cache_max_temperature=RICH_JSON_CACHE_MAX_TEMPERATURE,
+    )
+    if not r:
+        if not allow_template:
+            raise RuntimeError("GPT returned no Veo JSON")
+        log.warning("GPT unavailable for Veo JSON, using local template")
+        return _template_json(scene, style, replica, aspect_ratio)
+    return r.strip()
+
+async def _neurokudo_json_parser(scene: str, style: Optional[str], replica: Optional[str],
+                                mode: Optional[str], aspect_ratio: str, context: Optional[str] = None,
+                                on_delta=None, allow_template: bool = True) -> str:
     """
     Новый JSON-парсер для Veo 3 в формате, который точно работает.
     Парсит русский текст сцены и конвертирует в строгий JSON формат для VEO 3.
@@ -1006,17 +1358,23 @@ def _neurokudo_json_parser(scene: str, style: Optional[str], replica: Optional[s
         input_text += f"\nФраза: {replica}"
     
     try:
-        response = gpt.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": input_text}
-            ],
-            temperature=0.3,
-            max_tokens=1000,
-        )
+        if on_delta is not None:
+            # Потоковый режим: JSON собирается на глазах, проверка — один раз по готовому тексту
+            response = await gpt_client.stream(
+                [{"role": "system", "content": sys_prompt},
+                 {"role": "user", "content": input_text}],
+                temperature=0.3, max_tokens=1000, on_delta=on_delta, label="veo_json",
+                cache_max_temperature=gpt_client.GPT_CACHE_MAX_TEMPERATURE,
+            )
+        else:
+            response = await gpt_client.complete(
+                sys_prompt, input_text, temperature=0.3, max_tokens=1000, label="veo_json",
+                cache_max_temperature=gpt_client.GPT_CACHE_MAX_TEMPERATURE,
+            )
+        if not response:
+            raise RuntimeError("GPT returned no Veo JSON")
         
-        json_text = response.choices[0].message.content.strip()
+        json_text = response.strip()
         
         # Проверяем что это валидный JSON
         parsed_json = json.loads(json_text)
@@ -1027,10 +1385,12 @@ def _neurokudo_json_parser(scene: str, style: Optional[str], replica: Optional[s
     except Exception as e:
         log.error("Veo 3 JSON parser error: %s", e)
         # Fallback к старому методу
-        return _rich_json_template(scene, style, replica, mode, aspect_ratio, context)
+        return await _rich_json_template(scene, style, replica, mode, aspect_ratio, context,
+                                         allow_template=allow_template)
 
-def to_json_prompt(scene: str, style: Optional[str], replica: Optional[str],
-                   mode: Optional[str], aspect_ratio: str, context: Optional[str] = None) -> str:
+async def to_json_prompt(scene: str, style: Optional[str], replica: Optional[str],
+                         mode: Optional[str], aspect_ratio: str, context: Optional[str] = None,
+                         on_delta=None, allow_template: bool = True) -> str:
     # если пользователь прислал уже JSON — проверяем длину
     try:
         json.loads(scene)
@@ -1041,37 +1401,138 @@ def to_json_prompt(scene: str, style: Optional[str], replica: Optional[str],
     except Exception:
         pass
     
-    if not gpt:
+    if not gpt_client.is_configured():
+        if not allow_template:
+            raise RuntimeError("GPT is not configured")
         # fallback JSON если GPT недоступен
-        fallback_json = json.dumps({
-            "model": "veo-3.0-fast",
-            "duration": 8,
-            "aspect_ratio": aspect_ratio,
-            "style_directives": style_instructions(style),
-            "shot": {"composition": "medium shot", "camera_motion": "static",
-                     "lens": "35mm", "frame_rate": "24fps", "film_grain": "subtle"},
-            "subject": {"description": _sanitize(scene), "voice_sync": False},
-            "scene": {"location": "generic", "time_of_day": "day"},
-            "action": "8s action",
-            "voiceover": {"voice": "female", "line": _sanitize(replica or "")},
-            "characters": [],
-            "ambient": "light fx",
-            "lighting": "natural",
-            "mood": "neutral",
-            "restrictions": "No text or logos"
-        }, ensure_ascii=False)
+        fallback_json = _template_json(scene, style, replica, aspect_ratio)
         limited_text, is_valid = _limit_prompt_length(fallback_json, max_length=MAX_PROMPT_LENGTH)
         if not is_valid:
             raise ValueError("Prompt too long")
         return limited_text
     
     # Новый JSON-парсер для NEUROKUDO стиля
-    result = _neurokudo_json_parser(scene, style, replica, mode, aspect_ratio, context)
+    result = await _neurokudo_json_parser(scene, style, replica, mode, aspect_ratio, context,
+                                          on_delta=on_delta, allow_template=allow_template)
     limited_text, is_valid = _limit_prompt_length(result, max_length=MAX_PROMPT_LENGTH)
     if not is_valid:
         raise ValueError("Prompt too long")
     return limited_text
 
+async def generate_scene_replica(base_scene: str, style: Optional[str], mode: Optional[str]) -> str:
+    """Фраза героя к сцене (кнопка «💬 Придумать фразу»), уже очищенная от тире"""
+    style_note = style or "без стиля"
+    if mode == "nkudo":
+        # Специальный промпт для NEUROKUDO
+        prompt = (
+            f"Write grandmother's dialogue in NEUROKUDO style for this scene.\n\n"
+            f"Scene: {base_scene}\n"
+            f"Style: {style_note}\n\n"
+            f"NEUROKUDO DIALOGUE STYLE:\n"
+            f"- Grandmother (75-85 years old) speaks calmly as if incredible things are normal\n"
+            f"- Village accent, simple words, sometimes with humor\n"
+            f"- Reactions: pride, explanation, calmness before absurdity\n"
+            f"EXAMPLES FROM NEUROKUDO (for inspiration, create NEW variations):\n"
+            f"- 'Взяла вот на передержку маленьких, скоро выпустят их, пусть сил набираются'\n"
+            f"- 'Да соседка бегемотов завела, я решила чем мы хуже, заказали вот малышей из Намибии'\n"
+            f"- 'Аккуратнее, лАрочка, чего ты нервничаешь. Сейчас они уйдут'\n"
+            f"- 'Не бойтесь её. Это Лариска. В погребе нашла, между банок сидела'\n"
+            f"- 'Вот, мои несушки, кормилицы мои, каждое утро свежие яички'\n\n"
+            f"TASK: Create NEW dialogue inspired by these examples, not copy them.\n"
+            f"Use similar tone and style but with different words and situations.\n"
+            f"Write in RUSSIAN. Format: ONE complete sentence, maximum 20 words.\n"
+            f"STRICT RULE: NO DASHES, HYPHENS, OR EM DASHES (—, -, –) in the dialogue!\n"
+            f"LENGTH RULE: Maximum 20 words total. Make it complete and conversational!"
+        )
+    else:
+        # Обычный промпт для других режимов
+        prompt = (
+            f"Напиши короткую и выразительную фразу для сцены.\n\n"
+            f"Сцена: {base_scene}\n"
+            f"Стиль: {style_note}\n\n"
+            f"Формат: ОДНО полное предложение, максимум 20 слов.\n"
+            f"СТРОГО ЗАПРЕЩЕНО: никаких тире, дефисов или длинных тире (—, -, –) в фразе!\n"
+            f"ДЛИНА: максимум 20 слов. Делай завершенным и разговорно!"
+        )
+
+    try:
+        if not gpt_client.is_configured():
+            replica = "Да сама довезу без принцев обойдусь!"
+        else:
+            resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=35, temperature=0.8)
+            replica = resp.strip() if resp else "Да сама довезу без принцев обойдусь!"
+    except Exception as e:
+        replica = f"(⚠️ Ошибка генерации: {e})"
+
+    # Очищаем фразу от тире
+    return _clean_replica(replica)
+
+# -----------------------------------------------------------------------------
+# СПЕКУЛЯТИВНЫЕ ШАГИ ПОМОЩНИКА
+# Как только сцена принята, фраза и предварительный JSON-промт считаются в фоне.
+# Ключи — входные данные шага: изменилась сцена/стиль/фраза/ориентация — результат отбрасывается.
+# -----------------------------------------------------------------------------
+from app.services import speculation
+
+def _replica_key(st: dict) -> tuple:
+    return ("replica", st.get("scene"), st.get("style"), st.get("mode"))
+
+def _prompt_key(st: dict) -> tuple:
+    return ("json", st.get("scene"), st.get("style"), st.get("replica"), st.get("mode"),
+            st.get("orientation") or DEFAULT_ORIENTATION)
+
+def _speculate_helper(uid: int, st: dict):
+    """Заранее посчитать следующий шаг помощника для текущей сцены"""
+    if st.get("mode") != "helper" or not st.get("scene") or not gpt_client.is_configured():
+        return
+    scene, style, replica = st["scene"], st.get("style"), st.get("replica")
+    if not replica:
+        speculation.speculate(uid, "replica", _replica_key(st),
+                              partial(generate_scene_replica, scene, style, "helper"))
+    speculation.speculate(uid, "json", _prompt_key(st),
+                          partial(to_json_prompt, scene, style, replica, "helper",
+                                  aspect_ratio=st.get("orientation") or DEFAULT_ORIENTATION, context=None,
+                                  # шаблон вместо GPT не запоминаем — при claim() шаг посчитается вживую
+                                  allow_template=False))
+
+# -----------------------------------------------------------------------------
+# МНОГОСЦЕНОВЫЕ РОЛИКИ (fan-out / fan-in)
+# -----------------------------------------------------------------------------
+def _video_file_from_result(res: Optional[dict]) -> Optional[str]:
+    """Путь к локальному файлу первого видео из ответа generate_video_sync"""
+    vids = (res or {}).get("videos", [])
+    if vids and vids[0].get("file_path") and os.path.exists(vids[0]["file_path"]):
+        return vids[0]["file_path"]
+    return None
+
+async def _run_scene_job(uid: int, scene: str, style: Optional[str], replica: Optional[str], context: Optional[str],
+                         aspect_ratio: str, duration: int, with_audio: bool, status: Any = None) -> Optional[str]:
+    """
+    Ветка одной сцены: GPT-промт → Veo.
+    Каждая ветка стартует Veo сразу, как только готов её промт, не дожидаясь соседних.
+    status — сообщение для места в очереди и ETA (сцены идут параллельно, хватает одной)
+    """
+    prompt = await to_json_prompt(
+        scene, style, replica, "reportage",
+        aspect_ratio=aspect_ratio, context=context
+    )
+    res = await _run_generation(uid, "veo", generate_video_sync, prompt, duration=duration,
+                                aspect_ratio=aspect_ratio, with_audio=with_audio,
+                                kind=_veo_kind(duration, with_audio), status=status)
+    return _video_file_from_result(res)
+
+async def run_scene_jobs(jobs: List[dict]) -> List[Any]:
+    """
+    Запустить независимые сцены параллельно и собрать результаты в исходном порядке.
+    Ошибка одной сцены не отменяет остальные: на её месте возвращается исключение.
+    """
+    return await asyncio.gather(*(_run_scene_job(**job) for job in jobs), return_exceptions=True)
+
+def _split_cost(cost: int, parts: int) -> List[int]:
+    """Разделить стоимость между сценами (остаток — на последнюю), чтобы вернуть долю упавшей"""
+    share = cost // parts
+    return [share] * (parts - 1) + [cost - share * (parts - 1)]
+
 # -----------------------------------------------------------------------------
 # СОСТОЯНИЕ
 # -----------------------------------------------------------------------------
@@ -1393,8 +1854,15 @@ def kb_tryon_need_garment():
         [InlineKeyboardButton("❌ Сбросить", callback_data="tryon_reset")],
     ])
 
-def kb_tryon_confirm():
+def kb_tryon_confirm(garments: int = 1):
     cost = feature_cost_coins("virtual_tryon")
+    if garments > 1:
+        # Несколько вещей на одного человека — примеряются параллельно, результат одним альбомом
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"✨ Примерить все {garments} (−{cost * garments} монеток)", callback_data="tryon_batch")],
+            [InlineKeyboardButton(f"👕 Только первую (−{cost} монеток)", callback_data="tryon_confirm")],
+            [InlineKeyboardButton("❌ Сбросить", callback_data="tryon_reset")],
+        ])
     button_text = f"✨ Примерить (−{cost} монеток)"
 
     return InlineKeyboardMarkup([
@@ -1503,6 +1971,14 @@ def kb_video_result():
         [InlineKeyboardButton(f"🔄 Сделать ещё вариант (−{cost} монеток)", callback_data="video_retry")],
     ])
 
+def kb_send_again(media_id: Optional[int]):
+    """Кнопка повторной отправки результата по file_id (без повторной загрузки)"""
+    if not media_id:
+        return None
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔁 Отправить ещё раз", callback_data=Cb(Actions.MEDIA_RESEND, str(media_id)).pack())],
+    ])
+
 # -----------------------------------------------------------------------------
 # ТАРИФЫ И АДДОНЫ
 # -----------------------------------------------------------------------------
@@ -2193,6 +2669,121 @@ async def cmd_reset_my_profile(update: Update, context: ContextTypes.DEFAULT_TYP
         reply_markup=kb_home_inline()
     )
 
+async def cmd_send_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """СЛУЖЕБНАЯ КОМАНДА: Переслать медиа из реестра по file_id - ТОЛЬКО ДЛЯ АДМИНА
+    Использование: /send_media <media_id> [chat_id]
+    """
+    uid = update.effective_user.id
+    
+    # Проверка: только владелец
+    ADMIN_ID = 5015100177
+    if uid != ADMIN_ID:
+        return
+    
+    args = context.args or []
+    try:
+        media_id = int(args[0])
+        chat_id = int(args[1]) if len(args) > 1 else update.effective_chat.id
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /send_media <media_id> [chat_id]")
+        return
+    
+    record = media_registry.get_media(media_id)
+    if not record:
+        await update.message.reply_text(f"❌ Медиа #{media_id} не найдено в реестре.")
+        return
+    
+    await media_registry.send_media(context.bot, chat_id, record, caption=record.get("prompt"))
+    log.info(f"ADMIN {uid} resent media {media_id} to chat {chat_id}")
+
+async def cmd_gpt_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """СЛУЖЕБНАЯ КОМАНДА: Метрики GPT-шлюза (задержки, токены, ошибки) - ТОЛЬКО ДЛЯ АДМИНА"""
+    uid = update.effective_user.id
+    
+    # Проверка: только владелец
+    ADMIN_ID = 5015100177
+    if uid != ADMIN_ID:
+        return
+    
+    m = gpt_client.get_metrics()
+    p = scene_prefetch.get_stats()
+    sp = speculation.get_stats()
+    await update.message.reply_text(
+        "🤖 GPT-шлюз\n\n"
+        f"📨 Вызовов: {m['calls']} (в работе: {m['in_flight']}/{m['max_concurrency']})\n"
+        f"⏱ Задержка p50/p95: {m['latency_p50']}s / {m['latency_p95']}s\n"
+        f"📡 Потоковых: {m['streams']}, первый фрагмент p50: {m['first_token_p50']}s\n"
+        f"🔤 Токены: {m['prompt_tokens']} вход / {m['completion_tokens']} выход\n"
+        f"⚠️ Ошибок: {m['errors']}, тайм-аутов: {m['timeouts']}, обрезано по max_tokens: {m['truncated']}\n\n"
+        f"🛡 Хедж: {m['hedged']} по дедлайну, шаблонов: {m['fallbacks']}, опоздавших использовано: {m['late_used']}\n"
+        f"💾 Кэш: {m['cache_hits']} попаданий / {m['cache_misses']} промахов "
+        f"(hit rate {m['cache_hit_rate']:.0%}, записей {m['cache_size']})\n\n"
+        f"🧺 Пул сцен: {p['pools']}\n"
+        f"🎯 Из пула: {p['hits']}, вживую: {p['misses']}\n\n"
+        f"🔮 Спекуляции: {sp['started']} запущено, {sp['hits']} пригодилось "
+        f"(hit rate {sp['hit_rate']:.0%}), отброшено: {sp['discarded']}, сверх бюджета: {sp['over_budget']}"
+    )
+
+async def cmd_image_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """СЛУЖЕБНАЯ КОМАНДА: Кэш результатов и экономия трафика в Vertex - ТОЛЬКО ДЛЯ АДМИНА"""
+    uid = update.effective_user.id
+
+    # Проверка: только владелец
+    ADMIN_ID = 5015100177
+    if uid != ADMIN_ID:
+        return
+
+    rc = result_cache.get_stats()
+    ix = image_index.get_stats()
+    tp = telegram_photos.get_stats()
+    await update.message.reply_text(
+        "🖼 Изображения\n\n"
+        f"💾 Кэш результатов: {rc['hits']} попаданий / {rc['misses']} промахов "
+        f"(hit rate {rc['hit_rate']:.0%}), мимо кэша: {rc['bypassed']}\n"
+        f"📦 Записей: {rc['entries']}, {rc['bytes'] / 1024 / 1024:.1f} МБ, вытеснено: {rc['evicted']}\n"
+        f"🪙 Не списано монеток: {rc['coins_saved']}\n\n"
+        f"🔎 Индекс фото примерочной: {ix['entries']} фото, {ix['bytes'] / 1024 / 1024:.1f} МБ\n"
+        + "".join(
+            f"• {kind}: {ix[kind]['exact']} точных, {ix[kind]['near']} похожих, {ix[kind]['new']} новых\n"
+            for kind in ("person", "garment") if kind in ix
+        )
+        + f"\n📥 Входящие фото: {tp['downloads']} скачано ({tp['bytes_downloaded'] / 1024 / 1024:.1f} МБ), "
+        f"из кэша: {tp['cache_hits']}, сэкономлено выбором размера: {tp['bytes_saved'] / 1024 / 1024:.1f} МБ"
+    )
+
+async def cmd_pool_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """СЛУЖЕБНАЯ КОМАНДА: Загрузка пулов исполнителей и очередь генераций - ТОЛЬКО ДЛЯ АДМИНА"""
+    uid = update.effective_user.id
+
+    # Проверка: только владелец
+    ADMIN_ID = 5015100177
+    if uid != ADMIN_ID:
+        return
+
+    lines = ["🧵 Пулы исполнителей\n"]
+    for name, s in executors.get_stats().items():
+        line = (f"• {name}: {s['busy']}/{s['workers']} занято, в очереди {s['queued']} "
+                f"(макс. {s['max_queue']}), выполнено {s['completed']}, ошибок {s['failed']}, "
+                f"среднее время {s['avg_run']:.1f} с")
+        if "avg_wait" in s:
+            line += f", ожидание {s['avg_wait']:.2f} с (макс. {s['wait_max']:.1f} с)"
+        if s["alerts"]:
+            line += f"\n  ⚠️ насыщение: {s['alerts']} раз"
+        lines.append(line)
+
+    gs = generation_scheduler.get_stats()
+    lines.append(f"\n🎛 Генерации: {gs['running']}/{gs['global_slots']} слотов, в очереди {gs['queued']}")
+    for model, m in gs["models"].items():
+        lines.append(f"• {model}: {m['running']}/{m['slots']}, в очереди {m['queued']}")
+    for plan, p in gs["plans"].items():
+        lines.append(f"⏱ {plan}: {p['jobs']} задач, ожидание p50 {p['p50_wait']:.1f} с, "
+                     f"p95 {p['p95_wait']:.1f} с, макс. {p['max_wait']:.1f} с, сейчас в очереди {p['queued']}")
+    if gs["latency"]:
+        lines.append("\n⏳ Длительность генераций (для ETA):")
+        for kind, l in sorted(gs["latency"].items()):
+            lines.append(f"• {kind}: p50 {l['p50']:.0f} с, p95 {l['p95']:.0f} с ({l['samples']} шт.)")
+    await update.message.reply_text("\n".join(lines))
+
 # --- Reply-кнопки (нижнее меню) как текст ---
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_access(update): return
@@ -2269,7 +2860,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Сначала выполните примерку, затем меняйте позу/локацию.")
             return
         prompt = text
-        await update.message.reply_text("⏳ Делаю перестановку по описанию…")
+        status = await update.message.reply_text("⏳ Делаю перестановку по описанию…")
         
         try:
             # Проверяем доступность Google credentials
@@ -2280,10 +2871,19 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not google_creds:
                 raise RuntimeError("Google credentials not configured")
             
-            from app.services.clients.nano_client import repose_or_relocate
-            out = await asyncio.to_thread(repose_or_relocate, stt["dressed"], prompt, None)
+            prompt_key = _repose_cache_key(stt["dressed"], prompt)
+            out = await _cached_result(prompt_key)
+            if out is not None:
+                # Эта ветка не списывает монетки при нажатии — возвращать нечего, только учёт
+                await _account_cache_hit(uid, "tryon_prompt", 0)
+            else:
+                from app.services.clients.nano_client import repose_or_relocate
+                out = await _run_generation(uid, "gemini", repose_or_relocate, stt["dressed"], prompt, None,
+                                            kind="repose", status=status)
+                await _store_result(prompt_key, out)
             stt["dressed"] = out
-            await update.message.reply_photo(photo=out, caption="✅ Готово (эксперимент).", reply_markup=kb_tryon_after())
+            sent = await update.message.reply_photo(photo=out, caption="✅ Готово (эксперимент).", reply_markup=kb_tryon_after())
+            await media_registry.remember(uid, sent, "tryon_prompt", prompt=prompt)
             
         except Exception as e:
             log.exception("Custom prompt failed for user %s: %s", uid, str(e))
@@ -2344,19 +2944,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=400,
-                    temperature=0.7,
-                )
-                result = resp.choices[0].message.content.strip() if resp else ""
+                    resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=400, temperature=0.7)
+                result = resp.strip() if resp else ""
                 
                 # Парсим результат
                 if "SCENE1:" in result and "SCENE2:" in result:
@@ -2412,19 +3007,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         try:
-            if not gpt:
+            if not gpt_client.is_configured():
 
                 replica = "Да сама довезу без принцев обойдусь!"
 
             else:
 
-                resp = gpt.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300,
-                temperature=0.7,
-            )
-            new_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.7)
+            new_scene = resp.strip() if resp else base_scene
         except Exception as e:
             new_scene = f"{base_scene}\n(⚠️ Failed to regenerate scene with GPT: {e})"
 
@@ -2467,19 +3057,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": extract_prompt}],
-                    max_tokens=50,
-                    temperature=0.3,
-                )
-                extracted_phrase = resp.choices[0].message.content.strip() if resp else ""
+                    resp = await gpt_client.chat([{"role": "user", "content": extract_prompt}], max_tokens=50, temperature=0.3)
+                extracted_phrase = resp.strip() if resp else ""
                 # Убираем кавычки, если они есть
                 if extracted_phrase.startswith('"') and extracted_phrase.endswith('"'):
                     extracted_phrase = extracted_phrase[1:-1]
@@ -2539,19 +3124,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     )
                     
                     try:
-                        if not gpt:
+                        if not gpt_client.is_configured():
 
                             replica = "Да сама довезу без принцев обойдусь!"
 
                         else:
 
-                            resp = gpt.chat.completions.create(
-                            model=OPENAI_MODEL,
-                            messages=[{"role": "user", "content": embed_prompt}],
-                            max_tokens=200,
-                            temperature=0.7,
-                        )
-                        updated_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                            resp = await gpt_client.chat([{"role": "user", "content": embed_prompt}], max_tokens=200, temperature=0.7)
+                        updated_scene = resp.strip() if resp else base_scene
                         st["scene"] = updated_scene
                     except Exception as e:
                         updated_scene = f"{st['scene']}\n\nБабушка говорит: {st['replica']}"
@@ -2593,19 +3173,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
         try:
-            if not gpt:
+            if not gpt_client.is_configured():
 
                 replica = "Да сама довезу без принцев обойдусь!"
 
             else:
 
-                resp = gpt.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300,
-                temperature=0.7,
-            )
-            new_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.7)
+            new_scene = resp.strip() if resp else base_scene
         except Exception as e:
             new_scene = f"{base_scene}\n(⚠️ Failed to refine scene with GPT: {e})"
 
@@ -2742,7 +3317,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Генерируем видео
         orientation_status = "📱 Вертикальное (9:16)" if st["orientation"] == "9:16" else "🖥️ Горизонтальное (16:9)"
-        await update.message.reply_text(
+        status = await update.message.reply_text(
             f"⚡ Быстрое создание\n\n"
             f"📝 Промт: {text[:100]}...\n"
             f"Ориентация: {orientation_status}\n\n"
@@ -2755,7 +3330,8 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             video_duration = int(st.get("video_duration", "8s").replace("s", ""))
             prompt = process_manual_prompt(text, st["orientation"], mode="manual", duration=video_duration)
             
-            res = await asyncio.to_thread(generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=st.get("with_audio", True))
+            res = await _run_generation(uid, "veo", generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=with_audio,
+                                        kind=_veo_kind(video_duration, with_audio), status=status)
             videos = (res or {}).get("videos", [])
             if not videos:
                 await update.message.reply_text("⚠️ Видео не вернулось. Попробуй ещё раз.", reply_markup=kb_manual_after_video())
@@ -2766,10 +3342,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             uri = v0.get("uri")
             
             if file_path or uri:
-                await update.message.reply_video(
+                sent = await update.message.reply_video(
                     video=file_path or uri,
                     caption=f"✅ Видео готово!\n\n📝 Промт: {text[:100]}...\n📱 Ориентация: {orientation_status}"
                 )
+                await media_registry.remember(uid, sent, "video", prompt=text)
                 await update.message.reply_text("🎉 Быстрое создание завершено!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️", reply_markup=kb_manual_after_video())
                 
                 # Устанавливаем флаг для следующего промта
@@ -2873,7 +3450,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Генерируем видео
         orientation_status = "📱 Вертикальное (9:16)" if st["orientation"] == "9:16" else "🖥️ Горизонтальное (16:9)"
-        await update.message.reply_text(
+        status = await update.message.reply_text(
             f"⚡ Быстрое создание\n\n"
             f"📝 Промт: {text[:100]}...\n"
             f"Ориентация: {orientation_status}\n\n"
@@ -2886,7 +3463,8 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             video_duration = int(st.get("video_duration", "8s").replace("s", ""))
             prompt = process_manual_prompt(text, st["orientation"], mode="manual", duration=video_duration)
             
-            res = await asyncio.to_thread(generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=st.get("with_audio", True))
+            res = await _run_generation(uid, "veo", generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=with_audio,
+                                        kind=_veo_kind(video_duration, with_audio), status=status)
             videos = (res or {}).get("videos", [])
             if not videos:
                 await update.message.reply_text("⚠️ Видео не вернулось. Попробуй ещё раз.", reply_markup=kb_manual_after_video())
@@ -2897,10 +3475,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             uri = v0.get("uri")
             
             if file_path or uri:
-                await update.message.reply_video(
+                sent = await update.message.reply_video(
                     video=file_path or uri,
                     caption=f"✅ Видео готово!\n\n📝 Промт: {text[:100]}...\n📱 Ориентация: {orientation_status}"
                 )
+                await media_registry.remember(uid, sent, "video", prompt=text)
                 await update.message.reply_text("🎉 Быстрое создание завершено!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️", reply_markup=kb_manual_after_video())
                 
                 # Устанавливаем флаг для следующего промта
@@ -2932,20 +3511,24 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Ожидание сцены (helper и другие режимы)
     if st.get("awaiting_scene"):
         st["awaiting_scene"] = False; st["source_text"] = text
-        if st["mode"] == "helper" and gpt:
+        if st["mode"] == "helper" and gpt_client.is_configured():
+            # Сцена печатается в этом сообщении по мере генерации
+            progress = await update.message.reply_text("🧠✨ Помощник пишет сцену…")
             try:
                 log.info(f"Helper mode: processing text '{text[:50]}...'")
-                scene = improve_scene(text, mode="normal")
+                scene = await improve_scene(text, mode="normal",
+                                            on_delta=_stream_editor(progress, "🧠✨ Улучшено помощником:\n\n"))
                 if scene and scene.strip():
                     st["scene"] = scene
                     log.info(f"Helper mode: scene improved successfully")
-                    await update.message.reply_text(f"🧠✨ Улучшено помощником:\n\n{scene}", reply_markup=kb_variants())
+                    await progress.edit_text(f"🧠✨ Улучшено помощником:\n\n{scene}", reply_markup=kb_variants())
+                    _speculate_helper(uid, st)
                     return
                 else:
                     # Если помощник не смог улучшить, используем исходный текст
                     log.warning(f"Helper mode: improve_scene returned empty result")
                     st["scene"] = text
-                    await update.message.reply_text(f"📝 Промт принят (помощник недоступен):\n\n{text}", reply_markup=kb_variants())
+                    await progress.edit_text(f"📝 Промт принят (помощник недоступен):\n\n{text}", reply_markup=kb_variants())
                     return
             except Exception as e:
                 log.error(f"Error in improve_scene: {e}")
@@ -2953,7 +3536,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 st["scene"] = text
                 await update.message.reply_text(f"📝 Промт принят (ошибка помощника):\n\n{text}", reply_markup=kb_variants())
                 return
-        elif st["mode"] == "helper" and not gpt:
+        elif st["mode"] == "helper" and not gpt_client.is_configured():
             log.warning("Helper mode: gpt not initialized")
             st["scene"] = text
             await update.message.reply_text(f"📝 Промт принят (GPT недоступен - используется исходный текст):\n\n{text}", reply_markup=kb_variants())
@@ -2997,12 +3580,14 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if st.get("jsonpro") and st["jsonpro"].get("await_text"):
         st["jsonpro"]["await_text"] = False
         # генерим JSON без показа в обычных режимах — здесь наоборот ПОКАЗЫВАЕМ, это раздел для продвинутых
+        progress = await update.message.reply_text("🧾 Собираю JSON…")
         try:
-            jj = to_json_prompt(text, style=None, replica=None, mode="manual",
-                                aspect_ratio=st["jsonpro"].get("orientation", DEFAULT_ORIENTATION), context=None)
+            jj = await to_json_prompt(text, style=None, replica=None, mode="manual",
+                                aspect_ratio=st["jsonpro"].get("orientation", DEFAULT_ORIENTATION), context=None,
+                                on_delta=_stream_editor(progress, "🧾 JSON:\n"))
             st["jsonpro"]["last_json"] = jj
-            await update.message.reply_text("🧾 JSON:\n```\n" + jj + "\n```", parse_mode="Markdown",
-                                            reply_markup=kb_jsonpro_after_text())
+            await progress.edit_text("🧾 JSON:\n```\n" + jj + "\n```", parse_mode="Markdown",
+                                     reply_markup=kb_jsonpro_after_text())
         except ValueError as e:
             if "Prompt too long" in str(e):
                 await update.message.reply_text(
@@ -3021,31 +3606,80 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Главное меню:", reply_markup=kb_home_inline())
 
 # --- Приём фото (для примерочной и т.п.) ---
-async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _reject_invalid_photos(update: Update, checks: List[tuple]) -> bool:
+    """
+    Локальная проверка фото до списания и вызова модели.
+    checks — пары (байты, назначение); при первой проблеме отвечаем подсказкой и возвращаем True.
+    """
+    for n, (image, purpose) in enumerate(checks, 1):
+        problem = await executors.run("cpu", photo_validation.validate, image, purpose)
+        if problem:
+            prefix = f"Фото {n}: " if len(checks) > 1 else ""
+            log.info("Photo rejected uid=%s purpose=%s: %s", update.effective_user.id, purpose, problem)
+            await update.message.reply_text(f"⚠️ {prefix}{problem}")
+            return True
+    return False
+
+def _photo_feature(st: dict) -> str:
+    """Под какую функцию качается фото — от этого зависит выбранный размер PhotoSize"""
+    if st.get("awaiting_transform"):
+        return "transform"
+    if st["tryon"].get("await_bg"):
+        return "background"
+    return "tryon"
+
+async def _flush_album(update: Update, context: ContextTypes.DEFAULT_TYPE, key):
+    """Ведущий апдейт альбома: дождаться всех фото, скачать их параллельно и обработать разом"""
+    photos = await media_group.collect(key)
+    try:
+        album = await telegram_photos.fetch_photos(context.bot, photos, _photo_feature(users[update.effective_user.id]))
+    except Exception as e:
+        log.error("Failed to download album %s: %s", key, e)
+        await update.message.reply_text("❌ Ошибка загрузки фото. Попробуйте ещё раз.")
+        return
+    await on_photo(update, context, album=album)
+
+async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, album: Optional[List[bytes]] = None):
     if not await check_access(update): return
     uid = update.effective_user.id
     _ensure(uid)
     st = users[uid]
 
+    # Альбом: фото собираются в пачку, один ответ на весь альбом
+    if album is None and update.message.media_group_id:
+        key = (update.message.chat_id, update.message.media_group_id)
+        if not media_group.add(key, update.message.message_id, update.message.photo):
+            return  # фото заберёт ведущий апдейт альбома (опоздавшее после сбора — отброшено)
+        if TELEGRAM_MODE == "polling":
+            # Апдейты идут по очереди: ожидание в обработчике не дало бы прийти остальным фото
+            context.application.create_task(_flush_album(update, context, key), update=update)
+        else:
+            await _flush_album(update, context, key)
+        return
+
     # --- Обработка фото для трансформаций ---
     if st.get("awaiting_transform", False):
         transform_type = st.get("transform_type")
         
         # Скачиваем фото
-        try:
-            photo = update.message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
-            b = await file.download_as_bytearray()
-            photo_bytes = bytes(b)
-        except Exception as e:
-            log.error("Failed to download photo: %s", e)
-            await update.message.reply_text("❌ Ошибка загрузки фото. Попробуйте ещё раз.")
-            return
+        if album is not None:
+            new_images = album
+        else:
+            try:
+                new_images = await telegram_photos.fetch_photos(context.bot, [update.message.photo], "transform")
+            except Exception as e:
+                log.error("Failed to download photo: %s", e)
+                await update.message.reply_text("❌ Ошибка загрузки фото. Попробуйте ещё раз.")
+                return
         
+        purpose = "merge_people" if transform_type == "merge_people" else "transform"
+        if await _reject_invalid_photos(update, [(image, purpose) for image in new_images]):
+            return
+
         # Добавляем фото в список
         if "transform_images" not in st:
             st["transform_images"] = []
-        st["transform_images"].append(photo_bytes)
+        st["transform_images"].extend(new_images)
         
         # Проверяем, достаточно ли фото
         required_photos = 1
@@ -3067,7 +3701,26 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Проверяем и списываем монеток
             quality = st.get("transform_quality", "basic")
             cost = 1 if quality == "basic" else 2
-            
+
+            # Повтор тех же фото/текста/параметров — отдаём готовое без списания
+            # (удаление фона считается локально, его не кэшируем)
+            cache_key = None
+            if transform_type != "remove_bg":
+                cache_key = _transform_cache_key(st, transform_type, quality)
+                cached = await _cached_result(cache_key)
+                if cached is not None:
+                    balance = await _account_cache_hit(uid, "transform", cost)
+                    sent = await update.message.reply_photo(
+                        photo=cached,
+                        caption=f"✅ Готово!\n{CACHE_HIT_NOTE}\n💎 Баланс: {balance} монеток",
+                        reply_markup=kb_transform_result()
+                    )
+                    await media_registry.remember(uid, sent, f"transform_{transform_type}", prompt=st.get("transform_text"))
+                    st["awaiting_transform"] = False
+                    st["transform_images"] = []
+                    st["transform_text"] = None
+                    return
+
             if not db.charge_feature(uid, "transform", cost, f"Photo transform: {quality}"):
                 # Получаем актуальные данные из БД
                 subscription_data = check_subscription(uid)
@@ -3087,7 +3740,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Отправляем уведомление о списании
             await send_coin_notification(update, context, "charge", cost, f"Трансформация фото ({quality})")
             
-            await update.message.reply_text(
+            status = await update.message.reply_text(
                 "🔄 Обрабатываю фото...\n"
                 "⏱️ Это может занять 1-2 минуты."
             )
@@ -3095,8 +3748,8 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Специальная обработка для удаления фона - используем новый модуль
             if transform_type == "remove_bg":
                 # Используем специальный модуль для удаления фона
-                png_bytes, jpg_bytes = await asyncio.to_thread(
-                    remove_background_complete,
+                png_bytes, jpg_bytes = await executors.run(
+                    "upstream", remove_background_complete,
                     st["transform_images"][0],
                     quality
                 )
@@ -3107,11 +3760,12 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 st["current_job_id"] = None
                 
                 # Отправляем PNG с прозрачным фоном
-                await update.message.reply_document(
+                sent = await update.message.reply_document(
                     document=png_bytes,
                     filename="без_фона.png",
                     caption="✅ PNG файл с прозрачным фоном"
                 )
+                await media_registry.remember(uid, sent, "transform_remove_bg", job_id=job_id)
                 
                 # Отправляем JPG с зеленым фоном
                 await update.message.reply_document(
@@ -3122,14 +3776,16 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             else:
                 # Обрабатываем остальные трансформации через старый модуль
-                result_bytes = await asyncio.to_thread(
-                    process_transform, 
+                result_bytes = await _run_generation(
+                    uid, "gemini", process_transform,
                     transform_type, 
                     st["transform_images"], 
-                    st.get("transform_text"), 
-                    quality
+                    st.get("transform_text"),
+                    quality,
+                    kind=f"transform:{transform_type}", status=status,
                 )
-                
+                await _store_result(cache_key, result_bytes)
+
                 # Отмечаем успех
                 job_id = f"{uid}_transform_{int(datetime.now().timestamp())}"
                 on_success(st, job_id)
@@ -3139,11 +3795,12 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if transform_type == "polaroid":
                     caption = "✅ Polaroid готов!"
                 
-                await update.message.reply_photo(
+                sent = await update.message.reply_photo(
                     photo=result_bytes,
                     caption=caption,
                     reply_markup=kb_transform_result()
                 )
+                await media_registry.remember(uid, sent, f"transform_{transform_type}", prompt=st.get("transform_text"), job_id=job_id)
             
             # Очищаем состояние
             st["awaiting_transform"] = False
@@ -3178,14 +3835,25 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # скачать bytes
-    try:
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        b = await file.download_as_bytearray()
-        b = bytes(b)
-    except Exception as e:
-        await update.message.reply_text("Не смог скачать фото. Пришлите как изображение (не как файл).")
-        return
+    if album is not None:
+        photos = album
+    else:
+        try:
+            photos = await telegram_photos.fetch_photos(context.bot, [update.message.photo], _photo_feature(st))
+        except Exception as e:
+            await update.message.reply_text("Не смог скачать фото. Пришлите как изображение (не как файл).")
+            return
+    # Смена фона/одежды берёт первое фото; остальные фото альбома — вещи для пакетной примерки
+    b, extra = photos[0], photos[1:]
+
+    if stt.get("await_bg"):
+        checks = [(b, "background")]
+    elif stt["stage"] == "await_person":
+        checks = [(b, "tryon_person")] + [(garment, "tryon_garment") for garment in extra]
+    else:
+        checks = [(photo, "tryon_garment") for photo in photos]
+    if await _reject_invalid_photos(update, checks):
+        return  # состояние не меняем — можно сразу прислать другое фото
 
     # ждём фон (перелокация)
     if stt.get("await_bg"):
@@ -3194,7 +3862,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not stt.get("dressed"):
             await update.message.reply_text("Сначала выполните примерку, затем меняйте локацию.")
             return
-        await update.message.reply_text("⏳ Пересобираю с новым фоном…")
+        status = await update.message.reply_text("⏳ Пересобираю с новым фоном…")
         
         try:
             # Проверяем доступность Google credentials
@@ -3205,10 +3873,18 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not google_creds:
                 raise RuntimeError("Google credentials not configured")
             
-            from app.services.clients.nano_client import repose_or_relocate
-            out = await asyncio.to_thread(repose_or_relocate, stt["dressed"], "", bg_bytes)
+            bg_key = _repose_cache_key(stt["dressed"], bg=bg_bytes)
+            out = await _cached_result(bg_key)
+            if out is not None:
+                await _refund_cache_hit(update, context, uid, "tryon_background", stt.pop("bg_cost", 0))
+            else:
+                from app.services.clients.nano_client import repose_or_relocate
+                out = await _run_generation(uid, "gemini", repose_or_relocate, stt["dressed"], "", bg_bytes,
+                                            kind="repose", status=status)
+                await _store_result(bg_key, out)
             stt["dressed"] = out
-            await update.message.reply_photo(photo=out, caption="✅ Новая локация готова.", reply_markup=kb_tryon_after())
+            sent = await update.message.reply_photo(photo=out, caption="✅ Новая локация готова.", reply_markup=kb_tryon_after())
+            await media_registry.remember(uid, sent, "tryon_background")
             
         except Exception as e:
             log.exception("Background change failed for user %s: %s", uid, str(e))
@@ -3236,6 +3912,16 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if stt["stage"] == "await_person":
         stt["person"] = b
         stt["stage"] = "await_garment"
+        if extra:
+            # Альбом «человек + вещи»: первое фото — человек
+            stt["garment"] = extra[0]
+            stt["garments"] = extra[:TRYON_BATCH_MAX]
+            stt["stage"] = "confirm"
+            await update.message.reply_text(
+                f"✅ Фото человека и вещей ({len(stt['garments'])}) получены. Готовы примерять?",
+                reply_markup=kb_tryon_confirm(len(stt["garments"]))
+            )
+            return
         await update.message.reply_text("✅ Фото человека получено.\nТеперь пришлите фото одежды.",
                                         reply_markup=kb_tryon_need_garment())
         return
@@ -3245,7 +3931,7 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Проверяем, это новая одежда для смены или первая одежда
         if stt.get("dressed"):  # Если уже есть результат примерки, значит это смена одежды
-            await update.message.reply_text("⏳ Переодеваю с новой одеждой…")
+            status = await update.message.reply_text("⏳ Переодеваю с новой одеждой…")
             
             try:
                 # Проверяем доступность Google credentials
@@ -3253,15 +3939,23 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 if not google_creds:
                     raise RuntimeError("Google credentials not configured")
                 
-                from app.services.clients.tryon_client import virtual_tryon
-                loop = asyncio.get_event_loop()
-                result_bytes = await loop.run_in_executor(
-                    None, 
-                    virtual_tryon, 
-                    stt["person"], 
-                    b  # новая одежда
-                )
-                
+                garment_key = await _tryon_cache_key(uid, stt["person"], b)
+                result_bytes = await _cached_result(garment_key)
+                charged = stt.pop("garment_cost", 0)
+                if result_bytes is not None:
+                    await _refund_cache_hit(update, context, uid, "tryon_garment", charged)
+                    charged = 0
+                else:
+                    from app.services.clients.tryon_client import virtual_tryon
+                    result_bytes = await _run_generation(
+                        uid, "tryon",
+                        virtual_tryon,
+                        stt["person"],
+                        b,  # новая одежда
+                        kind="tryon", status=status, user_id=uid,
+                    )
+                    await _store_result(garment_key, result_bytes)
+
                 stt["dressed"] = result_bytes
                 stt["stage"] = "after"
                 
@@ -3270,11 +3964,12 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 subscription_data = check_subscription(uid)
                 current_balance = subscription_data.get("coins", 0)
                 
-                await update.message.reply_photo(
+                sent = await update.message.reply_photo(
                     photo=result_bytes, 
-                    caption=f"✅ Готово! Одежда изменена.\n💰 Списано: 3 монеток\n💎 Баланс: {current_balance} монеток", 
+                    caption=f"✅ Готово! Одежда изменена.\n💰 Списано: {charged} монеток\n💎 Баланс: {current_balance} монеток",
                     reply_markup=kb_tryon_after()
                 )
+                await media_registry.remember(uid, sent, "virtual_tryon")
                 
             except Exception as e:
                 log.exception("Garment change failed for user %s: %s", uid, str(e))
@@ -3298,17 +3993,28 @@ async def on_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
         else:
             # Первая одежда - переводим в режим подтверждения
+            stt["garments"] = photos[:TRYON_BATCH_MAX]
             stt["stage"] = "confirm"
             await update.message.reply_text(
-                "Фото получены. Готовы примерять?",
-                reply_markup=kb_tryon_confirm()
+                "Фото получены. Готовы примерять?\n"
+                "👗 Можно прислать ещё вещи (или сразу альбомом) — примерю все за один раз.",
+                reply_markup=kb_tryon_confirm(len(stt["garments"]))
             )
         return
 
     if stt["stage"] == "confirm":
+        # Ещё одна вещь для пакетной примерки на того же человека
+        garments = stt.setdefault("garments", [stt["garment"]] if stt.get("garment") else [])
+        if len(garments) >= TRYON_BATCH_MAX:
+            await update.message.reply_text(
+                f"Можно примерить до {TRYON_BATCH_MAX} вещей за раз. Нажмите «✨ Примерить все».",
+                reply_markup=kb_tryon_confirm(len(garments))
+            )
+            return
+        garments.extend(photos[:TRYON_BATCH_MAX - len(garments)])
         await update.message.reply_text(
-            "У нас уже есть оба снимка. Нажмите «✨ Примерить» или «🔁 Поменять местами».",
-            reply_markup=kb_tryon_confirm()
+            f"👗 Вещей для примерки: {len(garments)}. Пришлите ещё или начинайте.",
+            reply_markup=kb_tryon_confirm(len(garments))
         )
 
 # --- Инлайн кнопки ---
@@ -3744,7 +4450,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             subscription_data = check_subscription(uid)
             current_balance = subscription_data.get("coins", 0)
             
-            await q.message.edit_text(
+            status = await q.message.edit_text(
                 "🔄 Обрабатываю фото ещё раз...\n"
                 f"💰 Списано: {cost_spent} монеток\n💎 Баланс: {current_balance} монеток"
             )
@@ -3752,14 +4458,17 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             transform_type = st.get("transform_type")
             quality = st.get("transform_quality", "basic")
             
-            result_bytes = await asyncio.to_thread(
-                process_transform, 
+            result_bytes = await _run_generation(
+                uid, "gemini", process_transform,
                 transform_type, 
                 st["transform_images"], 
-                st.get("transform_text"), 
-                quality
+                st.get("transform_text"),
+                quality,
+                kind=f"transform:{transform_type}", status=status,
             )
-            
+            # «Ещё вариант» всегда идёт мимо кэша; в кэше остаётся последний вариант
+            await _store_result(_transform_cache_key(st, transform_type, quality), result_bytes)
+
             # Отмечаем успех
             on_success(st, job_id)
             
@@ -3768,11 +4477,12 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if transform_type == "polaroid":
                 caption = "✅ Новый Polaroid готов!"
             
-            await q.message.reply_photo(
+            sent = await q.message.reply_photo(
                 photo=result_bytes,
                 caption=caption,
                 reply_markup=kb_transform_result()
             )
+            await media_registry.remember(uid, sent, f"transform_{transform_type}", prompt=st.get("transform_text"), job_id=job_id)
         return
 
     # -----------------------------------------------------------------------------
@@ -4295,6 +5005,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         st.update({"mode": "helper", "scene": None, "style": None, "replica": None})
+        speculation.discard(uid)
         st["awaiting_scene"] = True
         await q.message.edit_text("🧠✨ Режим умного помощника активирован!")
         await q.message.reply_text("Опишите идею: умный помощник превратит её в сценарий для 8-секундного ролика ✨", reply_markup=kb_back_only()); return
@@ -4320,8 +5031,9 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await check_gpt_access(q):
             return
         
-        st["mode"] = "helper"; st["source_text"] = st.get("scene"); st["scene"] = improve_scene(st["scene"], "normal")
-        await q.message.edit_text(f"🧠✨ Улучшено помощником:\n\n{st['scene']}", reply_markup=kb_variants()); return
+        st["mode"] = "helper"; st["source_text"] = st.get("scene"); st["scene"] = await improve_scene(st["scene"], "normal")
+        await q.message.edit_text(f"🧠✨ Улучшено помощником:\n\n{st['scene']}", reply_markup=kb_variants())
+        _speculate_helper(uid, st); return
 
     if data == "mode_nkudo":
         st.update({"mode": "nkudo", "scene": None, "style": None, "replica": None})
@@ -4352,12 +5064,12 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         await q.message.edit_text("⏳ Генерирую сцену...")
-        st["scene"] = generate_nkudo_single_scene(); st["nkudo_type"] = "single"
+        st["scene"] = await scene_prefetch.take("nkudo_single", uid); st["nkudo_type"] = "single"
         txt = "🔮 Сгенерирована сцена в стиле NEUROKUDO\n\n🎬 Сцена (8 сек):\n" + st["scene"] + "\n\nЧто делаем дальше?"
         await q.message.edit_text(txt, reply_markup=kb_nkudo_single()); return
     if data == "nkudo_regenerate_single":
         await q.message.edit_text("🔄 Генерирую новую сцену...")
-        st["scene"] = generate_nkudo_single_scene()
+        st["scene"] = await scene_prefetch.take("nkudo_single", uid)
         txt = "🔮 Новая сцена сгенерирована\n\n🎬 Сцена (8 сек):\n" + st["scene"] + "\n\nЧто делаем дальше?"
         await q.message.edit_text(txt, reply_markup=kb_nkudo_single()); return
     if data == "nkudo_improve_single":
@@ -4371,7 +5083,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await q.message.edit_text("⏳ Ожидайте, сцена улучшается...")
             # Используем новую функцию, которая сохраняет фразы
             current_phrase = st.get("replica", "")
-            st["scene"] = improve_scene_with_phrase(st["scene"], current_phrase, mode="complex")
+            st["scene"] = await improve_scene_with_phrase(st["scene"], current_phrase, mode="complex")
             txt = "🧠✨ Сцена улучшена помощником\n\n🎬 Улучшенная сцена:\n" + st["scene"] + "\n\nОставить улучшенную версию?"
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ Оставить", callback_data="improve_keep")],
@@ -4434,19 +5146,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=35,
-                    temperature=0.8,
-                )
-                replica = resp.choices[0].message.content.strip() if resp else "Да сама довезу без принцев обойдусь!"
+                    resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=35, temperature=0.8)
+                replica = resp.strip() if resp else "Да сама довезу без принцев обойдусь!"
             except Exception as e:
                 replica = f"(⚠️ Ошибка генерации: {e})"
             
@@ -4469,19 +5176,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": embed_prompt}],
-                    max_tokens=200,
-                    temperature=0.7,
-                )
-                updated_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                    resp = await gpt_client.chat([{"role": "user", "content": embed_prompt}], max_tokens=200, temperature=0.7)
+                updated_scene = resp.strip() if resp else base_scene
                 st["scene"] = updated_scene
                 st["replica"] = replica  # Сохраняем фразу отдельно
             except Exception as e:
@@ -4497,8 +5199,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # NEUROKUDO — репортаж (2 сцены)
     if data == "nkudo_reportage":
         await q.message.edit_text("⏳ Генерирую репортаж из деревни...")
-        s1 = generate_nkudo_reportage_scene1()
-        s2, rep = generate_nkudo_reportage_scene2(s1)
+        s1, s2, rep = await generate_nkudo_reportage(uid)
         st["nkudo_scene1"] = s1; st["nkudo_scene2"] = s2; st["replica"] = rep
         st["scene"] = f"{s1}\n\n{s2}"; st["nkudo_type"] = "reportage"
         txt = ("🔮 Сгенерирован репортаж\n\n"
@@ -4509,10 +5210,10 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.message.edit_text(txt, reply_markup=kb_nkudo_reportage_edit()); return
 
     if data == "nkudo_reroll_scene1":
-        st["nkudo_scene1"] = generate_nkudo_reportage_scene1()
+        st["nkudo_scene1"] = await scene_prefetch.take("nkudo_reportage_scene1", uid)
         await q.message.edit_text(f"🔄 Новая сцена 1:\n\n{st['nkudo_scene1']}", reply_markup=kb_nkudo_reportage_edit()); return
     if data == "nkudo_reroll_scene2":
-        s2, rep = generate_nkudo_reportage_scene2(st.get("nkudo_scene1",""))
+        s2, rep = await generate_nkudo_reportage_scene2(st.get("nkudo_scene1",""))
         st["nkudo_scene2"] = s2; st["replica"] = rep
         await q.message.edit_text(f"🔄 Новая сцена 2:\n\n{st['nkudo_scene2']}\n\n💬 Фраза: {rep}",
                                   reply_markup=kb_nkudo_reportage_edit()); return
@@ -4545,8 +5246,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data == "nkudo_regenerate_report":
         await q.message.edit_text("🔄 Генерирую новый репортаж...")
-        s1 = generate_nkudo_reportage_scene1()
-        s2, rep = generate_nkudo_reportage_scene2(s1)
+        s1, s2, rep = await generate_nkudo_reportage(uid)
         st["nkudo_scene1"] = s1; st["nkudo_scene2"] = s2; st["replica"] = rep
         st["scene"] = f"{s1}\n\n{s2}"
         txt = f"🔮 Новый репортаж\n\n📺 Сцена 1: {s1}\n\n🎤 Сцена 2: {s2}\n\n💬 Фраза: {rep}"
@@ -4561,8 +5261,11 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             st["scene1_backup"] = st["nkudo_scene1"]; st["scene2_backup"] = st["nkudo_scene2"]
             # Показываем загрузочное сообщение
             await q.message.edit_text("⏳ Ожидайте, сцена улучшается...")
-            st["nkudo_scene1"] = improve_scene(st["nkudo_scene1"], "complex")
-            st["nkudo_scene2"] = improve_scene(st["nkudo_scene2"], "normal")
+            # Сцены улучшаются независимо — запускаем оба GPT-запроса параллельно
+            st["nkudo_scene1"], st["nkudo_scene2"] = await asyncio.gather(
+                improve_scene(st["nkudo_scene1"], "complex"),
+                improve_scene(st["nkudo_scene2"], "normal"),
+            )
             st["scene"] = f"{st['nkudo_scene1']}\n\n{st['nkudo_scene2']}"
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ Оставить улучшенное", callback_data="report_improve_keep")],
@@ -4606,13 +5309,13 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         await q.message.edit_text("⏳ Генерирую LEGO сцену...")
-        st["scene"] = generate_lego_single_scene(); st["lego_type"] = "single"
+        st["scene"] = await scene_prefetch.take("lego_single", uid); st["lego_type"] = "single"
         txt = "🧱 Сгенерирована LEGO сцена\n\n🎬 Сцена (8 сек):\n" + st["scene"] + "\n\nЧто делаем дальше?"
         await q.message.edit_text(txt, reply_markup=kb_lego_single()); return
 
     if data == "lego_regenerate_single":
         await q.message.edit_text("⏳ Генерирую новую LEGO сцену...")
-        st["scene"] = generate_lego_single_scene()
+        st["scene"] = await scene_prefetch.take("lego_single", uid)
         txt = "🧱 Новая LEGO сцена\n\n🎬 Сцена (8 сек):\n" + st["scene"] + "\n\nЧто делаем дальше?"
         await q.message.edit_text(txt, reply_markup=kb_lego_single()); return
 
@@ -4627,7 +5330,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await q.message.edit_text("⏳ Ожидайте, сцена улучшается...")
             # Используем новую функцию, которая сохраняет фразы
             current_phrase = st.get("replica", "")
-            st["scene"] = improve_scene_with_phrase(st["scene"], current_phrase, mode="complex")
+            st["scene"] = await improve_scene_with_phrase(st["scene"], current_phrase, mode="complex")
             txt = "🧠✨ LEGO сцена улучшена помощником\n\n🎬 Улучшенная сцена:\n" + st["scene"] + "\n\nОставить улучшенную версию?"
             kb = InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ Оставить", callback_data="lego_improve_keep")],
@@ -4658,7 +5361,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "lego_improve_again":
         # Используем новую функцию, которая сохраняет фразы
         current_phrase = st.get("replica", "")
-        st["scene"] = improve_scene_with_phrase(st.get("scene_backup", st.get("scene", "")), current_phrase, mode="complex")
+        st["scene"] = await improve_scene_with_phrase(st.get("scene_backup", st.get("scene", "")), current_phrase, mode="complex")
         # Определяем правильную клавиатуру в зависимости от режима
         if st.get("mode") == "lego":
             txt = "🔄 Обновил улучшенную версию.\n\n🎬 Сцена (8 сек):\n" + st["scene"] + "\n\nЧто делаем дальше?"
@@ -4699,19 +5402,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=35,
-                    temperature=0.8,
-                )
-                replica = resp.choices[0].message.content.strip() if resp else "Да сама довезу без принцев обойдусь!"
+                    resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=35, temperature=0.8)
+                replica = resp.strip() if resp else "Да сама довезу без принцев обойдусь!"
             except Exception as e:
                 replica = f"(⚠️ Ошибка генерации: {e})"
             
@@ -4734,19 +5432,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             try:
-                if not gpt:
+                if not gpt_client.is_configured():
 
                     replica = "Да сама довезу без принцев обойдусь!"
 
                 else:
 
-                    resp = gpt.chat.completions.create(
-                    model=OPENAI_MODEL,
-                    messages=[{"role": "user", "content": embed_prompt}],
-                    max_tokens=200,
-                    temperature=0.7,
-                )
-                updated_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                    resp = await gpt_client.chat([{"role": "user", "content": embed_prompt}], max_tokens=200, temperature=0.7)
+                updated_scene = resp.strip() if resp else base_scene
                 st["scene"] = updated_scene
                 st["replica"] = replica  # Сохраняем фразу отдельно
             except Exception as e:
@@ -4762,8 +5455,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # LEGO — репортаж
     if data == "lego_reportage":
         await q.message.edit_text("⏳ Генерирую LEGO репортаж...")
-        s1 = generate_lego_reportage_scene1()
-        s2, rep = generate_lego_reportage_scene2(s1)
+        s1, s2, rep = await generate_lego_reportage(uid)
         st["lego_scene1"] = s1; st["lego_scene2"] = s2; st["replica"] = rep
         st["scene"] = f"{s1}\n\n{s2}"; st["lego_type"] = "reportage"
         txt = f"🧱 LEGO репортаж готов\n\n📺 Сцена 1: {s1}\n\n🎤 Сцена 2: {s2}\n\n💬 Фраза: {rep}"
@@ -4786,6 +5478,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "tryon_swap":
         stt = st["tryon"]
         stt["person"], stt["garment"] = stt.get("garment"), stt.get("person")
+        stt["garments"] = [stt["garment"]] if stt.get("garment") else []
         if not stt.get("person") or not stt.get("garment"):
             await q.message.edit_text("Нужно два изображения: человек и одежда. Пришлите недостающее.",
                                       reply_markup=kb_tryon_need_garment())
@@ -4808,7 +5501,107 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if data == "tryon_confirm":
+    if data == "tryon_batch":
+        stt = st["tryon"]
+        garments = list(stt.get("garments") or [])
+        if not stt.get("person") or len(garments) < 2:
+            await q.message.reply_text("Для пакетной примерки нужны фото человека и хотя бы две вещи.",
+                                       reply_markup=kb_tryon_need_garment())
+            return
+        if stt.get("batch_running"):
+            await q.message.reply_text("⏳ Примерка уже идёт — дождитесь результата.")
+            return
+
+        # Флаг ставим сразу после проверки: между проверкой и списанием есть await,
+        # и второе нажатие (или параллельный апдейт) иначе оплатило бы пачку ещё раз
+        stt["batch_running"] = True
+        try:
+            access_check = can_use_feature(uid, "virtual_tryon")
+            if not access_check["can_use"]:
+                log.warning("CALLBACK tryon_batch uid=%s - ACCESS DENIED: %s", uid, access_check["reason"])
+                await q.message.reply_text(access_check["message"], reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("💰 Докупить монеток", callback_data="show_topup")],
+                    [InlineKeyboardButton("⬅️ Назад", callback_data="back_home")],
+                ]))
+                return
+
+            # Что уже примерялось — из кэша, платим только за новые вещи
+            cost = access_check["cost"]
+            keys = [await _tryon_cache_key(uid, stt["person"], garment) for garment in garments]
+            results: List[Any] = [await _cached_result(key) for key in keys]
+            pending = [i for i, result in enumerate(results) if result is None]
+            charge = cost * len(pending)
+            if charge and not db.charge_feature(uid, "tryon", charge, f"Virtual try-on batch x{len(pending)}"):
+                subscription_data = check_subscription(uid)
+                await q.message.reply_text(
+                    f"❌ Не хватает монеток для примерки {len(pending)} вещей.\n\n"
+                    f"💰 Монеток: {subscription_data.get('coins', 0)} (нужно: {charge})",
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("💳 Докупить", callback_data="show_topup")],
+                        [InlineKeyboardButton("👕 Только первую", callback_data="tryon_confirm")],
+                    ])
+                )
+                return
+            if charge:
+                await send_coin_notification(q, context, "charge", charge, f"Примерка {len(pending)} вещей")
+            if len(pending) < len(garments):
+                await _account_cache_hit(uid, "tryon", cost * (len(garments) - len(pending)))
+
+            log.info("CALLBACK tryon_batch uid=%s - %s garments, %s from cache", uid, len(garments), len(garments) - len(pending))
+            status = await q.message.edit_text(f"⏳ Примеряю {len(garments)} вещей…")
+            # Каждая вещь — отдельная задача планировщика: пачка подчиняется тем же слотам VTO,
+            # что и одиночные примерки, а лимит на пользователя для неё выше на
+            # SCHEDULER_BATCH_EXTRA_SLOTS. Статус ведёт последняя вещь — она выйдет из очереди
+            # позже остальных
+            fresh = await asyncio.gather(*(
+                _run_generation(uid, "tryon", virtual_tryon, stt["person"], garments[i],
+                                kind="tryon", status=status if n == len(pending) - 1 else None,
+                                batch=True, user_id=uid)
+                for n, i in enumerate(pending)
+            ), return_exceptions=True)
+        finally:
+            stt["batch_running"] = False
+        for i, result in zip(pending, fresh):
+            if isinstance(result, Exception):
+                log.warning("CALLBACK tryon_batch uid=%s - garment %s failed: %s", uid, i + 1, result)
+
+        failed = 0
+        for i, result in zip(pending, fresh):
+            if isinstance(result, (bytes, bytearray)):
+                results[i] = bytes(result)
+                await _store_result(keys[i], results[i])
+            else:
+                failed += 1
+        if failed:
+            await send_coin_notification(q, context, "refund", cost * failed, f"Не удалось примерить вещей: {failed}")
+
+        photos = [result for result in results if result]
+        if not photos:
+            await q.message.reply_text("⚠️ Примерочная сейчас недоступна. Монетки возвращены.",
+                                       reply_markup=kb_home_inline())
+            return
+
+        # Дальнейшие действия (поза, фон, описание) — с первым образом
+        stt["dressed"] = photos[0]
+        stt["stage"] = "after"
+        sent = await q.message.reply_media_group(
+            media=[
+                InputMediaPhoto(media=photo, caption=f"✅ Образ {n}/{len(photos)}")
+                for n, photo in enumerate(photos, 1)
+            ]
+        )
+        for message in sent:
+            await media_registry.remember(uid, message, "virtual_tryon")
+        await q.message.reply_text(
+            f"✅ Готово: {len(photos)} образов."
+            + (f"\n⚠️ Не получилось: {failed}" if failed else "")
+            + "\nДальше работаю с первым образом:",
+            reply_markup=kb_tryon_after()
+        )
+        return
+
+    if data in ("tryon_confirm", "tryon_confirm_fresh"):
+        force_fresh = data == "tryon_confirm_fresh"  # «Сделать заново» под результатом из кэша
         log.info("CALLBACK tryon_confirm uid=%s - STARTING", uid)
         stt = st["tryon"]
         if not stt.get("person") or not stt.get("garment"):
@@ -4844,8 +5637,25 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Списываем монеток
         cost = access_check["cost"]
+        cache_key = await _tryon_cache_key(uid, stt["person"], stt["garment"])
+        cached = await _cached_result(cache_key, force_fresh)
+        if cached is not None:
+            log.info("CALLBACK tryon_confirm uid=%s - RESULT FROM CACHE", uid)
+            stt["dressed"] = cached
+            stt["stage"] = "after"
+            balance = await _account_cache_hit(uid, "tryon", cost)
+            await q.message.reply_photo(
+                photo=cached,
+                caption=f"✅ Готово! Одежда перенесена на человека.\n{CACHE_HIT_NOTE}\n💎 Баланс: {balance} монеток",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton(f"🆕 Сделать заново (−{cost} монеток)", callback_data="tryon_confirm_fresh")]]
+                    + list(kb_tryon_after().inline_keyboard)
+                ),
+            )
+            return
+
+        # Списываем монеток
         if not db.charge_feature(uid, "tryon", cost, "Virtual try-on"):
             log.error("CALLBACK tryon_confirm uid=%s - CHARGE FAILED", uid)
             await q.message.reply_text("❌ Ошибка списания монеток. Попробуйте позже.")
@@ -4854,17 +5664,21 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Отправляем уведомление о списании
         await send_coin_notification(q, context, "charge", cost, "Виртуальная примерка")
         log.info("CALLBACK tryon_confirm uid=%s - BALANCE CHARGED, STARTING PROCESSING", uid)
-        await q.message.edit_text("⏳ Делаю примерку…")
+        if force_fresh:
+            # Кнопка под фото из кэша: подпись фото в текст не превратить — новое сообщение
+            progress = await q.message.reply_text("⏳ Делаю примерку…")
+        else:
+            progress = await q.message.edit_text("⏳ Делаю примерку…")
         try:
             # Проверяем наличие изображений
             log.info("CALLBACK tryon_confirm uid=%s - PERSON SIZE: %s, GARMENT SIZE: %s", 
                     uid, len(stt["person"]) if stt["person"] else 0, 
                     len(stt["garment"]) if stt["garment"] else 0)
             
-            # Используем loop.run_in_executor для совместимости
-            loop = asyncio.get_event_loop()
             log.info("CALLBACK tryon_confirm uid=%s - CALLING VTO", uid)
-            result_bytes = await loop.run_in_executor(None, virtual_tryon, stt["person"], stt["garment"], 1)
+            result_bytes = await _run_generation(uid, "tryon", virtual_tryon, stt["person"], stt["garment"], 1,
+                                                kind="tryon", status=progress, user_id=uid)
+            await _store_result(cache_key, result_bytes)
             stt["dressed"] = result_bytes
             log.info("CALLBACK tryon_confirm uid=%s - VTO SUCCESS, RESULT SIZE: %s", uid, len(result_bytes))
             
@@ -4873,7 +5687,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             subscription_data = check_subscription(uid)
             current_balance = subscription_data.get("coins", 0)
             
-            await q.message.edit_media(
+            await progress.edit_media(
                 media=InputMediaPhoto(
                     media=result_bytes,
                     caption=f"✅ Готово! Одежда перенесена на человека.\n💰 Списано: {cost} монеток\n💎 Баланс: {current_balance} монеток",
@@ -4915,8 +5729,20 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Списываем монеток
         cost = access_check["cost"]
+        pose_key = _repose_cache_key(st["tryon"]["dressed"], "pose_change", style="natural_pose")
+        cached = await _cached_result(pose_key)
+        if cached is not None:
+            st["tryon"]["dressed"] = cached
+            st["tryon"]["stage"] = "after"
+            balance = await _account_cache_hit(uid, "tryon_pose", cost)
+            await q.message.edit_media(
+                media=InputMediaPhoto(media=cached, caption=f"✅ Готово! Поза изменена.\n{CACHE_HIT_NOTE}\n💎 Баланс: {balance} монеток"),
+                reply_markup=kb_tryon_after()
+            )
+            return
+
+        # Списываем монеток
         if not db.charge_feature(uid, "tryon_pose", cost, "Virtual try-on pose change"):
             log.error("CALLBACK tryon_new_pose uid=%s - CHARGE FAILED", uid)
             await q.message.reply_text("❌ Ошибка списания монеток. Попробуйте позже.")
@@ -4951,15 +5777,16 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             log.info("CALLBACK tryon_new_pose uid=%s - GENERATING NEW POSE", uid)
             
             # Генерируем новую позу на основе текущего результата
-            loop = asyncio.get_event_loop()
-            new_pose_bytes = await loop.run_in_executor(
-                None, 
+            new_pose_bytes = await _run_generation(
+                uid, "gemini",
                 repose_or_relocate, 
                 stt["dressed"],  # Используем уже готовое изображение
                 "pose_change",   # Тип операции - смена позы
-                "natural_pose"   # Стиль позы
+                "natural_pose",  # Стиль позы
+                kind="repose",
             )
-            
+            await _store_result(pose_key, new_pose_bytes)
+
             # Обновляем результат
             stt["dressed"] = new_pose_bytes
             stt["stage"] = "after"
@@ -5044,6 +5871,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         stt = st["tryon"]
         stt["stage"] = "await_garment"
+        stt["garment_cost"] = cost  # при выдаче из кэша вернём ровно списанное
         await q.message.edit_media(
             media=InputMediaPhoto(
                 media=stt["dressed"],  # Используем уже готовое изображение
@@ -5092,6 +5920,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         stt = st["tryon"]
         stt["await_bg"] = True
+        stt["bg_cost"] = cost  # при выдаче из кэша вернём ровно списанное
         await q.message.edit_media(
             media=InputMediaPhoto(
                 media=stt["dressed"],  # Используем уже готовое изображение
@@ -5119,24 +5948,31 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Варианты улучшения
-    if data == "var_complex" and st.get("source_text") and gpt:
+    if data == "var_complex" and st.get("source_text") and gpt_client.is_configured():
         # Проверяем доступ к GPT функциям
         if not await check_gpt_access(q):
             return
-        st["scene"] = improve_scene(st["source_text"], "complex")
-        await q.message.edit_text(f"🔍 Усложнено:\n\n{st['scene']}", reply_markup=kb_variants()); return
-    if data == "var_simple" and st.get("source_text") and gpt:
+        st["scene"] = await improve_scene(st["source_text"], "complex",
+                                          on_delta=_stream_editor(q.message, "🔍 Усложнено:\n\n"))
+        await q.message.edit_text(f"🔍 Усложнено:\n\n{st['scene']}", reply_markup=kb_variants())
+        _speculate_helper(uid, st); return
+    if data == "var_simple" and st.get("source_text") and gpt_client.is_configured():
         # Проверяем доступ к GPT функциям
         if not await check_gpt_access(q):
             return
-        st["scene"] = improve_scene(st["source_text"], "simple")
-        await q.message.edit_text(f"✂️ Упрощено:\n\n{st['scene']}", reply_markup=kb_variants()); return
-    if data == "var_again" and st.get("source_text") and gpt:
+        st["scene"] = await improve_scene(st["source_text"], "simple",
+                                          on_delta=_stream_editor(q.message, "✂️ Упрощено:\n\n"))
+        await q.message.edit_text(f"✂️ Упрощено:\n\n{st['scene']}", reply_markup=kb_variants())
+        _speculate_helper(uid, st); return
+    if data == "var_again" and st.get("source_text") and gpt_client.is_configured():
         # Проверяем доступ к GPT функциям
         if not await check_gpt_access(q):
             return
-        st["scene"] = improve_scene(st["source_text"], "normal")
-        await q.message.edit_text(f"🔄 Переделано:\n\n{st['scene']}", reply_markup=kb_variants()); return
+        # «Переделать» — всегда новый вариант, мимо кэша
+        st["scene"] = await improve_scene(st["source_text"], "normal", use_cache=False,
+                                          on_delta=_stream_editor(q.message, "🔄 Переделано:\n\n"))
+        await q.message.edit_text(f"🔄 Переделано:\n\n{st['scene']}", reply_markup=kb_variants())
+        _speculate_helper(uid, st); return
 
     # Переход к ориентации (пропускаем выбор стилей)
     if data in ("go_next", "choose_style"):
@@ -5267,19 +6103,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
         try:
-            if not gpt:
+            if not gpt_client.is_configured():
 
                 replica = "Да сама довезу без принцев обойдусь!"
 
             else:
 
-                resp = gpt.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=35,
-                temperature=0.8,
-            )
-            replica = resp.choices[0].message.content.strip() if resp else "Да сама довезу без принцев обойдусь!"
+                resp = await gpt_client.chat([{"role": "user", "content": prompt}], max_tokens=35, temperature=0.8)
+            replica = resp.strip() if resp else "Да сама довезу без принцев обойдусь!"
         except Exception as e:
             replica = f"(⚠️ Ошибка генерации: {e})"
 
@@ -5312,60 +6143,12 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.message.edit_text("⏳ Ожидайте, фраза генерируется...")
         
         base_scene = st.get("scene", "")
-        style_note = st.get("style") or "без стиля"
-
-        if st.get("mode") == "nkudo":
-            # Специальный промпт для NEUROKUDO
-                prompt = (
-                f"Write grandmother's dialogue in NEUROKUDO style for this scene.\n\n"
-                f"Scene: {base_scene}\n"
-                f"Style: {style_note}\n\n"
-                f"NEUROKUDO DIALOGUE STYLE:\n"
-                f"- Grandmother (75-85 years old) speaks calmly as if incredible things are normal\n"
-                f"- Village accent, simple words, sometimes with humor\n"
-                f"- Reactions: pride, explanation, calmness before absurdity\n"
-                f"EXAMPLES FROM NEUROKUDO (for inspiration, create NEW variations):\n"
-                f"- 'Взяла вот на передержку маленьких, скоро выпустят их, пусть сил набираются'\n"
-                f"- 'Да соседка бегемотов завела, я решила чем мы хуже, заказали вот малышей из Намибии'\n"
-                f"- 'Аккуратнее, лАрочка, чего ты нервничаешь. Сейчас они уйдут'\n"
-                f"- 'Не бойтесь её. Это Лариска. В погребе нашла, между банок сидела'\n"
-                f"- 'Вот, мои несушки, кормилицы мои, каждое утро свежие яички'\n\n"
-                f"TASK: Create NEW dialogue inspired by these examples, not copy them.\n"
-                f"Use similar tone and style but with different words and situations.\n"
-                f"Write in RUSSIAN. Format: ONE complete sentence, maximum 20 words.\n"
-                f"STRICT RULE: NO DASHES, HYPHENS, OR EM DASHES (—, -, –) in the dialogue!\n"
-                f"LENGTH RULE: Maximum 20 words total. Make it complete and conversational!"
-            )
-        else:
-            # Обычный промпт для других режимов
-            prompt = (
-            f"Напиши короткую и выразительную фразу для сцены.\n\n"
-            f"Сцена: {base_scene}\n"
-            f"Стиль: {style_note}\n\n"
-                f"Формат: ОДНО полное предложение, максимум 20 слов.\n"
-                f"СТРОГО ЗАПРЕЩЕНО: никаких тире, дефисов или длинных тире (—, -, –) в фразе!\n"
-                f"ДЛИНА: максимум 20 слов. Делай завершенным и разговорно!"
-        )
-
-        try:
-            if not gpt:
-
-                replica = "Да сама довезу без принцев обойдусь!"
-
-            else:
-
-                resp = gpt.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=35,
-                temperature=0.8,
-            )
-            replica = resp.choices[0].message.content.strip() if resp else "Да сама довезу без принцев обойдусь!"
-        except Exception as e:
-            replica = f"(⚠️ Ошибка генерации: {e})"
-
-        # Очищаем фразу от тире
-        replica = _clean_replica(replica)
+        replica = None
+        if st.get("mode") == "helper":
+            # Фраза могла быть посчитана заранее, пока пользователь читал сцену
+            replica = await speculation.claim(uid, "replica", _replica_key(st))
+        if not replica:
+            replica = await generate_scene_replica(base_scene, st.get("style"), st.get("mode"))
         st["replica"] = replica
         
         # Убираем предыдущее меню и показываем новое
@@ -5390,19 +6173,14 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 
                 try:
-                    if not gpt:
+                    if not gpt_client.is_configured():
 
                         replica = "Да сама довезу без принцев обойдусь!"
 
                     else:
 
-                        resp = gpt.chat.completions.create(
-                        model=OPENAI_MODEL,
-                        messages=[{"role": "user", "content": embed_prompt}],
-                        max_tokens=200,
-                        temperature=0.7,
-                    )
-                    updated_scene = resp.choices[0].message.content.strip() if resp else base_scene
+                        resp = await gpt_client.chat([{"role": "user", "content": embed_prompt}], max_tokens=200, temperature=0.7)
+                    updated_scene = resp.strip() if resp else base_scene
                     st["scene"] = updated_scene
                 except Exception as e:
                     updated_scene = f"{st['scene']}\n\nБабушка говорит: {replica}"
@@ -5433,6 +6211,8 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         [InlineKeyboardButton("➡️ Далее", callback_data="go_orientation")]
                     ])
                 )
+        # Сцена обновилась вместе с фразой — пересчитываем предварительный промт
+        _speculate_helper(uid, st)
         return
 
 
@@ -5453,6 +6233,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Переходим к выбору вариантов видео с полной стоимостью
         await q.message.edit_text("Выбери вариант видео:", reply_markup=kb_video_options())
+        _speculate_helper(uid, st)
         return
     
     # --- Выбор варианта видео ---
@@ -5527,6 +6308,7 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "cancel_procedure":
         # Очищаем все данные и возвращаемся в главное меню
         st.update({"scene": None, "style": None, "replica": None, "orientation": None, "mode": None, "with_audio": DEFAULT_AUDIO})
+        speculation.discard(uid)
         await q.message.edit_text("❌ Процедура отменена. Возврат в главное меню.", reply_markup=kb_home_inline())
         return
 
@@ -5571,34 +6353,59 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "⏳ Генерирую видео… Это может занять несколько минут."
         )
         try:
-            # REPORTAGE — два видео подряд
+            # REPORTAGE — две сцены генерируются параллельно
             if st.get("nkudo_type") == "reportage" or st.get("mode") == "reportage":
-                prompt1 = to_json_prompt(
-                    st.get("nkudo_scene1",""), st.get("style"), None, "reportage",
-                    aspect_ratio=st["orientation"], context=None
-                )
-                prompt2 = to_json_prompt(
-                    st.get("nkudo_scene2",""), st.get("style"), st.get("replica"), "reportage",
-                    aspect_ratio=st["orientation"], context=st.get("nkudo_scene1")
-                )
-
                 video_duration = int(duration.replace("s", ""))
-                res1 = await asyncio.to_thread(generate_video_sync, prompt1, duration=video_duration, aspect_ratio=st["orientation"], with_audio=st.get("with_audio", True))
-                vids1 = (res1 or {}).get("videos", [])
-                if vids1 and vids1[0].get("file_path") and os.path.exists(vids1[0]["file_path"]):
-                    with open(vids1[0]["file_path"], "rb") as f:
-                        await q.message.reply_video(video=f, caption="📺 Сцена 1", supports_streaming=True)
-                else:
-                    await q.message.reply_text("⚠️ Сцена 1: видео не вернулось.")
-
-                res2 = await asyncio.to_thread(generate_video_sync, prompt2, duration=video_duration, aspect_ratio=st["orientation"], with_audio=st.get("with_audio", True))
-                vids2 = (res2 or {}).get("videos", [])
-                cap2 = "🎤 Сцена 2" + (f"\n💬 {st.get('replica')}" if st.get("replica") else "")
-                if vids2 and vids2[0].get("file_path") and os.path.exists(vids2[0]["file_path"]):
-                    with open(vids2[0]["file_path"], "rb") as f:
-                        await q.message.reply_video(video=f, caption=cap2, supports_streaming=True)
+                common = dict(uid=uid, style=st.get("style"), aspect_ratio=st["orientation"],
+                              duration=video_duration, with_audio=st.get("with_audio", True))
+                scenes = [
+                    dict(scene=st.get("nkudo_scene1", ""), replica=None, context=None, status=msg, **common),
+                    dict(scene=st.get("nkudo_scene2", ""), replica=st.get("replica"),
+                         context=st.get("nkudo_scene1"), **common),
+                ]
+                captions = [
+                    "📺 Сцена 1",
+                    "🎤 Сцена 2" + (f"\n💬 {st.get('replica')}" if st.get("replica") else ""),
+                ]
+                results = await run_scene_jobs(scenes)
+
+                # Все сцены готовы — склеиваем в один ролик и отправляем одним файлом
+                files = [r for r in results if isinstance(r, str)]
+                merged = None
+                if len(files) == len(scenes):
+                    merged = await executors.run("upstream", concat_videos, files, st["orientation"])
+
+                # Fan-in: возвращаем долю только за упавшие сцены
+                shares = _split_cost(cost, len(scenes))
+                refund = 0
+                if merged:
+                    with open(merged, "rb") as f:
+                        sent = await q.message.reply_video(video=f, caption="\n".join(captions), supports_streaming=True)
+                    await media_registry.remember(uid, sent, "video_reportage", prompt=st.get("scene"))
                 else:
-                    await q.message.reply_text("⚠️ Сцена 2: видео не вернулось.")
+                    # Склейка не удалась или сцен не хватает — отправляем по отдельности в исходном порядке
+                    for idx, (result, caption) in enumerate(zip(results, captions), start=1):
+                        if isinstance(result, Exception):
+                            log.error("Reportage scene %s failed for user %s: %s", idx, uid, result)
+                            result = None
+                        if result:
+                            with open(result, "rb") as f:
+                                sent = await q.message.reply_video(video=f, caption=caption, supports_streaming=True)
+                            await media_registry.remember(uid, sent, "video_reportage", prompt=scenes[idx - 1]["scene"])
+                        else:
+                            refund += shares[idx - 1]
+                            await q.message.reply_text(f"⚠️ Сцена {idx}: видео не вернулось.")
+
+                if refund:
+                    await send_coin_notification(q, context, "refund", refund, "Сцена репортажа не сгенерировалась")
+
+                if refund == cost:
+                    # Не получилось ни одной сцены — задача провалена, монетки уже возвращены
+                    if st.get("current_job_id"):
+                        on_error(st, st["current_job_id"], reason="video_error")
+                        st["current_job_id"] = None
+                    await q.message.reply_text("⚠️ Видео не вернулось. Попробуйте ещё раз.", reply_markup=kb_home_inline())
+                    return
 
                 # Отмечаем задачу как успешную
                 if st.get("current_job_id"):
@@ -5615,12 +6422,18 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 video_duration = int(st.get("video_duration", "8s").replace("s", ""))
                 prompt = process_manual_prompt(st["scene"], st["orientation"], mode="manual", duration=video_duration)
             else:
-                prompt = to_json_prompt(
-                    st["scene"], st.get("style"), st.get("replica"), st.get("mode"),
-                    aspect_ratio=st["orientation"], context=None
-                )
+                prompt = None
+                if st.get("mode") == "helper":
+                    # Предварительный промт подходит, только если сцена/стиль/фраза/ориентация не менялись
+                    prompt = await speculation.claim(uid, "json", _prompt_key(st))
+                if not prompt:
+                    prompt = await to_json_prompt(
+                        st["scene"], st.get("style"), st.get("replica"), st.get("mode"),
+                        aspect_ratio=st["orientation"], context=None
+                    )
             video_duration = int(duration.replace("s", ""))
-            res = await asyncio.to_thread(generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=st.get("with_audio", True))
+            res = await _run_generation(uid, "veo", generate_video_sync, prompt, duration=video_duration, aspect_ratio=st["orientation"], with_audio=with_audio,
+                                        kind=_veo_kind(video_duration, with_audio), status=msg)
             videos = (res or {}).get("videos", [])
             if not videos:
                 await q.message.reply_text("⚠️ Видео не вернулось. Попробуйте ещё раз.", reply_markup=kb_home_inline())
@@ -5638,8 +6451,10 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             if file_path and os.path.exists(file_path):
                 with open(file_path, "rb") as f:
-                    await q.message.reply_video(video=f, caption=caption, supports_streaming=True, reply_markup=kb_video_result())
-                    await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️")
+                    sent = await q.message.reply_video(video=f, caption=caption, supports_streaming=True, reply_markup=kb_video_result())
+                media_id = await media_registry.remember(uid, sent, "video", prompt=st.get("scene"))
+                await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️",
+                                           reply_markup=kb_send_again(media_id))
             elif uri:
                 await q.message.reply_text(f"{caption}\n\n🔗 GCS: {uri}", reply_markup=kb_video_result())
                 await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️")
@@ -5725,7 +6540,9 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "⏳ Генерирую видео по JSON…"
         )
         try:
-            res = await asyncio.to_thread(generate_video_sync, jj, duration=8, aspect_ratio=orr, with_audio=st.get("with_audio", True))
+            with_audio = st.get("with_audio", True)
+            res = await _run_generation(uid, "veo", generate_video_sync, jj, duration=8, aspect_ratio=orr, with_audio=with_audio,
+                                        kind=_veo_kind(8, with_audio), status=msg)
             videos = (res or {}).get("videos", [])
             if not videos:
                 await q.message.reply_text("⚠️ Видео не вернулось. Попробуй ещё раз.", reply_markup=kb_home_inline())
@@ -5734,8 +6551,10 @@ async def on_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
             caption = f"✅ Видео по JSON готово!\n📐 Ориентация: {orr}"
             if file_path and os.path.exists(file_path):
                 with open(file_path, "rb") as f:
-                    await q.message.reply_video(video=f, caption=caption, supports_streaming=True, reply_markup=kb_after_video())
-                    await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️")
+                    sent = await q.message.reply_video(video=f, caption=caption, supports_streaming=True, reply_markup=kb_after_video())
+                media_id = await media_registry.remember(uid, sent, "video_json")
+                await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️",
+                                           reply_markup=kb_send_again(media_id))
             elif uri:
                 await q.message.reply_text(f"{caption}\n\n🔗 GCS: {uri}", reply_markup=kb_after_video())
                 await q.message.reply_text("🎉 Видео готово!\n\nПришлите новый промт для продолжения генерации, или вернитесь в главное меню ⬇️")
@@ -5869,6 +6688,10 @@ def create_app():
     app.add_handler(CommandHandler("add_bonus", cmd_add_bonus))  # команда для админских монеток
     app.add_handler(CommandHandler("reload_profile", cmd_reload_profile))  # перезагрузка профиля из БД
     app.add_handler(CommandHandler("reset_my_profile", cmd_reset_my_profile))  # сброс профиля админа
+    app.add_handler(CommandHandler("send_media", cmd_send_media))  # повторная отправка медиа по file_id
+    app.add_handler(CommandHandler("gpt_stats", cmd_gpt_stats))  # метрики GPT-шлюза
+    app.add_handler(CommandHandler("image_stats", cmd_image_stats))  # кэш результатов изображений
+    app.add_handler(CommandHandler("pool_stats", cmd_pool_stats))  # загрузка пулов исполнителей
     # app.add_handler(CallbackQueryHandler(on_cb))  # DEPRECATED: заменен на новый роутер
     register_router(app)  # Новый роутер для обработки callback-ов
     app.add_handler(MessageHandler(filters.PHOTO, on_photo))  # приём фото (примерочная)
@@ -5897,6 +6720,10 @@ def initialize_bot():
         db.init_tables()
         log.info("Database initialized successfully")
         
+        # Реестр сгенерированных медиа (file_id для повторной отправки)
+        from app.db import db_media
+        db_media.init_media_table()
+        
         # Проверяем и сбрасываем истёкшие подписки при старте
         check_and_reset_expired_plans()
         log.info("Expired subscriptions checked on startup")
@@ -5916,6 +6743,10 @@ def initialize_bot():
         log.error(f"YooKassa initialization failed: {e}")
         # Продолжаем работу без платежей
     
+    # Фоновый прогрев пула сцен NEUROKUDO/LEGO (только если GPT доступен)
+    if gpt_client.is_configured():
+        scene_prefetch.start()
+    
     _acquire_singleton_lock()
     return create_app()
 
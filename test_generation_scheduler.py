@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика генераций
+Проверяет справедливую очередь по тарифам, лимит задач на пользователя и оценку ETA
+"""
+
+import os
+import sys
+import asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from app.services import generation_scheduler as gs
+
+_DEFAULT_SLOTS = dict(gs.MODEL_SLOTS)
+
+def _reset(**slots):
+    """Чистое состояние планировщика; slots — переопределение слотов моделей"""
+    gs._queue.clear()
+    gs._running.clear()
+    gs._user_finish.clear()
+    gs._running_user.clear()
+    gs._latency.clear()
+    gs._waits.clear()
+    gs._stats.clear()
+    gs._virtual_time = 0.0
+    gs._running_total = 0
+    gs.MODEL_SLOTS.clear()
+    gs.MODEL_SLOTS.update(_DEFAULT_SLOTS, **slots)
+    for model in gs.MODEL_SLOTS:
+        gs._running_model[model] = 0
+    gs.SCHEDULER_AGING_RATE = 0.0  # тесты быстрые, старение только мешает порядку
+
+async def _hold(user_id: int, model: str, plan: str, started: asyncio.Event, release: asyncio.Event,
+                kind: str = None):
+    """Занять слот и держать его, пока не выставлен release"""
+    async with gs.job(user_id, model, plan, kind=kind):
+        started.set()
+        await release.wait()
+
+def test_plan_weights_order_queue():
+    """Второй задаче pro достаётся слот раньше, чем второй задаче без подписки"""
+    print("🔍 ТЕСТ: справедливая очередь по тарифам")
+    _reset(veo=1)
+
+    async def scenario():
+        order = []
+
+        async def run(name: str, user_id: int, plan: str):
+            async with gs.job(user_id, "veo", plan):
+                order.append(name)
+
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(1, "veo", "pro", started, release))
+        await started.wait()
+
+        tasks = []
+        for name, user_id, plan in [("free1", 2, gs.FREE_PLAN), ("pro1", 3, "pro"),
+                                    ("pro2", 3, "pro"), ("free2", 2, gs.FREE_PLAN)]:
+            tasks.append(asyncio.create_task(run(name, user_id, plan)))
+            await asyncio.sleep(0)  # задача встала в очередь
+        assert gs.get_stats()["models"]["veo"]["queued"] == 4
+
+        release.set()
+        await asyncio.gather(holder, *tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    print(f"  порядок: {order}")
+    assert order == ["free1", "pro1", "pro2", "free2"], order
+    print("✅ pro обслуживается чаще, но первая задача free не ждёт его очереди")
+
+def test_user_cap():
+    """У пользователя не больше SCHEDULER_USER_MAX_IN_FLIGHT задач, остальные не блокируются"""
+    print("🔍 ТЕСТ: лимит одновременных задач на пользователя")
+    _reset(gemini=8)
+    cap = gs.SCHEDULER_USER_MAX_IN_FLIGHT
+
+    async def scenario():
+        running = {}
+        peak = {}
+        release = asyncio.Event()
+        other_started = asyncio.Event()
+
+        async def run(user_id: int):
+            async with gs.job(user_id, "gemini", "pro"):
+                running[user_id] = running.get(user_id, 0) + 1
+                peak[user_id] = max(peak.get(user_id, 0), running[user_id])
+                if user_id == 2:
+                    other_started.set()
+                await release.wait()
+                running[user_id] -= 1
+
+        greedy = [asyncio.create_task(run(1)) for _ in range(cap + 2)]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(run(2))
+        # Чужая задача получает слот, хотя встала в очередь позже
+        await asyncio.wait_for(other_started.wait(), timeout=1)
+        assert running[1] == cap, running
+        assert gs.get_stats()["queued"] == 2
+
+        release.set()
+        await asyncio.gather(*greedy, other)
+        return peak
+
+    peak = asyncio.run(scenario())
+    assert peak[1] == cap, peak
+    assert gs.get_stats()["running"] == 0
+    print(f"✅ пик одновременных задач пользователя: {peak[1]} (лимит {cap})")
+
+def test_batch_extra_slots():
+    """Задачи пачки получают SCHEDULER_BATCH_EXTRA_SLOTS слотов сверх лимита, но не больше"""
+    print("🔍 ТЕСТ: дополнительные слоты для пачки")
+    _reset(tryon=8)
+    limit = gs.SCHEDULER_USER_MAX_IN_FLIGHT + gs.SCHEDULER_BATCH_EXTRA_SLOTS
+
+    async def scenario():
+        running, peak = 0, 0
+        release = asyncio.Event()
+
+        async def run():
+            nonlocal running, peak
+            async with gs.job(1, "tryon", "lite", batch=True):
+                running += 1
+                peak = max(peak, running)
+                await release.wait()
+                running -= 1
+
+        tasks = [asyncio.create_task(run()) for _ in range(limit + 2)]
+        await asyncio.sleep(0.01)
+        assert running == limit and gs.get_stats()["queued"] == 2, (running, gs.get_stats())
+        release.set()
+        await asyncio.gather(*tasks)
+        return peak
+
+    peak = asyncio.run(scenario())
+    assert peak == limit, peak
+    print(f"✅ пачка идёт в {limit} слотах (лимит {gs.SCHEDULER_USER_MAX_IN_FLIGHT} + {gs.SCHEDULER_BATCH_EXTRA_SLOTS})")
+
+def test_eta():
+    """Место в очереди и ETA считаются по перцентилям длительности вида задачи"""
+    print("🔍 ТЕСТ: место в очереди и ETA")
+    _reset(veo=1)
+    kind = "veo:8s:audio"
+    gs._latency[kind] = gs.deque([100.0] * gs.LATENCY_MIN_SAMPLES, maxlen=gs.LATENCY_WINDOW)
+
+    async def scenario():
+        statuses = {}
+        reported = {name: asyncio.Event() for name in ("first", "second")}
+
+        async def run(name: str, user_id: int):
+            async def on_status(position: int, eta: float):
+                statuses.setdefault(name, (position, eta))
+                reported[name].set()
+
+            async with gs.job(user_id, "veo", "lite", kind=kind, on_status=on_status):
+                pass
+
+        started, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(_hold(1, "veo", "lite", started, release, kind=kind))
+        await started.wait()
+
+        first = asyncio.create_task(run("first", 2))
+        await reported["first"].wait()
+        second = asyncio.create_task(run("second", 3))
+        await reported["second"].wait()
+
+        release.set()
+        await asyncio.gather(holder, first, second)
+        return statuses
+
+    statuses = asyncio.run(scenario())
+    print(f"  статусы: {statuses}")
+    position, eta = statuses["first"]
+    assert position == 1 and 195 < eta <= 200, statuses
+    position, eta = statuses["second"]
+    assert position == 2 and 295 < eta <= 300, statuses
+    print("✅ ETA = остаток текущей задачи + длительности задач впереди")
+
+def test_unknown_model():
+    _reset()
+
+    async def scenario():
+        async with gs.job(1, "sora", "lite"):
+            pass
+
+    try:
+        asyncio.run(scenario())
+    except ValueError:
+        print("✅ неизвестная модель отклоняется")
+    else:
+        raise AssertionError("ValueError expected")
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов планировщика генераций\n")
+    test_plan_weights_order_queue()
+    test_user_cap()
+    test_batch_extra_slots()
+    test_eta()
+    test_unknown_model()
+    print("\n✅ Все тесты прошли успешно!")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Тест кэша ответов GPT
+Проверяет, что повторный запрос промта Veo (rich_json, temperature 0.55) отдаётся из кэша
+"""
+
+import os
+import sys
+import asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from app.services.clients import gpt_client
+
+# Параметры вызова из _rich_json_template (main.py)
+RICH_JSON_TEMPERATURE = 0.55
+RICH_JSON_CACHE_MAX_TEMPERATURE = 0.55
+
+def _fake_gpt():
+    """Подменить запрос к OpenAI счётчиком вызовов"""
+    calls = []
+
+    async def request(messages, temperature, max_tokens, timeout, model, label=None, response_format=None):
+        calls.append(label)
+        return '{"scene": "бабушка во дворе"}'
+
+    gpt_client._request = request
+    gpt_client.GPT_CACHE_DB = ""
+    gpt_client._cache.clear()
+    gpt_client.configure("test-key", "gpt-4o-mini")
+    return calls
+
+def _rich_json(cache_max_temperature):
+    return gpt_client.complete(
+        "Return VALID JSON only", "scene: бабушка во дворе",
+        temperature=RICH_JSON_TEMPERATURE, max_tokens=1300, label="rich_json",
+        cache_max_temperature=cache_max_temperature,
+    )
+
+def test_rich_json_second_call_is_cache_hit():
+    print("🔍 ТЕСТ: повторный промт Veo из кэша")
+    calls = _fake_gpt()
+    hits = gpt_client.get_metrics()["cache_hits"]
+
+    async def scenario():
+        first = await _rich_json(RICH_JSON_CACHE_MAX_TEMPERATURE)
+        second = await _rich_json(RICH_JSON_CACHE_MAX_TEMPERATURE)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert calls == ["rich_json"], calls
+    assert gpt_client.get_metrics()["cache_hits"] == hits + 1
+    print("✅ второй запрос отдан из кэша без обращения к GPT")
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов кэша GPT\n")
+    test_rich_json_second_call_is_cache_hit()
+    print("\n✅ Все тесты прошли успешно!")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Тест сборщика альбомов (media group)
+Проверяет выбор ведущего апдейта и ожидание конца альбома (debounce и предельное ожидание)
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from app.services import media_group
+
+def _reset(debounce: float, max_wait: float):
+    media_group._groups.clear()
+    media_group._collected.clear()
+    media_group.MEDIA_GROUP_DEBOUNCE = debounce
+    media_group.MEDIA_GROUP_MAX_WAIT = max_wait
+
+def test_leader_election():
+    """Ведущий — только первый апдейт альбома, у каждого альбома свой"""
+    print("🔍 ТЕСТ: выбор ведущего")
+    _reset(debounce=0.01, max_wait=1.0)
+    assert media_group.add("album-1", 10, "p10") is True
+    assert media_group.add("album-1", 11, "p11") is False
+    assert media_group.add("album-2", 20, "p20") is True  # другой альбом — свой ведущий
+
+    photos = asyncio.run(media_group.collect("album-1"))
+    assert photos == ["p10", "p11"], photos
+    print("✅ ведущий выбирается один раз на альбом")
+
+def test_debounce_collects_late_photos():
+    """Фото, пришедшие во время паузы, попадают в альбом в порядке сообщений"""
+    print("🔍 ТЕСТ: debounce")
+    _reset(debounce=0.1, max_wait=2.0)
+
+    async def scenario():
+        assert media_group.add("album", 3, "p3")
+        collector = asyncio.create_task(media_group.collect("album"))
+        for message_id in (1, 2):
+            await asyncio.sleep(0.05)
+            assert not media_group.add("album", message_id, f"p{message_id}")
+        started = time.monotonic()
+        photos = await collector
+        return photos, time.monotonic() - started
+
+    photos, waited = asyncio.run(scenario())
+    assert photos == ["p1", "p2", "p3"], photos
+    assert waited >= 0.05, waited  # сбор дождался паузы после последнего фото
+    print(f"✅ альбом собран после паузы: {photos}")
+
+def test_max_wait():
+    """Непрерывный поток фото не держит альбом дольше MEDIA_GROUP_MAX_WAIT"""
+    print("🔍 ТЕСТ: предельное ожидание")
+    _reset(debounce=0.1, max_wait=0.3)
+
+    async def scenario():
+        media_group.add("album", 0, "p0")
+        started = time.monotonic()
+        collector = asyncio.create_task(media_group.collect("album"))
+        message_id = 0
+        while not collector.done():
+            await asyncio.sleep(0.03)
+            message_id += 1
+            media_group.add("album", message_id, f"p{message_id}")
+        return await collector, time.monotonic() - started
+
+    photos, waited = asyncio.run(scenario())
+    assert waited < 0.6, waited
+    assert photos[0] == "p0" and len(photos) > 1, photos
+    print(f"✅ альбом отдан через {waited:.2f} с, фото: {len(photos)}")
+
+def test_late_photo_after_collection():
+    """Фото, опоздавшее после сбора, отбрасывается и не открывает второй альбом"""
+    print("🔍 ТЕСТ: опоздавшее фото")
+    _reset(debounce=0.01, max_wait=1.0)
+    media_group.add("album", 1, "p1")
+    photos = asyncio.run(media_group.collect("album"))
+    assert photos == ["p1"], photos
+
+    assert media_group.add("album", 2, "p2") is False
+    assert "album" not in media_group._groups
+
+    tombstone = media_group.MEDIA_GROUP_TOMBSTONE
+    media_group.MEDIA_GROUP_TOMBSTONE = 0.0
+    time.sleep(0.01)
+    try:
+        # Через MEDIA_GROUP_TOMBSTONE тот же ключ снова может начать альбом
+        assert media_group.add("album", 3, "p3") is True
+    finally:
+        media_group.MEDIA_GROUP_TOMBSTONE = tombstone
+    print("✅ опоздавшее фото отброшено, второго ведущего нет")
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов сборщика альбомов\n")
+    test_leader_election()
+    test_debounce_collects_late_photos()
+    test_max_wait()
+    test_late_photo_after_collection()
+    print("\n✅ Все тесты прошли успешно!")
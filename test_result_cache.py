@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Тест кэша результатов генерации
+Проверяет стабильность ключа и вытеснение давно не использованных записей (LRU)
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from app.services import result_cache
+
+def _reset(max_bytes: int):
+    """Пустой кэш во временном каталоге с лимитом max_bytes"""
+    result_cache.RESULT_CACHE_ENABLED = True
+    result_cache.RESULT_CACHE_DIR = tempfile.mkdtemp(prefix="babka_result_cache_test_")
+    result_cache.RESULT_CACHE_MAX_BYTES = max_bytes
+    result_cache._index = None
+    result_cache._total = 0
+    for name in result_cache._stats:
+        result_cache._stats[name] = 0
+
+def test_key_stability():
+    """Ключ не зависит от регистра/пробелов текста и порядка параметров, но зависит от входов"""
+    print("🔍 ТЕСТ: стабильность ключа")
+    photo, other = b"photo-bytes", b"other-bytes"
+    key = result_cache.make_key("transform", "model-a", [photo], "  Сделай  Фон ", {"type": "bg", "q": 1})
+
+    assert key == result_cache.make_key("transform", "model-a", [photo], "сделай фон", {"q": 1, "type": "bg"})
+    assert key != result_cache.make_key("transform", "model-a", [other], "сделай фон", {"type": "bg", "q": 1})
+    assert key != result_cache.make_key("transform", "model-b", [photo], "сделай фон", {"type": "bg", "q": 1})
+    assert key != result_cache.make_key("transform", "model-a", [photo], "сделай фон", {"type": "bg", "q": 2})
+    assert key != result_cache.make_key("tryon", "model-a", [photo], "сделай фон", {"type": "bg", "q": 1})
+    # Порядок фото важен: человек и одежда не взаимозаменяемы
+    assert (result_cache.make_key("tryon", "m", [photo, other])
+            != result_cache.make_key("tryon", "m", [other, photo]))
+    print("✅ ключ стабилен и различает входы")
+
+def test_lru_eviction():
+    """При переполнении вытесняется запись, к которой дольше всего не обращались"""
+    print("🔍 ТЕСТ: вытеснение LRU")
+    _reset(max_bytes=100)
+    result_cache.put("a" * 64, b"a" * 40)
+    result_cache.put("b" * 64, b"b" * 40)
+    assert result_cache.get("a" * 64) == b"a" * 40  # «a» становится свежей записью
+
+    result_cache.put("c" * 64, b"c" * 40)  # 120 байт > 100: уходит «b»
+    assert result_cache.get("b" * 64) is None
+    assert result_cache.get("a" * 64) == b"a" * 40
+    assert result_cache.get("c" * 64) == b"c" * 40
+    assert not os.path.exists(result_cache._path("b" * 64))
+
+    stats = result_cache.get_stats()
+    assert stats["evicted"] == 1 and stats["entries"] == 2 and stats["bytes"] == 80, stats
+    print(f"✅ вытеснена давно не использованная запись: {stats}")
+
+def test_index_restored_after_restart():
+    """После рестарта LRU-порядок восстанавливается по времени последнего обращения"""
+    print("🔍 ТЕСТ: восстановление индекса после рестарта")
+    _reset(max_bytes=100)
+    result_cache.put("a" * 64, b"a" * 40)
+    result_cache.put("b" * 64, b"b" * 40)
+    os.utime(result_cache._path("a" * 64), (1, 1))
+    os.utime(result_cache._path("b" * 64), (2, 2))
+
+    result_cache._index = None  # как после рестарта процесса
+    result_cache._total = 0
+    result_cache.put("c" * 64, b"c" * 40)
+    assert result_cache.get("a" * 64) is None
+    assert result_cache.get("b" * 64) == b"b" * 40
+    print("✅ после рестарта вытесняется самая старая по mtime запись")
+
+def test_force_fresh_and_oversized():
+    print("🔍 ТЕСТ: force_fresh и слишком большие результаты")
+    _reset(max_bytes=100)
+    result_cache.put("a" * 64, b"a" * 40)
+    assert result_cache.get("a" * 64, force_fresh=True) is None
+    result_cache.put("d" * 64, b"d" * 101)
+    assert result_cache.get("d" * 64) is None
+    assert result_cache.get("a" * 64) == b"a" * 40  # большая запись не вытеснила остальные
+    print("✅ force_fresh обходит кэш, результаты больше лимита не сохраняются")
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов кэша результатов\n")
+    test_key_stability()
+    test_lru_eviction()
+    test_index_restored_after_restart()
+    test_force_fresh_and_oversized()
+    print("\n✅ Все тесты прошли успешно!")
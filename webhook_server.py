@@ -3,13 +3,35 @@
 """
 
 import os
+import asyncio
 import logging
+import threading
 from flask import Flask, request, jsonify
 from app.services.yookassa_service import process_payment_webhook, process_successful_payment
 
 # Настройка логирования
 log = logging.getLogger("babka-bot")
 
+# Один event loop в фоновом потоке и одно Application на весь процесс: loop на каждый
+# update пересоздавал бы Application и пулы HTTP-соединений (GPT, Telegram) и терял их
+_telegram_lock = threading.Lock()
+_telegram_loop = None
+_telegram_app = None
+
+def _get_telegram_app():
+    """Event loop и инициализированное Application (создаются при первом update)"""
+    global _telegram_loop, _telegram_app
+    with _telegram_lock:
+        if _telegram_app is None:
+            from main import create_app
+
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="telegram-webhook", daemon=True).start()
+            telegram_app = create_app()
+            asyncio.run_coroutine_threadsafe(telegram_app.initialize(), loop).result()
+            _telegram_loop, _telegram_app = loop, telegram_app
+        return _telegram_loop, _telegram_app
+
 def create_combined_webhook_app():
     """
     Создает объединенное Flask приложение для обработки webhook'ов
@@ -39,14 +61,11 @@ def create_combined_webhook_app():
             
             log.info("WEBHOOK HIT: method=%s path=%s", request.method, request.path)
             
-            # Импортируем уже созданное приложение из main.py
-            from main import create_app
-            
             # Создаем объект Update из данных webhook
             from telegram import Update
             
-            # Создаем Application для обработки update
-            telegram_app = create_app()
+            # Общее Application, работающее в долгоживущем event loop
+            loop, telegram_app = _get_telegram_app()
             
             # Создаем объект Update
             update = Update.de_json(webhook_data, telegram_app.bot)
@@ -55,18 +74,8 @@ def create_combined_webhook_app():
                 log.warning("Failed to parse Telegram update")
                 return jsonify({"status": "error", "message": "Invalid update"}), 400
             
-            # Обрабатываем update через диспетчер
-            import asyncio
-            
-            # Создаем новый event loop для обработки update
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                # Инициализируем Application перед обработкой update
-                loop.run_until_complete(telegram_app.initialize())
-                loop.run_until_complete(telegram_app.process_update(update))
-            finally:
-                loop.close()
+            # Обрабатываем update через диспетчер в общем loop; поток Flask ждёт результата
+            asyncio.run_coroutine_threadsafe(telegram_app.process_update(update), loop).result()
             
             log.info("Telegram update processed successfully")
             return jsonify({"ok": True}), 200